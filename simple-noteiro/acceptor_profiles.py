@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Acceptor Profiles
+Pulse encodings of the bill acceptor's modes, tolerant note classification and the rejected-note audit log
+
+Acceptors can signal a note as 1 pulse per real or scaled (1 pulse per R$5,
+R$10, ...); scaled modes count large notes in a handful of pulses. A framed
+pulse count a few pulses short of a denomination is matched to it with a
+confidence score (never rounded up from an over-count); other counts are
+rejected and written to the audit log instead of being silently dropped,
+since the acceptor has already taken the customer's note.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from metrics import REGISTRO
+
+DENOMINACOES_BRL = (2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0)
+
+METRICA_CLASSIFICADAS = REGISTRO.contador("atm_notas_classificadas_total", "Notas classificadas por resultado",
+                                          ("canal", "perfil", "resultado"))
+METRICA_CONFIANCA = REGISTRO.histograma("atm_nota_confianca", "Confiança da classificação de cada nota",
+                                        ("perfil",), buckets=(0.25, 0.5, 0.75, 0.9, 0.99, 1.0))
+
+# valor: denomination (None if rejected), esperado: its pulse count, confianca: 0..1,
+# resultado: "exata", "aproximada" or "rejeitada", motivo: why it was rejected
+Classificacao = namedtuple("Classificacao", "valor esperado pulsos confianca resultado motivo")
+
+
+class PerfilNoteiro:
+    """One acceptor mode: its pulse encoding, classification tolerance and framing timing.
+
+    The encoding is either `valor_pulso` (every denomination that is a whole
+    number of pulses) or an explicit `pulsos` map {pulse count: value}.
+    `tolerancia` is the fraction of a denomination's pulse count that may be
+    missing (rounded down, so small counts must match exactly) and
+    `confianca_min` the lowest confidence still accepted. `timing` holds
+    CanalNota parameters that override the global framing settings
+    (scaled modes pulse few times, so their notes can close sooner).
+    """
+
+    def __init__(self, nome, valor_pulso=None, pulsos=None, denominacoes=DENOMINACOES_BRL,
+                 tolerancia=0.05, confianca_min=0.75, timing=None, descricao=""):
+        if (valor_pulso is None) == (pulsos is None):
+            raise ValueError(f"Perfil '{nome}': informe valor_pulso ou pulsos")
+        self.nome = nome
+        self.valor_pulso = valor_pulso
+        self.pulsos = pulsos
+        self.denominacoes = denominacoes
+        self.tolerancia = tolerancia
+        self.confianca_min = confianca_min
+        self.timing = dict(timing or {})
+        self.descricao = descricao
+
+    def mapa(self):
+        """Pulse count -> value (a new dict: channels may add their own entries)"""
+        if self.pulsos is not None:
+            return dict(self.pulsos)
+        mapa = {}
+        for valor in self.denominacoes:
+            pulsos = round(valor / self.valor_pulso)
+            if pulsos >= 1 and abs(pulsos * self.valor_pulso - valor) < 1e-6:
+                mapa[pulsos] = valor
+        return mapa
+
+
+def classificar(pulsos, mapa, tolerancia=0.05, confianca_min=0.75):
+    """Denomination for a pulse count, snapping only downward.
+
+    A short count (pulses lost on the line) is matched to the smallest
+    denomination above it if it is within `tolerancia` of that count; an
+    over-count is never rounded to a note, so line noise or a tampered
+    acceptor cannot pay out more than was inserted. Confidence falls
+    linearly from 1 (exact count) to 0 halfway down to the next lower
+    denomination, so the same one-pulse loss is trusted on a 100-pulse note
+    and rejected between 1 and 2 pulses.
+
+    Boundaries (python3 -m doctest acceptor_profiles.py):
+
+    >>> real = PERFIS["real"].mapa()
+    >>> def c(pulsos, mapa=real):
+    ...     r = classificar(pulsos, mapa)
+    ...     return r.valor, r.resultado, r.motivo
+    >>> c(100), c(95), c(94)
+    ((100.0, 'exata', None), (100.0, 'aproximada', None), (None, 'rejeitada', 'fora_da_tolerancia'))
+    >>> c(101), c(105), c(201)
+    ((None, 'rejeitada', 'acima_do_nominal'), (None, 'rejeitada', 'acima_do_nominal'), (None, 'rejeitada', 'acima_do_nominal'))
+    >>> c(49), c(48), c(47), c(51)
+    ((50.0, 'aproximada', None), (50.0, 'aproximada', None), (None, 'rejeitada', 'fora_da_tolerancia'), (None, 'rejeitada', 'acima_do_nominal'))
+    >>> c(48, {40: 40.0, 50: 50.0})
+    (None, 'rejeitada', 'confianca_baixa')
+    >>> dez = PERFIS["dez"].mapa()
+    >>> c(19, dez), c(20, dez), c(21, dez), c(4, dez), c(3, dez)
+    ((200.0, 'aproximada', None), (200.0, 'exata', None), (None, 'rejeitada', 'acima_do_nominal'), (None, 'rejeitada', 'fora_da_tolerancia'), (None, 'rejeitada', 'acima_do_nominal'))
+    >>> c(1, dez), c(0)
+    ((10.0, 'exata', None), (None, 'rejeitada', 'sem_pulsos'))
+    """
+    if not mapa or pulsos <= 0:
+        return Classificacao(None, None, pulsos, 0.0, "rejeitada", "sem_mapa" if not mapa else "sem_pulsos")
+    if pulsos in mapa:
+        return Classificacao(mapa[pulsos], pulsos, pulsos, 1.0, "exata", None)
+
+    contagens = sorted(mapa)
+    acima = [c for c in contagens if c > pulsos]
+    if not acima:
+        return Classificacao(None, contagens[-1], pulsos, 0.0, "rejeitada", "acima_do_nominal")
+    esperado = acima[0]
+    erro = esperado - pulsos
+    abaixo = [c for c in contagens if c < esperado]
+    meia_distancia = (esperado - (abaixo[-1] if abaixo else 0)) / 2
+    confianca = max(0.0, 1 - erro / meia_distancia)
+
+    if abaixo and pulsos - abaixo[-1] < erro:
+        motivo = "acima_do_nominal"  # Over-count of the note below: never paid as either
+    elif erro > int(esperado * tolerancia):
+        motivo = "fora_da_tolerancia"
+    elif confianca < confianca_min:
+        motivo = "confianca_baixa"
+    else:
+        return Classificacao(mapa[esperado], esperado, pulsos, round(confianca, 3), "aproximada", None)
+    return Classificacao(None, esperado, pulsos, round(confianca, 3), "rejeitada", motivo)
+
+
+def classificar_nota(pulsos, mapa, perfil, canal):
+    """classificar() with the profile's thresholds, counted in the metrics"""
+    resultado = classificar(pulsos, mapa, perfil.tolerancia, perfil.confianca_min)
+    METRICA_CLASSIFICADAS.inc(canal=canal, perfil=perfil.nome, resultado=resultado.resultado)
+    METRICA_CONFIANCA.observe(resultado.confianca, perfil=perfil.nome)
+    return resultado
+
+
+# Built-in acceptor modes (CANAIS "perfil" / PERFIL_NOTEIRO in atm-simple.py)
+PERFIS = {
+    "real": PerfilNoteiro("real", valor_pulso=1.0, descricao="1 pulso por real"),
+    "cinco": PerfilNoteiro("cinco", valor_pulso=5.0, descricao="1 pulso a cada R$ 5 (sem nota de R$ 2)",
+                           timing={"timeout_max": 0.8, "timeout_min": 0.15}),
+    "dez": PerfilNoteiro("dez", valor_pulso=10.0, descricao="1 pulso a cada R$ 10 (sem notas de R$ 2 e R$ 5)",
+                         timing={"timeout_max": 0.6, "timeout_min": 0.15}),
+}
+
+
+def obter_perfil(nome):
+    if nome not in PERFIS:
+        raise ValueError(f"Perfil de noteiro desconhecido: {nome} (disponíveis: {', '.join(PERFIS)})")
+    return PERFIS[nome]
+
+
+class AuditoriaNotas:
+    """Append-only, fsynced JSONL of notes that were rejected or only approximately matched.
+
+    Rejected notes are money the acceptor kept without a withdraw: the
+    operator settles them from this file ('rejeitadas' in the terminal).
+    registrar() only enqueues (it runs on the note worker, or on the event
+    loop under the asyncio runtime); a writer thread appends and fsyncs.
+    """
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self._lock = threading.Lock()
+        self._fila = queue.SimpleQueue()
+        self._thread = None
+        self.registradas = 0
+
+    def registrar(self, **campos):
+        """Enqueue an audit record (never blocks on disk)"""
+        with self._lock:
+            self.registradas += 1
+            if not self.arquivo:
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="auditoria-notas", daemon=True)
+                self._thread.start()
+        self._fila.put(dict(campos, ts=time.time()))
+
+    def stop(self):
+        """Write what is queued and stop the writer"""
+        if self._thread:
+            self._fila.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        while True:
+            lote = [self._fila.get()]
+            while True:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            registros = [r for r in lote if r is not None]
+            if registros:
+                with self._lock:
+                    try:
+                        fd = os.open(self.arquivo, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+                        with os.fdopen(fd, "a") as f:
+                            f.write("".join(json.dumps(r) + "\n" for r in registros))
+                            f.flush()
+                            os.fsync(f.fileno())
+                    except OSError as e:
+                        print(f"⚠️  Erro ao gravar auditoria de notas: {e}")
+            if None in lote:
+                return
+
+    def recentes(self, limite=20, resultado=None):
+        """Last `limite` records (optionally only one resultado), oldest first"""
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return []
+        registros = []
+        with self._lock:
+            with open(self.arquivo) as f:
+                for linha in f:
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    if resultado is None or registro.get("resultado") == resultado:
+                        registros.append(registro)
+        return registros[-limite:]
@@ -4,74 +4,346 @@ ATM Bitcoin Lightning - Frontend Web Simplista
 Recebe pulsos via POST e exibe status com QR code
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, abort
 import json
-import base64
-import io
-import qrcode
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 
+from asset_bundle import IMUTAVEL, REVALIDAR, AssetBundle
+from claim_watcher import ClaimWatcher
+from event_bus import BusServer, enviar_comando
+from metrics import REGISTRO, ler_metricas
+from qr_cache import QrCache
+from state_store import StateStore
+
 app = Flask(__name__)
 
-# Estado global da aplicação
-estado_atual = {
-    "status": "aguardando",  # aguardando, sucesso, processando
-    "pulsos": 0,
-    "valor_brl": 0.0,
-    "qr_code": None,
-    "timestamp": None,
-    "lnurl": None
-}
-
-def gerar_qr_base64(data):
-    """Gera QR code e retorna como base64 para exibir no HTML"""
+# Socket local onde o backend (atm-simple.py) publica eventos
+BUS_SOCKET = "atm-bus.sock"
+
+# Socket de métricas do backend (reexportadas em /metrics)
+METRICS_SOCKET = "atm-metrics.sock"
+
+# Socket de comandos do backend (confirmação da sessão, situação dos links, webhooks)
+CONTROLE_SOCKET = "atm-controle.sock"
+
+# Detecção de resgate: o QR sai da tela quando o saque é resgatado ou expira
+QR_EXPIRACAO = 180  # Segundos até um QR não resgatado liberar a tela (o link continua válido no LNbits)
+TEMPO_SUCESSO = 5  # Segundos na tela de saque concluído antes de voltar a aguardar
+INTERVALO_CONSULTA_RESGATE = 3.0  # Consulta ao backend para links cujo webhook não chegou
+
+# Bundle de assets gerado por asset_bundle.py (start-frontend.sh o gera antes de iniciar).
+# Sem ele a página é renderizada do template a cada acesso, como no desenvolvimento
+ASSETS_DIR = "dist"
+
+# Resgates de saques feitos com o LNbits fora do ar (token -> valor e, quando criado, a LNURL)
+RESGATES_ARQUIVO = "resgates.json"
+RESGATES_RETENCAO = 30 * 24 * 3600  # Resgates com link são esquecidos depois de 30 dias
+
+# Servidor de produção (waitress): um processo, várias threads compartilhando o estado.
+# Um único processo porque o bus, o stream de eventos e a detecção de resgate vivem nele.
+SERVIDOR_PRODUCAO = True  # False: servidor de desenvolvimento do Flask
+SERVIDOR_THREADS = 16  # Cada display conectado ao stream de eventos ocupa uma thread
+
+def estado_inicial():
+    return {
+        "status": "aguardando",  # aguardando, sucesso, sessao, qr_gerado, processando, resgatado
+        "pulsos": 0,
+        "valor_brl": 0.0,
+        "qr_code": None,
+        "timestamp": None,
+        "lnurl": None,
+        "canal": None,  # Noteiro de origem (quiosques com mais de um noteiro)
+        "sessao": None,  # Sessão aberta no modo sessão: notas, sats provisórios, expira_em
+        "resgate": None,  # Token do resgate quando o QR exibido é a página de resgate (LNbits fora do ar)
+        "withdraw_id": None  # Link exibido, acompanhado até ser resgatado ou expirar
+    }
+
+# Estado da aplicação: toda mudança é uma transição versionada, publicada aos displays
+estado = StateStore(estado_inicial())
+
+# Canal de eventos (Server-Sent Events) para os displays
+HEARTBEAT_SSE = 15  # Segundos entre comentários keep-alive
+# Cada stream prende uma thread do servidor: acima deste limite o display recebe 503 e usa polling,
+# deixando threads livres para /api/status, /qr e /api/confirmar
+SSE_MAX_ASSINANTES = SERVIDOR_THREADS - 4
+
+# Métricas do frontend
+METRICA_EVENTOS = REGISTRO.contador("atm_frontend_eventos_total", "Eventos recebidos do backend",
+                                    ("tipo", "via"))
+METRICA_STATUS = REGISTRO.contador("atm_frontend_status_total", "Consultas a /api/status", ("resposta",))
+REGISTRO.funcao("atm_frontend_assinantes_sse", "Displays conectados ao stream de eventos",
+                lambda: estado.assinantes())
+METRICA_SSE_RECUSADOS = REGISTRO.contador("atm_frontend_sse_recusados_total",
+                                          "Conexões ao stream de eventos recusadas pelo limite de assinantes")
+REGISTRO.funcao("atm_frontend_versao_estado", "Transições de estado publicadas",
+                lambda: estado.versao, tipo="counter")
+
+def formatar_sse(versao, tipo, dados):
+    """Formata um evento no protocolo text/event-stream"""
+    return f"id: {versao}\nevent: {tipo}\ndata: {dados}\n\n"
+
+# QR codes codificados uma vez e servidos em /qr/<id>.<formato>
+qr_cache = QrCache()
+REGISTRO.funcao("atm_frontend_qr_codificacoes_total", "LNURLs codificadas no frontend",
+                lambda: qr_cache.codificacoes, tipo="counter")
+
+def registrar_qr(lnurl, matriz=None):
+    """Registra o QR no cache (reaproveitando a matriz do backend) e retorna sua URL"""
+    if matriz:
+        qr = qr_cache.importar(lnurl, matriz)
+    else:
+        qr = qr_cache.obter(lnurl)
+    return f"/qr/{qr.id}.svg"
+
+resgates = {}
+resgates_lock = threading.Lock()
+
+def carregar_resgates():
+    """Lê os resgates salvos (sobrevivem a reinícios do frontend)"""
+    if not os.path.exists(RESGATES_ARQUIVO):
+        return
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Converter para base64
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-        return f"data:image/png;base64,{qr_base64}"
-        
-    except Exception as e:
-        print(f"Erro ao gerar QR code: {e}")
-        return None
+        with open(RESGATES_ARQUIVO) as f:
+            resgates.update(json.load(f))
+        print(f"💾 {len(resgates)} resgates carregados")
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Erro ao carregar resgates: {e}")
+
+def salvar_resgates():
+    """Grava os resgates (chamado com resgates_lock; o arquivo dá acesso aos saques)"""
+    limite = time.time() - RESGATES_RETENCAO
+    for token in [t for t, r in resgates.items() if r.get("lnurl") and r.get("pronto_em", 0) < limite]:
+        del resgates[token]
+    tmp = f"{RESGATES_ARQUIVO}.tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(resgates, f)
+        os.replace(tmp, RESGATES_ARQUIVO)
+    except OSError as e:
+        print(f"⚠️  Erro ao salvar resgates: {e}")
+
+# Página e assets servidos da memória, já comprimidos (vazio se o bundle não foi gerado)
+bundle = AssetBundle(ASSETS_DIR)
+
+def servir_bundle(relativo, cache_control):
+    """Arquivo do bundle na melhor compressão aceita pelo navegador; 304 se o ETag não mudou"""
+    arquivo = bundle.obter(relativo, request.headers.get("Accept-Encoding", ""))
+    if arquivo is None:
+        abort(404)
+    corpo, codificacao, tipo, etag = arquivo
+    cabecalhos = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=cabecalhos)
+    if codificacao:
+        cabecalhos["Content-Encoding"] = codificacao
+    return Response(corpo, mimetype=tipo, headers=cabecalhos)
 
 @app.route('/')
 def index():
     """Página principal"""
-    return render_template('index.html', estado=estado_atual)
+    if bundle:
+        return servir_bundle("index.html", REVALIDAR)
+    return render_template('index.html', estado=estado.obter())
+
+@app.route('/assets/<path:nome>')
+def servir_asset(nome):
+    """CSS, JS e imagens do bundle (o nome tem o hash do conteúdo: imutáveis)"""
+    return servir_bundle(nome, IMUTAVEL)
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker do bundle (escopo /: precisa ser servido da raiz)"""
+    return servir_bundle("sw.js", REVALIDAR)
+
+def aplicar_pulsos(data):
+    """Atualiza o estado com uma nota detectada (via HTTP ou bus)"""
+    pulsos = data.get("pulsos", 0)
+    valor_brl = data.get("valor_brl", 0.0)
+    estado.transicao("nota", {
+        "status": "sucesso",
+        "pulsos": pulsos,
+        "valor_brl": valor_brl,
+        "timestamp": data.get("timestamp"),
+        "qr_code": None,  # Reset QR code
+        "lnurl": None,
+        "canal": data.get("canal"),
+        "resgate": None,
+        "withdraw_id": None
+    })
+    
+    print(f"✅ Pulsos recebidos: {pulsos} (R$ {valor_brl:.2f})")
+
+def aplicar_qrcode(data):
+    """Atualiza o estado com o QR code de saque (via HTTP ou bus); False se faltar a LNURL"""
+    lnurl = data.get("lnurl")
+    valor_brl = data.get("valor_brl", estado.obter("valor_brl"))
+    
+    if not lnurl:
+        return False
+    
+    # Registrar QR code (a imagem é servida pelo endpoint /qr)
+    qr_url = registrar_qr(lnurl, data.get("qr_matriz"))
+    
+    # LNbits fora do ar: o QR é a página de resgate, o link chega depois (evento 'resgate')
+    token = data.get("resgate")
+    if token:
+        with resgates_lock:
+            resgates.setdefault(token, {"valor_brl": valor_brl, "amount_sats": data.get("amount_sats"),
+                                        "lnurl": None, "criado_em": time.time()})
+            salvar_resgates()
+    
+    mudancas = {
+        "status": "qr_gerado",
+        "qr_code": qr_url,
+        "lnurl": lnurl,
+        "valor_brl": valor_brl,
+        "resgate": token,
+        "withdraw_id": data.get("withdraw_id") or token
+    }
+    if "canal" in data:
+        mudancas["canal"] = data["canal"]
+    estado.transicao("qrcode", mudancas)
+    
+    print(f"✅ QR Code gerado para R$ {valor_brl:.2f}{f' (resgate {token})' if token else ''}")
+    return True
+
+def aplicar_resgate(data):
+    """Link criado para um resgate pendente; False se faltar o token ou a LNURL"""
+    token = data.get("token")
+    lnurl = data.get("lnurl")
+    if not token or not lnurl:
+        return False
+    
+    with resgates_lock:
+        resgate = resgates.setdefault(token, {"criado_em": time.time()})
+        resgate.update(lnurl=lnurl, withdraw_id=data.get("withdraw_id"),
+                       valor_brl=data.get("valor_brl", resgate.get("valor_brl")),
+                       amount_sats=data.get("amount_sats", resgate.get("amount_sats")), pronto_em=time.time())
+        salvar_resgates()
+    
+    # Cliente ainda diante do quiosque: troca o QR de resgate pelo link de saque
+    estado.transicao("resgate", {
+        "qr_code": registrar_qr(lnurl),
+        "lnurl": lnurl,
+        "resgate": None,
+        "withdraw_id": data.get("withdraw_id")
+    }, se=lambda atual: atual["status"] == "qr_gerado" and atual["resgate"] == token)
+    
+    print(f"✅ Resgate {token} liberado (R$ {resgate.get('valor_brl') or 0:.2f})")
+    return True
+
+def aplicar_sessao(data):
+    """Atualiza o estado com a sessão aberta (total acumulado e cotação provisória)"""
+    total = data.get("total", 0.0)
+    notas = data.get("notas", 0)
+    estado.transicao("sessao", {
+        "status": "sessao",
+        "valor_brl": total,
+        "timestamp": data.get("timestamp"),
+        "qr_code": None,
+        "lnurl": None,
+        "canal": data.get("canal"),
+        "withdraw_id": None,
+        "sessao": {
+            "id": data.get("id"),
+            "notas": notas,
+            "sats": data.get("sats"),
+            "expira_em": data.get("expira_em")
+        }
+    })
+    
+    print(f"🧾 Sessão: R$ {total:.2f} em {notas} nota(s)")
+
+def acompanhar_link(anterior, novo):
+    """Acompanha o link exibido (chamado pelo estado a cada transição, com o lock do estado)"""
+    if anterior["withdraw_id"] == novo["withdraw_id"]:
+        return
+    if anterior["withdraw_id"]:
+        resgates_watcher.esquecer(anterior["withdraw_id"])  # Saiu da tela sem resgate: continua válido no LNbits
+    if novo["withdraw_id"]:
+        resgates_watcher.observar(novo["withdraw_id"], QR_EXPIRACAO)
+
+def consultar_links(ids):
+    """Situação dos links pelo backend (que tem as credenciais do provedor Lightning)"""
+    resposta = enviar_comando(CONTROLE_SOCKET, "status_links", {"ids": ids}, timeout=20.0)
+    if not resposta.get("success"):
+        raise ValueError(resposta.get("error", "Consulta recusada"))
+    return resposta["status"]
+
+def avisar_backend(evento, withdraw_id):
+    """Registra no log do backend o desfecho do link (melhor esforço)"""
+    try:
+        enviar_comando(CONTROLE_SOCKET, "link", {"evento": evento, "withdraw_id": withdraw_id})
+    except (OSError, ValueError):
+        pass
+
+def marcar_resgate_concluido(withdraw_id):
+    """Página de resgate passa a mostrar o saque como concluído"""
+    with resgates_lock:
+        for resgate in resgates.values():
+            if resgate.get("withdraw_id") == withdraw_id and not resgate.get("resgatado"):
+                resgate["resgatado"] = time.time()
+                salvar_resgates()
+                return True
+    return False
+
+def link_resgatado(withdraw_id):
+    """Saque resgatado: tela de sucesso e, depois de TEMPO_SUCESSO, volta a aguardar"""
+    marcar_resgate_concluido(withdraw_id)
+    avisar_backend("resgatado", withdraw_id)
+    if estado.transicao("resgatado", {"status": "resgatado", "qr_code": None, "lnurl": None},
+                        se=lambda atual: atual["withdraw_id"] == withdraw_id) is None:
+        return
+    print(f"✅ Saque resgatado: {withdraw_id}")
+    
+    threading.Timer(TEMPO_SUCESSO, voltar_a_aguardar, args=(withdraw_id, "resgatado")).start()
+
+def link_expirado(withdraw_id):
+    """QR não resgatado a tempo: libera a tela para o próximo cliente"""
+    avisar_backend("expirado", withdraw_id)
+    print(f"⌛ QR expirou sem resgate: {withdraw_id}")
+    voltar_a_aguardar(withdraw_id, "qr_gerado")
+
+def voltar_a_aguardar(withdraw_id, status):
+    """Volta a aguardar se a tela ainda mostra esse link nesse status (senão outra nota ou QR já ocupou a tela)"""
+    estado.substituir("reset", estado_inicial(),
+                      se=lambda atual: atual["withdraw_id"] == withdraw_id and atual["status"] == status)
+
+resgates_watcher = ClaimWatcher(consultar_links, on_resgate=link_resgatado, on_expirado=link_expirado,
+                                intervalo=INTERVALO_CONSULTA_RESGATE)
+REGISTRO.funcao("atm_frontend_links_observados", "QRs na tela aguardando resgate",
+                lambda: resgates_watcher.observados())
+REGISTRO.funcao("atm_frontend_links_resgatados_total", "Saques resgatados com o QR na tela",
+                lambda: resgates_watcher.resgatados, tipo="counter")
+REGISTRO.funcao("atm_frontend_links_expirados_total", "QRs que expiraram sem resgate",
+                lambda: resgates_watcher.expirados, tipo="counter")
+estado.ao_mudar = acompanhar_link
+
+def tratar_evento_bus(tipo, dados):
+    """Aplica um evento recebido do backend pelo socket local"""
+    METRICA_EVENTOS.inc(tipo=tipo, via="bus")
+    if tipo == "pulsos":
+        aplicar_pulsos(dados)
+    elif tipo == "qrcode":
+        aplicar_qrcode(dados)
+    elif tipo == "sessao":
+        aplicar_sessao(dados)
+    elif tipo == "resgate":
+        aplicar_resgate(dados)
+    else:
+        print(f"⚠️  Evento desconhecido no bus: {tipo}")
 
 @app.route('/api/pulsos', methods=['POST'])
 def receber_pulsos():
     """Endpoint para receber pulsos do ATM"""
-    global estado_atual
-    
     try:
-        data = request.get_json()
-        
-        # Atualizar estado
-        estado_atual["status"] = "sucesso"
-        estado_atual["pulsos"] = data.get("pulsos", 0)
-        estado_atual["valor_brl"] = data.get("valor_brl", 0.0)
-        estado_atual["timestamp"] = data.get("timestamp")
-        estado_atual["qr_code"] = None  # Reset QR code
-        estado_atual["lnurl"] = None
-        
-        print(f"✅ Pulsos recebidos: {estado_atual['pulsos']} (R$ {estado_atual['valor_brl']:.2f})")
-        
+        METRICA_EVENTOS.inc(tipo="pulsos", via="http")
+        aplicar_pulsos(request.get_json())
         return jsonify({"success": True, "message": "Pulsos recebidos"})
         
     except Exception as e:
@@ -81,25 +353,9 @@ def receber_pulsos():
 @app.route('/api/qrcode', methods=['POST'])
 def receber_qrcode():
     """Endpoint para receber QR code de saque"""
-    global estado_atual
-    
     try:
-        data = request.get_json()
-        
-        lnurl = data.get("lnurl")
-        valor_brl = data.get("valor_brl", estado_atual["valor_brl"])
-        
-        if lnurl:
-            # Gerar QR code
-            qr_base64 = gerar_qr_base64(lnurl)
-            
-            estado_atual["qr_code"] = qr_base64
-            estado_atual["lnurl"] = lnurl
-            estado_atual["valor_brl"] = valor_brl
-            estado_atual["status"] = "qr_gerado"
-            
-            print(f"✅ QR Code gerado para R$ {valor_brl:.2f}")
-            
+        METRICA_EVENTOS.inc(tipo="qrcode", via="http")
+        if aplicar_qrcode(request.get_json()):
             return jsonify({"success": True, "message": "QR code gerado"})
         else:
             return jsonify({"success": False, "error": "LNURL não fornecida"}), 400
@@ -108,31 +364,200 @@ def receber_qrcode():
         print(f"❌ Erro ao processar QR code: {e}")
         return jsonify({"success": False, "error": str(e)}), 400
 
+@app.route('/api/sessao', methods=['POST'])
+def receber_sessao():
+    """Endpoint para receber a sessão aberta (transporte HTTP)"""
+    try:
+        METRICA_EVENTOS.inc(tipo="sessao", via="http")
+        aplicar_sessao(request.get_json())
+        return jsonify({"success": True, "message": "Sessão atualizada"})
+        
+    except Exception as e:
+        print(f"❌ Erro ao processar sessão: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@app.route('/api/resgate', methods=['POST'])
+def receber_resgate():
+    """Endpoint para receber o link de um resgate pendente (transporte HTTP)"""
+    try:
+        METRICA_EVENTOS.inc(tipo="resgate", via="http")
+        if aplicar_resgate(request.get_json()):
+            return jsonify({"success": True, "message": "Resgate liberado"})
+        else:
+            return jsonify({"success": False, "error": "Token ou LNURL não fornecidos"}), 400
+            
+    except Exception as e:
+        print(f"❌ Erro ao processar resgate: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@app.route('/api/resgate/<token>')
+def consultar_resgate(token):
+    """Situação de um resgate: pendente (sem lnurl) ou pronto"""
+    with resgates_lock:
+        resgate = resgates.get(token.upper())
+        resgate = dict(resgate) if resgate else None
+    if resgate is None:
+        return jsonify({"success": False, "error": "Resgate não encontrado"}), 404
+    return jsonify(dict(resgate, token=token.upper(), pronto=bool(resgate.get("lnurl"))))
+
+@app.route('/resgate/<token>')
+def pagina_resgate(token):
+    """Página aberta pelo QR de resgate: aguarda o link e então mostra o QR de saque"""
+    token = token.upper()
+    with resgates_lock:
+        resgate = resgates.get(token)
+        resgate = dict(resgate) if resgate else None
+    if resgate is None:
+        abort(404)
+    qr_url = registrar_qr(resgate["lnurl"]) if resgate.get("lnurl") else None
+    return render_template('resgate.html', token=token, resgate=resgate, qr_code=qr_url)
+
+@app.route('/api/webhook/lightning', methods=['POST'])
+def webhook_lightning():
+    """Webhook de saque pago do provedor Lightning (LNbits: webhook_url do link)"""
+    METRICA_EVENTOS.inc(tipo="webhook", via="http")
+    try:
+        resposta = enviar_comando(CONTROLE_SOCKET, "webhook", {
+            "corpo": request.get_json(silent=True),
+            "cabecalhos": {"X-ATM-Token": request.headers.get("X-ATM-Token")}
+        })
+    except (OSError, ValueError) as e:
+        # Sem o backend não dá para validar; a consulta periódica detecta o resgate depois
+        print(f"⚠️  Backend indisponível para webhook: {e}")
+        return jsonify({"success": False, "error": "Backend indisponível"}), 503
+    
+    if not resposta.get("success"):
+        return jsonify({"success": False, "error": "Webhook não reconhecido"}), 403
+    
+    withdraw_id = resposta["withdraw_id"]
+    if not resgates_watcher.resgatado(withdraw_id):
+        marcar_resgate_concluido(withdraw_id)  # Link de página de resgate, ou QR que já saiu da tela
+    return jsonify({"success": True})
+
+@app.route('/api/confirmar', methods=['POST'])
+def confirmar():
+    """Cliente confirmou: o backend fecha a sessão e gera um único saque"""
+    dados = request.get_json(silent=True) or {}
+    try:
+        resposta = enviar_comando(CONTROLE_SOCKET, "confirmar", {"canal": dados.get("canal")})
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Backend indisponível para confirmar sessão: {e}")
+        return jsonify({"success": False, "error": "Backend indisponível"}), 503
+    
+    if resposta.get("success"):
+        estado.transicao("confirmacao", {"status": "processando"})
+    return jsonify(resposta), 200 if resposta.get("success") else 409
+
 @app.route('/api/reset', methods=['POST'])
 def reset():
     """Reset do estado da aplicação"""
-    global estado_atual
-    
-    estado_atual = {
-        "status": "aguardando",
-        "pulsos": 0,
-        "valor_brl": 0.0,
-        "qr_code": None,
-        "timestamp": None,
-        "lnurl": None
-    }
+    estado.substituir("reset", estado_inicial())
     
     print("🔄 Estado resetado")
     return jsonify({"success": True, "message": "Estado resetado"})
 
 @app.route('/api/status')
 def get_status():
-    """Endpoint para obter status atual (para polling do frontend)"""
-    return jsonify(estado_atual)
+    """Endpoint para obter status atual (para polling do frontend); 304 se a versão não mudou"""
+    etag, corpo = estado.corpo()
+    cabecalhos = {"ETag": etag, "Cache-Control": "no-cache"}  # Navegador revalida a cada consulta
+    if etag in request.headers.get("If-None-Match", ""):
+        METRICA_STATUS.inc(resposta="304")
+        return Response(status=304, headers=cabecalhos)
+    METRICA_STATUS.inc(resposta="200")
+    return Response(corpo, mimetype="application/json", headers=cabecalhos)
+
+@app.route('/metrics')
+def metricas():
+    """Métricas do frontend e do backend no formato de texto do Prometheus"""
+    texto = REGISTRO.exportar()
+    try:
+        texto += ler_metricas(METRICS_SOCKET)
+        backend_up = 1
+    except OSError:
+        backend_up = 0  # Backend parado: só as métricas do frontend
+    
+    texto += ("# HELP atm_backend_up Socket de métricas do backend respondeu\n"
+              "# TYPE atm_backend_up gauge\n"
+              f"atm_backend_up {backend_up}\n")
+    return Response(texto, mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/qr/<qr_id>.<formato>')
+def servir_qr(qr_id, formato):
+    """Imagem do QR code (imutável: o id é o hash da LNURL)"""
+    qr = qr_cache.por_id(qr_id)
+    if qr is None or formato not in ("svg", "png"):
+        abort(404)
+    
+    cabecalhos = {
+        "ETag": qr.etag(formato),
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    if qr.etag(formato) in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=cabecalhos)
+    
+    if formato == "svg":
+        return Response(qr.svg(), mimetype="image/svg+xml", headers=cabecalhos)
+    return Response(qr.png(), mimetype="image/png", headers=cabecalhos)
+
+@app.route('/api/eventos')
+def eventos():
+    """Stream de eventos: estado completo ao conectar, depois apenas transições"""
+    assinatura = estado.assinar(limite=SSE_MAX_ASSINANTES)
+    if assinatura is None:
+        METRICA_SSE_RECUSADOS.inc()
+        return (jsonify({"success": False, "error": "Limite de displays conectados atingido"}), 503,
+                {"Retry-After": str(HEARTBEAT_SSE)})
+    fila, versao, dados = assinatura
+    inicial = formatar_sse(versao, "estado", dados)
+    
+    def stream():
+        try:
+            yield inicial
+            while True:
+                try:
+                    versao, tipo, dados = fila.get(timeout=HEARTBEAT_SSE)
+                    yield formatar_sse(versao, tipo, dados)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            estado.cancelar(fila)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+def servir(host='0.0.0.0', port=3005):
+    """Serve com waitress (produção) ou, sem ele instalado, com o servidor de desenvolvimento do Flask"""
+    if SERVIDOR_PRODUCAO:
+        try:
+            from waitress import serve
+        except ImportError:
+            print("⚠️  waitress não instalado (pip install waitress): usando o servidor de desenvolvimento")
+        else:
+            print(f"🏭 Servidor de produção: waitress com {SERVIDOR_THREADS} threads")
+            serve(app, host=host, port=port, threads=SERVIDOR_THREADS, ident="atm-frontend")
+            return
+    app.run(host=host, port=port, debug=False, threaded=True)
 
 if __name__ == '__main__':
     print("🚀 Iniciando frontend ATM Bitcoin Lightning...")
     print("📱 Acesse: http://localhost:3005")
     print("🔗 API disponível em: http://localhost:3005/api/pulsos")
+    print("📡 Eventos em: http://localhost:3005/api/eventos")
+    print("📈 Métricas em: http://localhost:3005/metrics")
+    
+    carregar_resgates()
+    resgates_watcher.start()
+    if bundle:
+        print(f"📦 Bundle de assets {bundle.versao}: {len(bundle)} arquivos em memória")
+    else:
+        print(f"⚠️  Bundle de assets não encontrado em {ASSETS_DIR}/ (python3 asset_bundle.py): usando o template")
+    
+    # Receber eventos do backend pelo socket local (sem HTTP)
+    bus = BusServer(BUS_SOCKET, tratar_evento_bus)
+    bus.start()
+    print(f"🔌 Bus local em: {BUS_SOCKET}")
     
-    app.run(host='0.0.0.0', port=3005, debug=False)
\ No newline at end of file
+    servir()
\ No newline at end of file
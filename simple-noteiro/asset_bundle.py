@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Kiosk Asset Bundle
+Builds the display page into fingerprinted, minified, precompressed assets and serves them from memory
+
+Build (start-frontend.sh runs it before app.py):
+  python3 asset_bundle.py                  # templates/ + static/ -> dist/
+
+Output in dist/:
+  index.html                  shell page; inline CSS/JS moved out, /static/ URLs rewritten
+  sw.js                       service worker: serves the shell from cache while the frontend restarts
+  app.<hash>.css, app.<hash>.js, <nome>.<hash>.<ext>
+                              immutable assets, served under /assets/
+  *.gz, *.br                  precompressed variants (.br only with the 'brotli' package)
+  manifest.json               original path -> fingerprinted URL
+Files with identical content are emitted once, whatever their path.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+try:
+    import brotli  # Optional: .br variants (~15% smaller than gzip for text)
+except ImportError:
+    brotli = None
+
+PREFIXO_URL = "/assets/"
+IMUTAVEL = "public, max-age=31536000, immutable"
+REVALIDAR = "no-cache"  # Shell and service worker: revalidated on every load (304 when unchanged)
+COMPRIMIR = (".html", ".css", ".js", ".svg", ".json")
+
+_TEXTO = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+
+
+def impressao(dados):
+    """Content fingerprint used in file names and ETags"""
+    return hashlib.sha256(dados).hexdigest()[:10]
+
+
+def minificar_css(css):
+    """Drop comments and redundant whitespace (quoted strings, e.g. data: URIs, are left alone)"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    partes = _TEXTO.split(css)
+    for i in range(0, len(partes), 2):  # Even indexes are outside quotes
+        trecho = re.sub(r"\s+", " ", partes[i])
+        trecho = re.sub(r"\s*([{};,>])\s*", r"\1", trecho)
+        partes[i] = re.sub(r":\s+", ":", trecho)
+    return "".join(partes).replace(";}", "}").strip()
+
+
+def minificar_js(js):
+    """Strip indentation, blank lines and whole-line // comments, never inside a template literal"""
+    linhas = []
+    em_template = False
+    for linha in js.splitlines():
+        if em_template:
+            linhas.append(linha)
+        else:
+            limpa = linha.strip()
+            if limpa and not limpa.startswith("//"):
+                linhas.append(limpa)
+        em_template ^= len(re.findall(r"(?<!\\)`", linha)) % 2 == 1
+    return "\n".join(linhas)
+
+
+def minificar_html(html):
+    """Strip indentation and blank lines (newlines are kept: they are whitespace to the browser)"""
+    return "\n".join(linha.strip() for linha in html.splitlines() if linha.strip())
+
+
+def minificar_svg(svg):
+    svg = re.sub(r"<!--.*?-->", "", svg, flags=re.S)
+    return re.sub(r">\s+<", "><", svg).strip()
+
+
+class _Saida:
+    """Files written to the bundle directory, deduplicated by content"""
+
+    def __init__(self, destino):
+        self.destino = destino
+        self.por_hash = {}  # fingerprint -> URL of the file already emitted
+
+    def gravar(self, relativo, dados):
+        caminho = os.path.join(self.destino, relativo)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, "wb") as f:
+            f.write(dados)
+        if relativo.endswith(COMPRIMIR):
+            # mtime=0: identical input gives byte-identical .gz (stable builds)
+            with open(caminho + ".gz", "wb") as f:
+                f.write(gzip.compress(dados, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(caminho + ".br", "wb") as f:
+                    f.write(brotli.compress(dados, quality=11))
+
+    def fingerprint(self, relativo, dados):
+        """Write under a content-hashed name; returns its URL"""
+        h = impressao(dados)
+        if h not in self.por_hash:
+            base, ext = os.path.splitext(relativo)
+            self.gravar(f"{base}.{h}{ext}", dados)
+            self.por_hash[h] = f"{PREFIXO_URL}{base}.{h}{ext}"
+        return self.por_hash[h]
+
+
+def _service_worker(versao, precache):
+    return f"""// Gerado por asset_bundle.py - não editar
+const VERSAO = 'atm-{versao}';
+const PRECACHE = {json.dumps(precache)};
+
+self.addEventListener('install', e => {{
+    e.waitUntil(caches.open(VERSAO).then(c => c.addAll(PRECACHE)).then(() => self.skipWaiting()));
+}});
+
+self.addEventListener('activate', e => {{
+    e.waitUntil(caches.keys()
+        .then(nomes => Promise.all(nomes.filter(n => n !== VERSAO).map(n => caches.delete(n))))
+        .then(() => self.clients.claim()));
+}});
+
+self.addEventListener('fetch', e => {{
+    const url = new URL(e.request.url);
+    if (e.request.method !== 'GET' || url.origin !== location.origin) return;
+
+    // Assets imutáveis: cache primeiro
+    if (url.pathname.startsWith('{PREFIXO_URL}')) {{
+        e.respondWith(caches.match(e.request).then(r => r || fetch(e.request)));
+        return;
+    }}
+
+    // Página: exibida do cache na hora e atualizada em segundo plano (frontend reiniciando não deixa a tela em branco)
+    if (url.pathname === '/') {{
+        const rede = fetch(e.request).then(r => {{
+            if (r.ok) {{
+                const copia = r.clone();
+                caches.open(VERSAO).then(c => c.put('/', copia));
+            }}
+            return r;
+        }});
+        e.respondWith(caches.match('/').then(r => r || rede));
+        e.waitUntil(rede.catch(() => null));
+    }}
+    // /api, /qr e /resgate sempre pela rede
+}});
+"""
+
+
+def construir(origem=".", destino="dist"):
+    """Build the bundle from templates/index.html and static/; returns the manifest"""
+    temporario = destino.rstrip("/") + ".tmp"
+    shutil.rmtree(temporario, ignore_errors=True)
+    saida = _Saida(temporario)
+    mapa = {}  # /static/ URL -> fingerprinted URL
+    inline = []  # URLs of the CSS/JS pulled out of the page
+
+    # Static files first, so the page can point at their fingerprinted URLs
+    pasta_static = os.path.join(origem, "static")
+    for raiz, _, nomes in os.walk(pasta_static):
+        for nome in sorted(nomes):
+            caminho = os.path.join(raiz, nome)
+            relativo = os.path.relpath(caminho, pasta_static).replace(os.sep, "/")
+            with open(caminho, "rb") as f:
+                dados = f.read()
+            if nome.endswith(".svg"):
+                dados = minificar_svg(dados.decode("utf-8")).encode("utf-8")
+            mapa[f"/static/{relativo}"] = saida.fingerprint(relativo, dados)
+
+    with open(os.path.join(origem, "templates", "index.html"), encoding="utf-8") as f:
+        html = f.read()
+
+    # Inline <style> and <script> become fingerprinted files
+    def extrair_css(m):
+        url = saida.fingerprint("app.css", minificar_css(m.group(1)).encode("utf-8"))
+        inline.append(url)
+        return f'<link rel="stylesheet" href="{url}">'
+
+    def extrair_js(m):
+        url = saida.fingerprint("app.js", minificar_js(m.group(1)).encode("utf-8"))
+        inline.append(url)
+        return f'<script src="{url}"></script>'
+
+    html = re.sub(r"<style>(.*?)</style>", extrair_css, html, flags=re.S)
+    html = re.sub(r"<script>(.*?)</script>", extrair_js, html, flags=re.S)
+    for original in sorted(mapa, key=len, reverse=True):
+        html = html.replace(original, mapa[original])
+
+    # Service worker (needs a secure context: http://localhost on the kiosk qualifies)
+    registro = ("<script>if ('serviceWorker' in navigator) "
+                "navigator.serviceWorker.register('/sw.js');</script>")
+    html = minificar_html(html.replace("</body>", registro + "\n</body>"))
+    saida.gravar("index.html", html.encode("utf-8"))
+
+    versao = impressao("".join(sorted(saida.por_hash)).encode() + html.encode("utf-8"))
+    precache = ["/"] + inline + sorted(set(mapa.values()))
+    saida.gravar("sw.js", _service_worker(versao, precache).encode("utf-8"))
+
+    manifesto = {"versao": versao, "inline": inline, "arquivos": mapa}
+    saida.gravar("manifest.json", json.dumps(manifesto, indent=2).encode("utf-8"))
+
+    # Swap the new bundle in (a running frontend keeps the copy it loaded)
+    antigo = destino.rstrip("/") + ".old"
+    shutil.rmtree(antigo, ignore_errors=True)
+    if os.path.exists(destino):
+        os.rename(destino, antigo)
+    os.rename(temporario, destino)
+    shutil.rmtree(antigo, ignore_errors=True)
+    return manifesto
+
+
+class AssetBundle:
+    """Built bundle held in memory: every file with its precompressed variants, ETag and type"""
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        self._arquivos = {}  # relative path -> {"": bytes, "gzip": bytes, "br": bytes, "tipo": ..., "etag": ...}
+        self.versao = None
+        self._carregar()
+
+    def __bool__(self):
+        return bool(self._arquivos)
+
+    def __len__(self):
+        return len(self._arquivos)
+
+    def obter(self, relativo, aceita=""):
+        """(body, content-encoding or None, mimetype, etag) for the best variant the client accepts; None if absent"""
+        arquivo = self._arquivos.get(relativo)
+        if arquivo is None:
+            return None
+        codificacoes = {c.split(";")[0].strip() for c in aceita.split(",")}
+        for codificacao in ("br", "gzip"):
+            if codificacao in arquivo and codificacao in codificacoes:
+                return arquivo[codificacao], codificacao, arquivo["tipo"], arquivo["etag"]
+        return arquivo[""], None, arquivo["tipo"], arquivo["etag"]
+
+    def _carregar(self):
+        caminho_manifesto = os.path.join(self.diretorio, "manifest.json")
+        if not os.path.exists(caminho_manifesto):
+            return
+        try:
+            with open(caminho_manifesto) as f:
+                self.versao = json.load(f)["versao"]
+            for raiz, _, nomes in os.walk(self.diretorio):
+                for nome in nomes:
+                    if nome.endswith((".gz", ".br")) or nome == "manifest.json":
+                        continue
+                    caminho = os.path.join(raiz, nome)
+                    relativo = os.path.relpath(caminho, self.diretorio).replace(os.sep, "/")
+                    with open(caminho, "rb") as f:
+                        dados = f.read()
+                    arquivo = {
+                        "": dados,
+                        "tipo": mimetypes.guess_type(nome)[0] or "application/octet-stream",
+                        "etag": f'W/"{impressao(dados)}"'  # Weak: shared by the compressed variants
+                    }
+                    for extensao, codificacao in ((".gz", "gzip"), (".br", "br")):
+                        if os.path.exists(caminho + extensao):
+                            with open(caminho + extensao, "rb") as f:
+                                arquivo[codificacao] = f.read()
+                    self._arquivos[relativo] = arquivo
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  Erro ao carregar bundle de assets: {e}")
+            self._arquivos.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera o bundle de assets do display do quiosque")
+    parser.add_argument("--origem", default=".", help="Pasta com templates/ e static/")
+    parser.add_argument("--destino", default="dist", help="Pasta de saída (servida por app.py)")
+    args = parser.parse_args()
+
+    manifesto = construir(args.origem, args.destino)
+    total = sum(os.path.getsize(os.path.join(raiz, n)) for raiz, _, nomes in os.walk(args.destino)
+                for n in nomes if not n.endswith((".gz", ".br")))
+    comprimido = sum(os.path.getsize(os.path.join(raiz, n)) for raiz, _, nomes in os.walk(args.destino)
+                     for n in nomes if n.endswith(".gz"))
+    print(f"📦 Bundle {manifesto['versao']}: {len(manifesto['arquivos']) + len(manifesto['inline'])} assets, "
+          f"{total / 1024:.1f} KB ({comprimido / 1024:.1f} KB com gzip)"
+          f"{'' if brotli else ' - instale brotli para variantes .br'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Asynchronous Logging
+Structured log records pushed onto a bounded in-memory queue and written by a background thread
+
+Callers never wait on stdout/journald: a full queue drops the record (and the
+drop is reported later) instead of stalling pulse capture or the pipeline.
+Records carry the correlation id of the note/withdraw being processed, taken
+from a context variable set by the pipeline stages.
+"""
+
+import contextlib
+import contextvars
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+NIVEIS = {"debug": 10, "info": 20, "aviso": 30, "erro": 40}
+
+_correlacao = contextvars.ContextVar("correlacao", default=None)
+
+
+@contextlib.contextmanager
+def correlacao(ident):
+    """Tag every record logged inside the with-block with this note/withdraw id"""
+    token = _correlacao.set(ident)
+    try:
+        yield
+    finally:
+        _correlacao.reset(token)
+
+
+def _nivel_da_mensagem(texto):
+    # Legacy prints already say how bad they are
+    if texto.startswith("❌"):
+        return "erro"
+    if texto.startswith("⚠"):
+        return "aviso"
+    return "info"
+
+
+class _SaidaLog:
+    """File-like object that turns print() lines into log records (see AsyncLogger.capturar_stdout)"""
+
+    def __init__(self, logger, original):
+        self.logger = logger
+        self.original = original
+        self._buffers = threading.local()
+
+    def write(self, texto):
+        buffer = getattr(self._buffers, "texto", "") + texto
+        *linhas, resto = buffer.split("\n")
+        self._buffers.texto = resto
+        for linha in linhas:
+            if linha.strip():
+                self.logger.log(_nivel_da_mensagem(linha.strip()), "print", linha)
+        return len(texto)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class AsyncLogger:
+    """Bounded queue of records drained by one writer thread.
+
+    formato "json" writes one JSON object per line (for journald / log
+    shipping); "texto" writes only the human message, as the terminal version
+    always did. Before start() records are written synchronously.
+    """
+
+    def __init__(self, destino=None, capacidade=2000, nivel="info", formato="texto", componente="backend"):
+        self.destino = destino  # None = current stdout
+        self.nivel = NIVEIS[nivel]
+        self.formato = formato
+        self.componente = componente
+        self._fila = queue.Queue(maxsize=capacidade)
+        self._limites = {}  # Rate-limited event -> [next allowed time, suppressed count]
+        self._limites_lock = threading.Lock()
+        self._thread = None
+        self.descartados = 0  # Records dropped because the queue was full
+        self._descartados_reportados = 0
+
+    def configurar(self, nivel=None, formato=None):
+        if nivel:
+            self.nivel = NIVEIS[nivel]
+        if formato:
+            self.formato = formato
+
+    def habilitado(self, nivel):
+        return NIVEIS[nivel] >= self.nivel
+
+    def log(self, nivel, evento, mensagem=None, limite=None, **campos):
+        """Queue a record; never blocks. limite: at most one record per `limite` seconds for this event"""
+        if NIVEIS[nivel] < self.nivel:
+            return
+        if limite is not None:
+            permitido, suprimidos = self._limitar(evento, limite)
+            if not permitido:
+                return
+            if suprimidos:
+                campos["suprimidos"] = suprimidos
+
+        registro = {
+            "ts": time.time(),
+            "nivel": nivel,
+            "evento": evento,
+            "componente": self.componente,
+            "thread": threading.current_thread().name,
+        }
+        ident = _correlacao.get()
+        if ident:
+            registro["id"] = ident
+        if mensagem is not None:
+            registro["msg"] = mensagem
+        registro.update(campos)
+
+        if self._thread is None:
+            self._escrever([registro])
+            return
+        try:
+            self._fila.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+
+    def debug(self, evento, mensagem=None, **campos):
+        self.log("debug", evento, mensagem, **campos)
+
+    def info(self, evento, mensagem=None, **campos):
+        self.log("info", evento, mensagem, **campos)
+
+    def aviso(self, evento, mensagem=None, **campos):
+        self.log("aviso", evento, mensagem, **campos)
+
+    def erro(self, evento, mensagem=None, **campos):
+        self.log("erro", evento, mensagem, **campos)
+
+    def capturar_stdout(self):
+        """Route print() through the queue (daemon mode: stdout goes to journald)"""
+        if not isinstance(sys.stdout, _SaidaLog):
+            sys.stdout = _SaidaLog(self, sys.stdout)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write everything still queued and stop the writer"""
+        if self._thread is None:
+            return
+        self._fila.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+        if isinstance(sys.stdout, _SaidaLog):
+            sys.stdout = sys.stdout.original
+
+    def _limitar(self, evento, intervalo):
+        agora = time.monotonic()
+        with self._limites_lock:
+            estado = self._limites.setdefault(evento, [0.0, 0])
+            if agora < estado[0]:
+                estado[1] += 1
+                return False, 0
+            suprimidos = estado[1]
+            estado[0] = agora + intervalo
+            estado[1] = 0
+            return True, suprimidos
+
+    def _loop(self):
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < 256:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            fim = None in lote
+            lote = [r for r in lote if r is not None]
+            if self.descartados != self._descartados_reportados:
+                perdidos = self.descartados - self._descartados_reportados
+                self._descartados_reportados = self.descartados
+                lote.append({"ts": time.time(), "nivel": "aviso", "evento": "log_descartados",
+                             "componente": self.componente, "descartados": perdidos,
+                             "msg": f"⚠️  {perdidos} registros de log descartados (fila cheia)"})
+            self._escrever(lote)
+            if fim:
+                return
+
+    def _escrever(self, registros):
+        saida = self.destino or sys.stdout
+        if isinstance(saida, _SaidaLog):
+            saida = saida.original
+        try:
+            if self.formato == "json":
+                texto = "".join(json.dumps(dict(r, ts=datetime.fromtimestamp(r["ts"]).isoformat()),
+                                           ensure_ascii=False, default=str) + "\n" for r in registros)
+            else:
+                texto = "".join(f"{r.get('msg', r['evento'])}\n" for r in registros)
+            saida.write(texto)
+            saida.flush()
+        except (OSError, ValueError):
+            pass  # Closed or broken stdout must never take the backend down
+
+
+# Process-wide logger used by the backend modules
+LOG = AsyncLogger()
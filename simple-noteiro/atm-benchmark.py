@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - End-to-End Benchmark
+Replays pulse traces through atm-simple.py (framing -> pipeline -> display) against local
+stand-ins for LNbits, the price API and the frontend, and reports per scenario:
+
+  - note-to-display latency (last falling edge of a note -> QR event at the frontend), p50/p99
+  - pulse miscount rate (framed notes that do not match the notes in the trace)
+  - CPU usage of the backend process while replaying
+
+Each scenario runs in its own process so module state (session, journal, pipeline) starts clean.
+
+Uso:
+  python3 atm-benchmark.py                       # all scenarios at real speed
+  python3 atm-benchmark.py --cenario jitter --velocidade 4
+  python3 atm-benchmark.py --trace gravado.txt   # recorded trace (see pulse_sim.py)
+  python3 atm-benchmark.py --json
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIO)
+
+from pulse_sim import SimulatedSource, carregar_trace, gerar_trace, notas_do_trace  # noqa: E402
+
+PRECO_BTC = 350000.0
+
+# Scenario -> trace and environment parameters
+CENARIOS = collections.OrderedDict([
+    ("basico", {"notas": [2, 5, 10, 20, 50]}),
+    ("jitter", {"notas": [2, 5, 10, 20, 50], "jitter": 0.25}),
+    ("bounce", {"notas": [2, 5, 10, 20, 50], "bounce": 0.3}),
+    ("dropout", {"notas": [2, 5, 10, 20, 50], "dropout": 0.02}),
+    ("rajada", {"notas": [10, 10, 10, 10, 10, 10], "gap_notas": 1.0}),
+    ("rapido", {"notas": [20, 50, 100, 200], "periodo": 0.04, "largura": 0.02, "bounce": 0.3}),
+    # R$ 20, 50, 100, 200 with the acceptor in 1 pulse per R$ 10 mode
+    ("perfil_dez", {"notas": [2, 5, 10, 20], "periodo": 0.05, "largura": 0.025, "perfil": "dez"}),
+    ("lnbits_lento", {"notas": [2, 5, 10, 20], "atraso_lnbits": 0.8}),
+    ("pool", {"notas": [2, 5, 10, 20], "atraso_lnbits": 0.8, "pool": True}),
+    ("lnbits_fora", {"notas": [2, 5, 10, 20, 50], "lnbits_fora": True}),
+    ("frontend_http", {"notas": [2, 5, 10, 20], "transporte": "http"}),
+    ("asyncio", {"notas": [2, 5, 10, 20, 50], "runtime": "asyncio"}),
+    ("lnbits_lento_asyncio", {"notas": [2, 5, 10, 20], "atraso_lnbits": 0.8, "runtime": "asyncio"}),
+    ("ocioso", {"notas": [], "duracao": 10.0}),
+])
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    """LNbits withdraw API, CoinGecko price API and frontend /api endpoints on one local port"""
+
+    atraso_lnbits = 0.0
+    lnbits_fora = False  # Withdraw API answers 503 (outage: notes go to the offline queue)
+    eventos = None  # Callback(tipo, dados) for frontend POSTs
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _corpo(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(tamanho) or b"{}")
+
+    def do_GET(self):
+        if self.path.startswith("/api/v3/simple/price"):
+            self._responder(200, {"bitcoin": {"brl": PRECO_BTC}})
+        else:
+            self._responder(404, {"detail": "Not found"})
+
+    def do_POST(self):
+        corpo = self._corpo()
+        if self.path == "/withdraw/api/v1/links":
+            if self.lnbits_fora:
+                self._responder(503, {"detail": "Service Unavailable"})
+                return
+            time.sleep(self.atraso_lnbits)
+            ident = uuid.uuid4().hex[:22]
+            self._responder(201, {"id": ident, "lnurl": f"LNURL1BENCH{ident.upper()}"})
+        elif self.path in ("/api/pulsos", "/api/qrcode"):
+            self.eventos(self.path.rsplit("/", 1)[1], corpo)
+            self._responder(200, {"status": "success"})
+        else:
+            self._responder(404, {"detail": "Not found"})
+
+    def do_DELETE(self):
+        self._responder(200, {"success": True})
+
+
+def carregar_atm():
+    """Import atm-simple.py as a module (the file name is not importable directly)"""
+    spec = importlib.util.spec_from_file_location("atm_simple", os.path.join(DIRETORIO, "atm-simple.py"))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def percentil(valores, p):
+    """Nearest-rank percentile"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def taxa_erro_contagem(esperadas, detectadas):
+    """Fraction of notes not matched between the trace and what the framer produced"""
+    total = max(len(esperadas), len(detectadas))
+    if not total:
+        return 0.0
+    casadas = sum((collections.Counter(esperadas) & collections.Counter(detectadas)).values())
+    return 1 - casadas / total
+
+
+def executar_cenario(nome, parametros, velocidade=1.0, trace_arquivo=None, seed=1):
+    """Run one scenario in this process; returns the result dict"""
+    if trace_arquivo:
+        bordas = carregar_trace(trace_arquivo)
+        resumo = notas_do_trace(bordas)
+    else:
+        bordas, resumo = gerar_trace(
+            parametros["notas"],
+            periodo=parametros.get("periodo", 0.15),
+            largura=parametros.get("largura", 0.05),
+            gap_notas=parametros.get("gap_notas", 3.5),
+            jitter=parametros.get("jitter", 0.0),
+            bounce=parametros.get("bounce", 0.0),
+            dropout=parametros.get("dropout", 0.0),
+            seed=seed,
+        )
+
+    temporario = tempfile.mkdtemp(prefix="atm-bench-")
+    os.chdir(temporario)  # Journal, spool, socket and PNGs land in the scratch directory
+
+    exibidos = []  # (monotonic ns, valor_brl) of QR events seen by the frontend stand-in
+    exibidos_lock = threading.Lock()
+
+    def evento_frontend(tipo, dados):
+        if tipo == "qrcode":
+            with exibidos_lock:
+                exibidos.append((time.monotonic_ns(), dados.get("valor_brl")))
+
+    _StandIn.atraso_lnbits = parametros.get("atraso_lnbits", 0.0)
+    _StandIn.lnbits_fora = parametros.get("lnbits_fora", False)
+    _StandIn.eventos = staticmethod(evento_frontend)
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_port}"
+
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        atm = carregar_atm()
+        import price_feed
+        from async_log import LOG
+        LOG.destino = nulo  # Background threads may still log after stdout is restored
+
+        # Local stand-ins instead of LNbits / CoinGecko / app.py
+        atm.LNBITS_URL = base
+        atm.POOL_ATIVO = parametros.get("pool", False)
+        atm.FRONTEND_TRANSPORT = parametros.get("transporte", "bus")
+        atm.API_ENDPOINT = f"{base}/api/pulsos"
+        atm.RESGATE_URL = "http://quiosque.exemplo:3005/resgate"  # Any non-loopback URL enables the offline queue
+        _, params, parser = price_feed.FONTES_PRECO["coingecko"]
+        price_feed.FONTES_PRECO["coingecko"] = (f"{base}/api/v3/simple/price", params, parser)
+        atm.price_feed = price_feed.PriceFeed(atm.http, fontes=["coingecko"], arquivo=None)
+        atm.price_feed.atualizar()
+
+        # Accelerated replay shrinks every timing window by the same factor
+        atm.TEMPO_DEBOUNCE /= velocidade
+        atm.DEBOUNCE_MIN /= velocidade
+        atm.LARGURA_MIN_PULSO /= velocidade
+        atm.TIMEOUT_SEM_PULSOS /= velocidade
+        atm.TIMEOUT_MIN_NOTA /= velocidade
+        if parametros.get("perfil"):
+            perfil = atm.obter_perfil(parametros["perfil"])
+            perfil.timing = {chave: valor if chave.startswith("fator") else valor / velocidade
+                             for chave, valor in perfil.timing.items()}
+            atm.PERFIL_NOTEIRO = perfil.nome
+            atm.canais = {c["nome"]: atm.Canal(i, **c) for i, c in enumerate(atm.CANAIS)}
+        mapa = atm.canal_padrao().mapa
+
+        servidor_bus = None
+        if atm.FRONTEND_TRANSPORT == "bus":
+            from event_bus import BusServer
+            servidor_bus = BusServer(atm.BUS_SOCKET, evento_frontend)
+            servidor_bus.start()
+
+        # Record what the framer produced (pulse count, when it reached the worker)
+        enquadradas = []
+        processar_original = atm.processar_nota
+
+        def processar_medido(pulsos, canal=None):
+            enquadradas.append((pulsos, time.monotonic_ns()))
+            processar_original(pulsos, canal)
+
+        atm.processar_nota = processar_medido
+
+        atm.iniciar_bus_frontend()
+        atm.iniciar_lightning()
+        atm.iniciar_pool_saques()
+        atm.iniciar_fila_saques()
+        if atm.withdraw_pool:
+            atm.withdraw_pool.repor()  # Warm before the first note, as after a normal startup
+        runtime_async = None
+        if parametros.get("runtime") == "asyncio":
+            # Same wiring as run_async() in interactive mode: the loop on its own thread
+            atm.RUNTIME = "asyncio"
+            pronto = threading.Event()
+            runtime_async = threading.Thread(target=lambda: asyncio.run(atm.executar_async(pronto)), daemon=True)
+            runtime_async.start()
+            pronto.wait(timeout=10)
+        else:
+            atm.iniciar_pipeline()
+            atm.recuperar_saques()
+            atm.iniciar_framing()
+
+        pinos = [canal.pino for canal in atm.canais.values()]
+        fonte = SimulatedSource(pinos, atm.pulse_ring, bordas, velocidade=velocidade)
+        cpu_inicio = time.process_time()
+        parede_inicio = time.monotonic()
+        fonte.start()
+
+        # Wait for the trace, the end-of-note window and every recognized note to be displayed
+        duracao_trace = (bordas[-1][0] if bordas else 0.0) / velocidade
+        limite = parede_inicio + max(parametros.get("duracao", 0.0), duracao_trace) + 30.0
+        fonte.concluido.wait(timeout=max(0.0, limite - time.monotonic()))
+        time.sleep(max(parametros.get("duracao", 0.0) - (time.monotonic() - parede_inicio), 0.0))
+        time.sleep(atm.parametros_framing(atm.canal_padrao())["timeout_max"] + 0.2)
+        while time.monotonic() < limite:
+            reconhecidas = sum(1 for p, _ in enquadradas if p in mapa)
+            with exibidos_lock:
+                if len(exibidos) >= reconhecidas and atm.fila_notas.empty():
+                    break
+            time.sleep(0.05)
+
+        cpu = time.process_time() - cpu_inicio
+        parede = time.monotonic() - parede_inicio
+
+        atm.shutdown_event.set()
+        if runtime_async:
+            atm.parar_async()
+            runtime_async.join(timeout=10)
+        fonte.stop()
+        atm.cleanup_gpio()
+        if atm.withdraw_pool:
+            atm.withdraw_pool.stop()
+        if atm.fila_saques:
+            atm.fila_saques.stop()
+        if atm.bus_frontend:
+            atm.bus_frontend.stop()
+        atm.diario.stop()
+        atm.http.close()
+        if servidor_bus:
+            servidor_bus.stop()
+        servidor.shutdown()
+
+    # Match each framed note to the trace note whose last falling edge precedes it,
+    # then framed notes that produced a QR to display events (display is in note order)
+    fim_notas = [fonte.instante_ns(t) for _, t in resumo]
+    latencias = []
+    exibidos_fila = collections.deque(exibidos)
+    for pulsos, instante in enquadradas:
+        if pulsos not in mapa or not exibidos_fila:
+            continue
+        exibido_ns, _ = exibidos_fila.popleft()
+        anteriores = [fim for fim in fim_notas if fim <= instante]
+        if anteriores:
+            latencias.append((exibido_ns - anteriores[-1]) / 1e6)
+
+    esperadas = [p for p, _ in resumo]
+    detectadas = [p for p, _ in enquadradas]
+    return {
+        "cenario": nome,
+        "velocidade": velocidade,
+        "notas_trace": len(esperadas),
+        "notas_detectadas": len(detectadas),
+        "qr_exibidos": len(exibidos),
+        "latencia_p50_ms": round(percentil(latencias, 50), 1) if latencias else None,
+        "latencia_p99_ms": round(percentil(latencias, 99), 1) if latencias else None,
+        "erro_contagem": round(taxa_erro_contagem(esperadas, detectadas), 4),
+        "cpu_pct": round(100 * cpu / parede, 2) if parede else 0.0,
+        "bordas_descartadas": atm.pulse_ring.descartados,
+        "rejeitados_debounce": atm.note_framer.rejeitados_debounce,
+        "rejeitados_glitch": atm.note_framer.rejeitados_glitch,
+    }
+
+
+def rodar_em_subprocesso(nome, args):
+    comando = [sys.executable, os.path.abspath(__file__), "--interno", nome,
+               "--velocidade", str(args.velocidade), "--seed", str(args.seed)]
+    if args.trace:
+        comando += ["--trace", os.path.abspath(args.trace)]
+    saida = subprocess.run(comando, capture_output=True, text=True)
+    if saida.returncode != 0:
+        return {"cenario": nome, "erro": saida.stderr.strip().splitlines()[-1:] or ["falhou"]}
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def imprimir_tabela(resultados):
+    print(f"{'cenário':<22} {'notas':>7} {'p50 ms':>9} {'p99 ms':>9} {'erro cont.':>11} {'CPU %':>7}")
+    print("-" * 70)
+    for r in resultados:
+        if "erro" in r:
+            print(f"{r['cenario']:<22} ❌ {r['erro'][0]}")
+            continue
+        p50 = "-" if r["latencia_p50_ms"] is None else f"{r['latencia_p50_ms']:.1f}"
+        p99 = "-" if r["latencia_p99_ms"] is None else f"{r['latencia_p99_ms']:.1f}"
+        notas = f"{r['qr_exibidos']}/{r['notas_trace']}"
+        print(f"{r['cenario']:<22} {notas:>7} {p50:>9} {p99:>9} {r['erro_contagem'] * 100:>10.1f}% "
+              f"{r['cpu_pct']:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do ATM (sem hardware)")
+    parser.add_argument("--cenario", action="append", choices=list(CENARIOS),
+                        help="Cenário a executar (pode repetir; padrão: todos)")
+    parser.add_argument("--velocidade", type=float, default=1.0, help="Fator de aceleração do trace")
+    parser.add_argument("--trace", help="Trace gravado a reproduzir em vez dos sintéticos")
+    parser.add_argument("--seed", type=int, default=1, help="Semente dos traces sintéticos")
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    parser.add_argument("--interno", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        resultado = executar_cenario(args.interno, CENARIOS.get(args.interno, {}),
+                                     velocidade=args.velocidade, trace_arquivo=args.trace, seed=args.seed)
+        print(json.dumps(resultado))
+        return
+
+    nomes = ["trace"] if args.trace else (args.cenario or list(CENARIOS))
+    resultados = []
+    for nome in nomes:
+        if not args.json:
+            print(f"⏱️  Executando cenário '{nome}'...", flush=True)
+        resultados.append(rodar_em_subprocesso(nome, args))
+
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+    else:
+        print()
+        imprimir_tabela(resultados)
+
+
+if __name__ == "__main__":
+    main()
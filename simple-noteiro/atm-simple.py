@@ -4,32 +4,151 @@ ATM Bitcoin Lightning - Simple Terminal Version
 Counts GPIO pulses from banknote acceptor and generates Lightning QR codes via LNbits
 """
 
-import RPi.GPIO as GPIO
 import time
+INICIO_PROCESSO = time.monotonic()  # Startup phases are timed from here (before the imports below)
+
+import asyncio
 import threading
-import requests
 import json
-import qrcode
 import hashlib
 from datetime import datetime
 import os
 import sys
 import signal
+import queue
+import socket
+import uuid
+import ipaddress
+from urllib.parse import urlsplit
+
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    GPIO = None  # Not on a Raspberry Pi: gpiod or simulated pulses only
+
+from pulse_source import PulseRing, criar_fonte_pulsos
+from note_framer import CanalNota, NoteFramer
+from acceptor_profiles import AuditoriaNotas, classificar_nota, obter_perfil
+from pipeline import AsyncPipeline, Pipeline
+from http_client import AsyncHttpClient, HttpClient, HttpError, carregar_bibliotecas
+from lightning_provider import LinkRecusado, criar_provedor
+from price_feed import PriceFeed
+from withdraw_pool import WithdrawPool
+from withdraw_queue import WithdrawQueue
+from event_bus import BusPublisher, ComandoServer
+from qr_cache import QrCache
+from metrics import REGISTRO, MetricsServer
+from async_log import LOG, correlacao
+from fleet_reporter import FleetReporter
+from session_batcher import SessionBatcher
+from startup import StartupPhases
+import journal
 
 # Hardware Configuration
 PINO_SINAL = 17
-TEMPO_DEBOUNCE = 0.1  # 100ms debounce
-TIMEOUT_SEM_PULSOS = 3.0  # Timeout after no pulses detected (seconds)
+TEMPO_DEBOUNCE = 0.1  # Upper bound of the learned debounce between pulse starts (seconds)
+DEBOUNCE_MIN = 0.01  # Learned debounce floor, used until the acceptor's pulse period is known
+FATOR_DEBOUNCE = 0.5  # Learned debounce = this fraction of the median inter-pulse gap
+LARGURA_MIN_PULSO = 0.01  # Glitch filter: LOW pulses shorter than this (contact bounce, noise) are dropped
+TIMEOUT_SEM_PULSOS = 3.0  # Max silence before a note is closed (seconds)
+TIMEOUT_MIN_NOTA = 0.25  # Lower bound for the learned end-of-note window (seconds)
+FATOR_GAP_FIM_NOTA = 4.0  # Close a note after this many average inter-pulse gaps
+PULSE_BACKEND = "auto"  # auto, gpiod, rpi-edge, polling, sim
+SIM_TRACE = None  # Edge trace replayed by the sim backend (see pulse_sim.py)
+GPIO_CHIP = "/dev/gpiochip0"  # GPIO character device used by the gpiod backend
+PULSE_RING_SIZE = 4096  # Edges buffered between capture and note state machine
+INICIO_META_CAPTURA = 1.0  # Warn when pulse capture takes longer than this to arm after process start (seconds)
 
 # LNbits Configuration
 LNBITS_URL = "https://wallet.br-ln.com"  # Change this to your LNbits URL
 LNBITS_ADMIN_KEY = "808edf38d8b7447a94e339ef835ec991"  # Change this to your admin key
 LNBITS_WALLET_ID = "ca115665923c443ea28fe1a179d42413"  # Change this to your wallet ID
 
+# Lightning provider creating the withdraw links (see lightning_provider.PROVEDORES;
+# for tests point LNBITS_URL at lightning_mock.py)
+LIGHTNING_PROVIDER = "lnbits"
+LIGHTNING_CONCORRENCIA = 8  # Link requests in flight at once (pipeline, pool and offline queue together)
+# Claim webhook set on every link (app.py /api/webhook/lightning); it must be reachable by LNbits.
+# Without it app.py still detects claims by polling the provider through the command socket.
+LIGHTNING_WEBHOOK_URL = None  # e.g. "https://atm01.example.com/api/webhook/lightning"
+LIGHTNING_WEBHOOK_TOKEN = None  # Echoed in the X-ATM-Token header; set it whenever the webhook URL is public
+
+# Pre-created withdraw links per denomination (served without a LNbits round trip)
+POOL_ATIVO = True
+POOL_TAMANHO = 2  # Ready links kept per denomination
+POOL_TOLERANCIA = 0.01  # Re-price links when the quote moves more than 1%
+POOL_INTERVALO = 30  # Seconds between replenish/re-price checks
+POOL_ARQUIVO = "pool_saques.json"  # Ready links survive restarts
+
+# Offline withdraw queue: with LNbits unreachable the customer gets a claim QR right away
+# and the link is created in the background once LNbits answers again
+FILA_SAQUES_ARQUIVO = "fila_saques.jsonl"  # Owed withdraws survive restarts
+FILA_SAQUES_LOTE = 10  # Links created per replay round (one concurrent batch)
+FILA_SAQUES_INTERVALO = 5.0  # Seconds between replay attempts (doubles while LNbits stays down)
+# Claim page (app.py) as the customer's phone reaches it, e.g. "http://192.168.0.10:3005/resgate".
+# The offline queue only runs with a non-loopback URL: without one an outage fails the withdraw
+# (the journal resumes it) instead of handing out a QR the phone cannot open
+RESGATE_URL = None
+
+# Transaction journal (write-ahead log, replayed on startup)
+JOURNAL_ARQUIVO = "transacoes.journal"
+JOURNAL_FSYNC_INTERVAL = 0.05  # Records are fsynced in batches at most this often (seconds)
+JOURNAL_COMPACTACAO = 1000  # Compact after this many appended records
+
 # API Configuration for local frontend notification
 API_ENDPOINT = "http://localhost:3005/api/pulsos"  # Local frontend endpoint
+FRONTEND_TRANSPORT = "bus"  # "bus" (Unix socket, lossless) or "http" (legacy POSTs)
+BUS_SOCKET = "atm-bus.sock"  # Must match BUS_SOCKET in app.py
+BUS_SPOOL = "bus_pendentes.jsonl"  # Undelivered display events survive restarts
+CONTROLE_SOCKET = "atm-controle.sock"  # Commands from the display (confirm, claim status); must match app.py
+
+# Withdraw batching: "nota" creates one withdraw per note; "sessao" accumulates the notes of a
+# customer and creates one withdraw when they confirm on the display or the session goes idle
+MODO_SAQUE = "nota"
+SESSAO_OCIOSA = 30.0  # Seconds without a new note before an open session is withdrawn
+SESSAO_DURACAO_MAX = 300.0  # Sessions are withdrawn at most this long after the first note
+
+# Logging (records are queued and written by a background thread)
+LOG_NIVEL = "info"  # debug, info, aviso, erro ("debug" adds rate-limited per-pulse records)
+LOG_FORMATO = None  # "json" or "texto"; default: json in daemon mode, texto interactive
+LOG_QR_ASCII = None  # Print the ASCII QR; default: only in interactive mode
+LOG_PULSO_INTERVALO = 1.0  # At most one per-pulse record per interval (seconds)
+
+# Metrics (Prometheus text format on a local socket, re-exported by app.py on /metrics)
+METRICS_SOCKET = "atm-metrics.sock"  # Must match METRICS_SOCKET in app.py
+
+# Fleet reporting (notes, withdraws, errors and quotes sent in batches to fleet_server.py)
+FROTA_URL = None  # e.g. "http://frota.local:3010"; None disables reporting
+FROTA_MAQUINA = socket.gethostname()  # Kiosk id shown on the fleet dashboard
+FROTA_INTERVALO = 10  # Seconds between batches
+FROTA_TOKEN = None  # Must match FROTA_TOKEN on the fleet server (if set)
+HTTP_TIMEOUT_FROTA = (3.05, 15.0)
+
+# HTTP client configuration (timeouts are (connect, read) seconds)
+HTTP_TIMEOUT_FRONTEND = (1.0, 5.0)
+HTTP_TIMEOUT_LNBITS = (3.05, 10.0)
+HTTP_TIMEOUT_COINGECKO = (3.05, 10.0)
+HTTP_TENTATIVAS = 3  # Attempts per request (jittered exponential backoff between them)
+HTTP_FALHAS_CIRCUITO = 5  # Consecutive failures before an endpoint fails fast
+HTTP_RESET_CIRCUITO = 30.0  # Seconds before a failing endpoint is tried again
+
+# Withdraw pipeline (note accepted -> quote -> withdraw -> QR -> display)
+PIPELINE_CAPACIDADE = 16  # Max notes queued per stage before back-pressure
+PIPELINE_WORKERS_SAQUE = 4  # Concurrent LNbits withdraw creations
+PIPELINE_WORKERS_QR = 2  # Concurrent QR renders
+
+# Runtime: "threads" (framing, note, price and pipeline worker threads) or "asyncio"
+# (one event loop: those become tasks, HTTP is awaited, GPIO edges are bridged into the loop)
+RUNTIME = "threads"
+
+# Acceptor pulse mode (see PERFIS in acceptor_profiles.py): "real" = 1 pulse per real,
+# "cinco"/"dez" = 1 pulse per R$5/R$10 (large notes in a handful of pulses, closed sooner).
+# Counts off by a few pulses on large notes are matched to the nearest note with a confidence
+# score; the rest are rejected and written to the audit file for the operator to settle.
+PERFIL_NOTEIRO = "real"
+AUDITORIA_NOTAS = "notas_auditoria.jsonl"  # Rejected and approximately matched notes
 
-# Note values mapping (pulses -> BRL value)
+# Note values mapping for the "real" profile (pulses -> BRL value)
 PULSO_PARA_REAL = {
     2: 2.0,
     5: 5.0,
@@ -41,33 +160,191 @@ PULSO_PARA_REAL = {
     200: 200.0
 }
 
+# Bill acceptors (one entry per validator). All pins are captured by one pulse source
+# and framed by one worker; optional keys: "perfil" (acceptor pulse mode), "pulsos" (own pulse map),
+# "debounce", "largura_min", "timeout_max" (override the profile's timing)
+CANAIS = [
+    {"nome": "principal", "pino": PINO_SINAL},
+    # {"nome": "secundario", "pino": 27, "perfil": "dez"},
+]
+
+class Canal:
+    """One bill acceptor: its pin, pulse profile and map, framing parameters and session"""
+    
+    def __init__(self, indice, nome, pino, perfil=None, pulsos=None, debounce=None, largura_min=None,
+                 timeout_max=None):
+        self.indice = indice  # Channel index used by the pulse source and framer
+        self.nome = nome
+        self.pino = pino
+        self.perfil = obter_perfil(perfil or PERFIL_NOTEIRO)
+        if pulsos is not None:
+            self.mapa = pulsos
+        elif self.perfil.nome == "real":
+            self.mapa = PULSO_PARA_REAL  # Keeps the configured map (and its extra entries)
+        else:
+            self.mapa = self.perfil.mapa()
+        self.debounce = debounce
+        self.largura_min = largura_min
+        self.timeout_max = timeout_max
+        self.total_sessao = 0.0
+        self.notas_sessao = []
+
 # Global variables
-contador_pulsos = 0
-ultimo_tempo = 0
-ultimo_tempo_pulso = 0  # Track last pulse time for timeout detection
-total_sessao = 0.0
-notas_sessao = []
-processando = False
-timer_ativo = None  # Store active timer reference
+canais = {c["nome"]: Canal(i, **c) for i, c in enumerate(CANAIS)}  # In pin order
 lock = threading.Lock()
 daemon_mode = False  # Flag to control daemon vs interactive mode
 shutdown_event = threading.Event()  # Event to signal shutdown
+pulse_ring = PulseRing(PULSE_RING_SIZE)  # Edge timestamps from the capture backend
+fonte_pulsos = None  # Active pulse source (gpiod, rpi-edge or polling)
+http_async = None  # Async HTTP client (asyncio runtime only)
+parada_async = None  # Stops the asyncio runtime (set on the loop thread)
+loop_async = None
+note_framer = None  # Single framing worker grouping pulses into notes
+fila_notas = queue.Queue()  # Framed notes (pulse count, channel name) waiting to be processed
+pipeline_saque = None  # Staged withdraw pipeline
+lightning = None  # Lightning provider (withdraw link creation and claim status)
+withdraw_pool = None  # Warm pool of LNbits withdraw links
+fila_saques = None  # Withdraws owed while LNbits is unreachable
+bus_frontend = None  # Local message bus to app.py
+qr_cache = QrCache()  # Each LNURL is encoded once (terminal, PNG file and frontend)
+diario = journal.Journal(JOURNAL_ARQUIVO, intervalo_fsync=JOURNAL_FSYNC_INTERVAL,
+                         limite_compactacao=JOURNAL_COMPACTACAO)
+servidor_metricas = None  # Local metrics socket
+frota = None  # Fleet event reporter (None when FROTA_URL is not set)
+sessoes = None  # Session batcher (MODO_SAQUE = "sessao")
+servidor_comandos = None  # Command socket for the display (session confirmation, claim status)
+auditoria = AuditoriaNotas(AUDITORIA_NOTAS)  # Rejected and approximately matched notes
+inicio = StartupPhases(INICIO_PROCESSO)  # Startup phase timings and readiness milestones
 
-# Exchange rate cache
+# Hot-path metrics (HTTP, price and pulse framing metrics live in their modules)
+METRICA_SAQUE = REGISTRO.histograma("atm_saque_criacao_segundos",
+                                    "Criação do link de saque por origem", ("origem",))
+METRICA_SIMULADO = REGISTRO.contador("atm_saque_simulado_total",
+                                     "Saques servidos com QR simulado", ("motivo",))
+METRICA_ADIADO = REGISTRO.contador("atm_saque_adiado_total",
+                                   "Saques enviados à fila offline (QR de resgate)", ("motivo",))
+METRICA_QR = REGISTRO.histograma("atm_qr_render_segundos", "Renderização do QR (terminal + PNG)")
+METRICA_FRONTEND = REGISTRO.histograma("atm_frontend_notificacao_segundos",
+                                       "Envio de evento ao frontend", ("tipo",))
+METRICA_NOTA_DISPLAY = REGISTRO.histograma("atm_nota_exibicao_segundos",
+                                           "Da nota aceita até o QR enviado ao frontend")
+REGISTRO.funcao("atm_ring_bordas_descartadas_total", "Bordas perdidas com o ring cheio",
+                lambda: pulse_ring.descartados, tipo="counter")
+REGISTRO.funcao("atm_pipeline_pendentes", "Saques aguardando nas filas do pipeline",
+                lambda: pipeline_saque.pendentes() if pipeline_saque else None)
+REGISTRO.funcao("atm_pool_acertos_total", "Saques servidos pelo pool de links",
+                lambda: withdraw_pool.acertos if withdraw_pool else None, tipo="counter")
+REGISTRO.funcao("atm_pool_faltas_total", "Saques sem link pronto no pool",
+                lambda: withdraw_pool.faltas if withdraw_pool else None, tipo="counter")
+REGISTRO.funcao("atm_fila_saques_pendentes", "Saques devidos aguardando o LNbits",
+                lambda: fila_saques.pendentes() if fila_saques else None)
+REGISTRO.funcao("atm_fila_saques_criados_total", "Links criados pela fila offline",
+                lambda: fila_saques.criados if fila_saques else None, tipo="counter")
+REGISTRO.funcao("atm_qr_codificacoes_total", "LNURLs codificadas em QR",
+                lambda: qr_cache.codificacoes, tipo="counter")
+REGISTRO.funcao("atm_bus_pendentes", "Eventos do display aguardando ack do frontend",
+                lambda: bus_frontend.pendentes() if bus_frontend else None)
+
+# Exchange rate feed
 PRICE_UPDATE_INTERVAL = 300  # Update every 5 minutes
-btc_price_brl = 500000.0  # Default BTC price fallback (R$)
-last_price_update = 0  # Last price update timestamp
+PRICE_RETRY_INTERVAL = 30  # Retry after a failed update (seconds)
+PRICE_MAX_AGE = 900  # Quotes older than this are reported as stale (seconds)
+PRICE_SOURCES = ["coingecko", "binance", "mercadobitcoin"]  # Aggregated by median
+PRICE_MAX_DEVIATION = 0.02  # Sources further than 2% from the median are rejected
+PRICE_CACHE_FILE = "ultimo_preco.json"  # Last good quote, for instant startup
+BTC_PRICE_FALLBACK = 500000.0  # Default BTC price fallback (R$)
+
+# Shared pooled HTTP client (keep-alive per host, retries, circuit breakers)
+http = HttpClient(tentativas=HTTP_TENTATIVAS, falhas_circuito=HTTP_FALHAS_CIRCUITO,
+                  reset_circuito=HTTP_RESET_CIRCUITO, pool_maxsize=LIGHTNING_CONCORRENCIA)
+http.endpoint("frontend", timeout=HTTP_TIMEOUT_FRONTEND, tentativas=2)
+http.endpoint("lnbits", timeout=HTTP_TIMEOUT_LNBITS)
+http.endpoint("frota", timeout=HTTP_TIMEOUT_FROTA)
+for _fonte in PRICE_SOURCES:
+    http.endpoint(_fonte, timeout=HTTP_TIMEOUT_COINGECKO)
+
+# Background BTC/BRL quote; reads never block the note pipeline
+price_feed = PriceFeed(http, fontes=PRICE_SOURCES, intervalo=PRICE_UPDATE_INTERVAL,
+                       intervalo_erro=PRICE_RETRY_INTERVAL, idade_max=PRICE_MAX_AGE,
+                       arquivo=PRICE_CACHE_FILE, preco_padrao=BTC_PRICE_FALLBACK,
+                       desvio_max=PRICE_MAX_DEVIATION,
+                       on_atualizacao=lambda c: ao_atualizar_preco(c))
+REGISTRO.funcao("atm_preco_idade_segundos", "Idade da cotação BTC/BRL em uso", lambda: price_feed.idade())
 
-def enviar_pulsos_para_frontend(pulsos, valor_brl=None):
-    """Send pulse count to local frontend via POST request"""
+def iniciar_metricas():
+    """Serve metrics on the local socket (scraped by app.py /metrics)"""
+    global servidor_metricas
+    
     try:
-        data = {
-            "pulsos": pulsos,
-            "timestamp": datetime.now().isoformat(),
-            "valor_brl": valor_brl
-        }
+        servidor_metricas = MetricsServer(METRICS_SOCKET)
+        servidor_metricas.start()
+    except OSError as e:
+        print(f"⚠️  Socket de métricas indisponível: {e}")
+        servidor_metricas = None
+
+def iniciar_frota():
+    """Start batched event reporting to the fleet server (if configured)"""
+    global frota
+    
+    if not FROTA_URL:
+        return
+    frota = FleetReporter(http, FROTA_URL, FROTA_MAQUINA, intervalo=FROTA_INTERVALO, token=FROTA_TOKEN)
+    frota.start()
+    print(f"📡 Reportando à frota: {FROTA_URL} (máquina {FROTA_MAQUINA})")
+
+def reportar_frota(tipo, **dados):
+    """Queue a fleet event (never blocks; no-op when reporting is disabled)"""
+    if frota:
+        frota.registrar(tipo, **dados)
+
+def ao_atualizar_preco(cotacao):
+    """New network quote: report it and re-quote open sessions on the display"""
+    inicio.marco("preco_rede")
+    reportar_frota("preco", preco=cotacao.preco, fontes=cotacao.fontes)
+    if sessoes:
+        for sessao in sessoes.recotar():
+            publicar_sessao(sessao)
+
+def iniciar_bus_frontend():
+    """Start the local message bus to the frontend (if enabled)"""
+    global bus_frontend
+    
+    if FRONTEND_TRANSPORT == "bus":
+        bus_frontend = BusPublisher(BUS_SOCKET, arquivo_spool=BUS_SPOOL)
+        bus_frontend.start()
+
+def dados_pulsos(pulsos, valor_brl=None, canal=None):
+    """Frontend 'pulsos' event payload"""
+    return {
+        "pulsos": pulsos,
+        "timestamp": datetime.now().isoformat(),
+        "valor_brl": valor_brl,
+        "canal": canal
+    }
+
+def dados_qrcode(lnurl, valor_brl, canal=None, resgate=None, withdraw_id=None):
+    """Frontend 'qrcode' event payload (resgate: claim token when lnurl is the claim page)"""
+    data = {
+        "lnurl": lnurl,
+        "valor_brl": valor_brl,
+        "canal": canal,
+        "withdraw_id": withdraw_id,  # Claim watcher key
+        "timestamp": datetime.now().isoformat(),
+        "qr_matriz": qr_cache.obter(lnurl).exportar()  # Frontend skips re-encoding
+    }
+    if resgate:
+        data["resgate"] = resgate
+    return data
+
+def enviar_pulsos_para_frontend(pulsos, valor_brl=None, canal=None):
+    """Send pulse count to local frontend (bus, or POST request)"""
+    try:
+        data = dados_pulsos(pulsos, valor_brl, canal)
         
-        response = requests.post(API_ENDPOINT, json=data, timeout=5)
+        if bus_frontend:
+            return bus_frontend.publicar("pulsos", data)
+        
+        response = http.post("frontend", API_ENDPOINT, json=data, idempotente=True)
         
         if response.status_code == 200:
             print(f"✅ Pulsos enviados para frontend: {pulsos}")
@@ -76,24 +353,23 @@ def enviar_pulsos_para_frontend(pulsos, valor_brl=None):
             print(f"⚠️ Erro no frontend: {response.status_code}")
             return False
             
-    except requests.exceptions.RequestException as e:
+    except HttpError as e:
         print(f"⚠️ Frontend não disponível: {e}")
         return False
     except Exception as e:
         print(f"⚠️ Erro ao enviar para frontend: {e}")
         return False
 
-def enviar_qrcode_para_frontend(lnurl, valor_brl):
-    """Send QR code data to local frontend"""
+def enviar_qrcode_para_frontend(lnurl, valor_brl, canal=None, resgate=None, withdraw_id=None):
+    """Send QR code data to local frontend (bus, or POST request)"""
     try:
-        data = {
-            "lnurl": lnurl,
-            "valor_brl": valor_brl,
-            "timestamp": datetime.now().isoformat()
-        }
+        data = dados_qrcode(lnurl, valor_brl, canal, resgate, withdraw_id)
+        
+        if bus_frontend:
+            return bus_frontend.publicar("qrcode", data)
         
         qr_endpoint = API_ENDPOINT.replace('/pulsos', '/qrcode')
-        response = requests.post(qr_endpoint, json=data, timeout=5)
+        response = http.post("frontend", qr_endpoint, json=data, idempotente=True)
         
         if response.status_code == 200:
             print(f"✅ QR code enviado para frontend")
@@ -102,52 +378,79 @@ def enviar_qrcode_para_frontend(lnurl, valor_brl):
             print(f"⚠️ Erro ao enviar QR para frontend: {response.status_code}")
             return False
             
-    except requests.exceptions.RequestException as e:
+    except HttpError as e:
         print(f"⚠️ Frontend não disponível para QR: {e}")
         return False
     except Exception as e:
         print(f"⚠️ Erro ao enviar QR para frontend: {e}")
         return False
 
-def get_btc_price():
-    """Get current BTC price in BRL from CoinGecko API"""
-    global btc_price_brl, last_price_update
-    
-    current_time = time.time()
-    
-    # Check if we need to update the price
-    if current_time - last_price_update < PRICE_UPDATE_INTERVAL:
-        return btc_price_brl
-    
+async def enviar_para_frontend_async(tipo, data):
+    """Asyncio runtime: publish on the bus, or await the POST to the frontend"""
+    if bus_frontend:
+        return bus_frontend.publicar(tipo, data)
     try:
-        print("💱 Atualizando preço do Bitcoin...")
-        url = "https://api.coingecko.com/api/v3/simple/price"
-        params = {
-            "ids": "bitcoin",
-            "vs_currencies": "brl"
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        
+        url = API_ENDPOINT if tipo == "pulsos" else API_ENDPOINT.replace('/pulsos', f'/{tipo}')
+        response = await http_async.post("frontend", url, json=data, idempotente=True)
         if response.status_code == 200:
-            data = response.json()
-            new_price = float(data["bitcoin"]["brl"])
-            
-            btc_price_brl = new_price
-            last_price_update = current_time
-            
-            print(f"✅ Preço atualizado: 1 BTC = R$ {btc_price_brl:,.2f}")
-            return btc_price_brl
-        else:
-            print(f"⚠️  Erro na API CoinGecko: {response.status_code}")
-            return btc_price_brl
-            
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️  Erro de conexão com CoinGecko: {e}")
-        return btc_price_brl
+            print(f"✅ Evento '{tipo}' enviado para frontend")
+            return True
+        print(f"⚠️ Erro no frontend ({tipo}): {response.status_code}")
+        return False
+    except HttpError as e:
+        print(f"⚠️ Frontend não disponível: {e}")
+        return False
     except Exception as e:
-        print(f"⚠️  Erro ao buscar preço: {e}")
-        return btc_price_brl
+        print(f"⚠️ Erro ao enviar para frontend: {e}")
+        return False
+
+def publicar_sessao(sessao):
+    """Show an open session (running total, provisional quote, deadline) on the display"""
+    data = dict(sessao, timestamp=datetime.now().isoformat())
+    if bus_frontend:
+        return bus_frontend.publicar("sessao", data)
+    if loop_async:
+        try:
+            if asyncio.get_running_loop() is loop_async:  # Never block the event loop on a POST
+                loop_async.create_task(enviar_para_frontend_async("sessao", data))
+                return True
+        except RuntimeError:
+            pass  # Not on the loop thread
+    try:
+        response = http.post("frontend", API_ENDPOINT.replace('/pulsos', '/sessao'), json=data, idempotente=True)
+        return response.status_code == 200
+    except Exception as e:
+        print(f"⚠️ Frontend não disponível para sessão: {e}")
+        return False
+
+def publicar_resgate(entrada):
+    """Deliver a link created by the offline queue to the claim page; True once the frontend has it"""
+    data = {
+        "token": entrada["token"],
+        "lnurl": entrada["lnurl"],
+        "withdraw_id": entrada["withdraw_id"],
+        "valor_brl": entrada["valor_brl"],
+        "amount_sats": entrada["amount_sats"],
+        "timestamp": datetime.now().isoformat()
+    }
+    LOG.info("resgate_liberado", f"🎟️  Resgate {entrada['token']} liberado (R$ {entrada['valor_brl']:.2f})",
+             resgate=entrada["token"], withdraw_id=entrada["withdraw_id"], valor_brl=entrada["valor_brl"])
+    if bus_frontend:
+        return bus_frontend.publicar("resgate", data)
+    try:
+        response = http.post("frontend", API_ENDPOINT.replace('/pulsos', '/resgate'), json=data, idempotente=True)
+        return response.status_code == 200
+    except Exception as e:
+        print(f"⚠️ Frontend não disponível para resgate: {e}")
+        return False
+
+def get_btc_price():
+    """Get current BTC price in BRL from the background price feed (never blocks)"""
+    if not price_feed.confiavel():
+        cotacao = price_feed.cotacao()
+        motivo = "fontes divergentes" if cotacao.origem == "divergente" else f"desatualizado, {cotacao.origem}"
+        print(f"⚠️  Preço do Bitcoin não confiável ({motivo})")
+    return price_feed.preco()
 
 def calculate_sats_from_brl(amount_brl):
     """Calculate satoshis from BRL amount using current BTC price"""
@@ -163,11 +466,13 @@ def calculate_sats_from_brl(amount_brl):
     return sats_amount
 
 def setup_gpio():
-    """Initialize GPIO configuration"""
+    """Initialize GPIO configuration and select the pulse capture backend"""
+    global fonte_pulsos
     try:
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(PINO_SINAL, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        print("🔧 GPIO configurado - Pino 17 como entrada com pull-up")
+        pinos = [canal.pino for canal in canais.values()]
+        fonte_pulsos = criar_fonte_pulsos(pinos, pulse_ring, backend=PULSE_BACKEND,
+                                          gpio=GPIO, chip=GPIO_CHIP, trace=SIM_TRACE)
+        print(f"🔧 GPIO configurado - Pinos {pinos} como entrada com pull-up ({fonte_pulsos.nome})")
         return True
     except Exception as e:
         print(f"❌ Erro ao configurar GPIO: {e}")
@@ -175,71 +480,191 @@ def setup_gpio():
 
 def cleanup_gpio():
     """Clean up GPIO resources"""
-    global timer_ativo
     try:
-        # Cancel any active timer
-        if timer_ativo:
-            timer_ativo.cancel()
-        GPIO.cleanup()
+        if note_framer:
+            note_framer.stop()
+        if fonte_pulsos:
+            fonte_pulsos.stop()
+        if GPIO:
+            GPIO.cleanup()
         print("🧹 GPIO cleanup realizado")
     except:
         pass
 
-def create_lnbits_withdraw(amount_brl):
-    """Create withdraw link via LNbits API"""
+def lnbits_configurado():
+    """True if LNbits credentials were set"""
+    return LNBITS_URL != "https://your-lnbits-instance.com"
+
+def iniciar_lightning():
+    """Create the Lightning provider from the LNBITS_* settings"""
+    global lightning
+    
+    lightning = criar_provedor(LIGHTNING_PROVIDER, http=http, url=LNBITS_URL, admin_key=LNBITS_ADMIN_KEY,
+                               concorrencia=LIGHTNING_CONCORRENCIA, webhook_url=LIGHTNING_WEBHOOK_URL,
+                               webhook_token=LIGHTNING_WEBHOOK_TOKEN)
+
+def aquecer_rede():
+    """Background startup: import the HTTP and QR libraries and open the LNbits connection before the first note needs them"""
+    carregar_bibliotecas()
+    import qrcode  # noqa: F401  (qr_cache imports it on the first encode)
+    if not lnbits_configurado():
+        return
     try:
-        # Check if LNbits is configured
-        if LNBITS_URL == "https://your-lnbits-instance.com":
-            print("⚠️  LNbits não configurado - gerando QR simulado")
-            return create_simulated_withdraw(amount_brl)
-        
-        # Convert BRL to satoshis using real-time rate
+        lightning.status_links([])  # One listing: TLS handshake done, keep-alive connection pooled
+        inicio.marco("lnbits_pronto")
+    except Exception as e:
+        print(f"⚠️  LNbits ainda indisponível ({e}) - saques vão para a fila offline até ele responder")
+
+def saque_sem_rede(amount_brl):
+    """Withdraw served without calling LNbits (simulated when unconfigured, or a pooled link); else None"""
+    # Check if LNbits is configured
+    if not lnbits_configurado():
+        print("⚠️  LNbits não configurado - gerando QR simulado")
+        METRICA_SIMULADO.inc(motivo="nao_configurado")
+        return create_simulated_withdraw(amount_brl)
+    
+    # Serve a pre-created link when the pool has one for this denomination
+    if withdraw_pool:
+        link = withdraw_pool.retirar(amount_brl)
+        if link:
+            print(f"⚡ Link de saque retirado do pool (R$ {amount_brl:.2f})")
+            return dict(link, origem="pool")
+    return None
+
+def resgate_publico():
+    """True if RESGATE_URL is set and not a loopback address (the customer's phone must open it)"""
+    if not RESGATE_URL:
+        return False
+    host = (urlsplit(RESGATE_URL).hostname or "").lower()
+    try:
+        return not ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return bool(host) and host != "localhost" and not host.endswith(".localhost")
+
+def url_resgate(token):
+    """Claim page of a queued withdraw (the QR shown while LNbits is unreachable)"""
+    return f"{RESGATE_URL.rstrip('/')}/{token}"
+
+def adiar_saque(amount_brl, amount_sats, motivo, erro=None):
+    """LNbits is unreachable: owe the withdraw in the offline queue and hand out a claim token"""
+    if erro is not None:
+        print(f"❌ Erro de conexão com LNbits: {erro}")
+    if not fila_saques or not resgate_publico():
+        # No queue to owe it in: fail the stage so the journal resumes the withdraw on restart
+        return {"success": False, "error": f"LNbits indisponível ({motivo}) e fila de saques desativada"}
+    
+    entrada = fila_saques.enfileirar(amount_brl, amount_sats)
+    METRICA_ADIADO.inc(motivo=motivo)
+    print(f"📥 Saque de R$ {amount_brl:.2f} guardado na fila offline - resgate {entrada['token']}")
+    return {
+        "success": True,
+        "lnurl": url_resgate(entrada["token"]),
+        "withdraw_id": entrada["token"],
+        "amount_brl": amount_brl,
+        "amount_sats": amount_sats,
+        "resgate": entrada["token"],
+        "origem": "fila"
+    }
+
+def create_lnbits_withdraw(amount_brl, amount_sats=None):
+    """Create withdraw link via LNbits API (amount_sats: pre-computed quote)"""
+    # Convert BRL to satoshis using real-time rate
+    if amount_sats is None:
         amount_sats = calculate_sats_from_brl(amount_brl * 0.95)
+    
+    try:
+        pronto = saque_sem_rede(amount_brl)
+        if pronto:
+            return pronto
         
-        # LNbits withdraw link creation
-        url = f"{LNBITS_URL}/withdraw/api/v1/links"
-        headers = {
-            "X-Api-Key": LNBITS_ADMIN_KEY,
-            "Content-Type": "application/json"
-        }
+        # Known outage: queue at once instead of waiting for timeouts on every note
+        if fila_saques and fila_saques.offline:
+            return adiar_saque(amount_brl, amount_sats, "offline")
         
-        data = {
-            "title": f"ATM Withdraw R${amount_brl:.2f}",
-            "min_withdrawable": amount_sats,
-            "max_withdrawable": amount_sats,
-            "uses": 1,
-            "wait_time": 1,
-            "is_unique": True,
-            "webhook_url": "",
-            "webhook_headers": "",
-            "webhook_body": ""
-        }
+        return lightning.criar_link(amount_brl, amount_sats)
+    except HttpError as e:
+        # Connection errors, timeouts and 5xx: LNbits may come back, so the withdraw is owed
+        return adiar_saque(amount_brl, amount_sats, "erro_http", e)
+    except LinkRecusado as e:
+        # LNbits answered and refused (bad key, wallet balance, amount): retrying will not help,
+        # so the stage fails and the journal keeps the withdraw for the operator
+        print(f"❌ LNbits recusou o saque: {e}")
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        print(f"❌ Erro ao criar withdraw: {e}")
+        return {"success": False, "error": str(e)}
+
+async def create_lnbits_withdraw_async(amount_brl, amount_sats=None):
+    """create_lnbits_withdraw() with the LNbits call awaited on the event loop"""
+    if amount_sats is None:
+        amount_sats = calculate_sats_from_brl(amount_brl * 0.95)
+    
+    try:
+        pronto = saque_sem_rede(amount_brl)
+        if pronto:
+            return pronto
         
-        print(f"🔗 Conectando com LNbits: {url}")
-        response = requests.post(url, headers=headers, json=data, timeout=10)
+        if fila_saques and fila_saques.offline:
+            return adiar_saque(amount_brl, amount_sats, "offline")
         
-        if response.status_code == 201:
-            result = response.json()
-            return {
-                "success": True,
-                "lnurl": result["lnurl"],
-                "withdraw_id": result["id"],
-                "amount_brl": amount_brl,
-                "amount_sats": amount_sats
-            }
-        else:
-            print(f"❌ Erro LNbits: {response.status_code} - {response.text}")
-            print("🔄 Gerando QR simulado como fallback")
-            return create_simulated_withdraw(amount_brl)
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Erro de conexão com LNbits: {e}")
-        print("🔄 Gerando QR simulado como fallback")
-        return create_simulated_withdraw(amount_brl)
+        return await lightning.criar_link_async(http_async, amount_brl, amount_sats)
+    except HttpError as e:
+        # Connection errors, timeouts and 5xx: LNbits may come back, so the withdraw is owed
+        return adiar_saque(amount_brl, amount_sats, "erro_http", e)
+    except LinkRecusado as e:
+        # LNbits answered and refused (bad key, wallet balance, amount): retrying will not help,
+        # so the stage fails and the journal keeps the withdraw for the operator
+        print(f"❌ LNbits recusou o saque: {e}")
+        return {"success": False, "error": str(e)}
     except Exception as e:
         print(f"❌ Erro ao criar withdraw: {e}")
-        print("🔄 Gerando QR simulado como fallback")
-        return create_simulated_withdraw(amount_brl)
+        return {"success": False, "error": str(e)}
+
+def cotar_link_pool(amount_brl):
+    """Quote for pooled links; None unless the quote is fresh and the sources agree (links are then made on demand)"""
+    if not price_feed.confiavel():
+        return None
+    return calculate_sats_from_brl(amount_brl * 0.95)
+
+def iniciar_pool_saques():
+    """Start the background withdraw link pool"""
+    global withdraw_pool
+    
+    if not POOL_ATIVO or not lnbits_configurado():
+        return
+    
+    withdraw_pool = WithdrawPool(
+        lightning.criar_links,  # Each refill is one concurrent batch
+        cotar=cotar_link_pool,
+        apagar_link=lightning.apagar_link,
+        denominacoes=sorted({valor for canal in canais.values() for valor in canal.mapa.values()}),
+        tamanho=POOL_TAMANHO,
+        tolerancia=POOL_TOLERANCIA,
+        intervalo=POOL_INTERVALO,
+        arquivo=POOL_ARQUIVO,
+    )
+    withdraw_pool.start()
+
+def iniciar_fila_saques():
+    """Start the offline withdraw queue (replays owed withdraws once LNbits answers)"""
+    global fila_saques
+    
+    if not lnbits_configurado():
+        return
+    if not resgate_publico():
+        if not (FILA_SAQUES_ARQUIVO and os.path.exists(FILA_SAQUES_ARQUIVO)):
+            print("⚠️  Fila offline desativada: defina RESGATE_URL com um endereço que o celular do cliente alcance")
+            return
+        print("⚠️  RESGATE_URL ausente ou local: a fila só repete os saques já devidos")
+    
+    fila_saques = WithdrawQueue(
+        lambda pedidos: lightning.criar_links(pedidos, recusas=True),
+        arquivo=FILA_SAQUES_ARQUIVO,
+        on_pronto=publicar_resgate,
+        lote=FILA_SAQUES_LOTE,
+        intervalo=FILA_SAQUES_INTERVALO,
+    )
+    fila_saques.start()
 
 def create_simulated_withdraw(amount_brl):
     """Create a simulated withdraw for testing"""
@@ -258,32 +683,27 @@ def create_simulated_withdraw(amount_brl):
         "withdraw_id": fake_id,
         "amount_brl": amount_brl,
         "amount_sats": amount_sats,
-        "simulated": True
+        "simulated": True,
+        "origem": "simulado"
     }
 
 def generate_qr_code(data, filename):
     """Generate and display QR code"""
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=1,  # Smaller for terminal display
-            border=2,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
+        qr = qr_cache.obter(data)
         
-        # Print QR code to terminal with better formatting
-        print("\n" + "=" * 50)
-        print("📱 QR CODE PARA SAQUE LIGHTNING:")
-        print("=" * 50)
-        qr.print_ascii(invert=False)
-        print("=" * 50)
+        # Print QR code to terminal (kept out of journald in daemon mode)
+        if LOG_QR_ASCII if LOG_QR_ASCII is not None else not daemon_mode:
+            print("\n" + "=" * 50)
+            print("📱 QR CODE PARA SAQUE LIGHTNING:")
+            print("=" * 50)
+            print(qr.ascii())
+            print("=" * 50)
         
         # Save QR code as image
-        img = qr.make_image(fill_color="black", back_color="white")
-        img.save(filename)
-        print(f"💾 QR Code salvo em: {filename}")
+        with open(filename, "wb") as f:
+            f.write(qr.png(box_size=10, borda=4))
+        LOG.info("qr_gerado", f"💾 QR Code salvo em: {filename}", arquivo=filename, qr_id=qr.id)
         
         return True
         
@@ -291,69 +711,99 @@ def generate_qr_code(data, filename):
         print(f"❌ Erro ao gerar QR code: {e}")
         return False
 
-def gpio_polling_loop():
-    """Continuously poll GPIO for pulse detection"""
-    global contador_pulsos, ultimo_tempo, ultimo_tempo_pulso, processando, timer_ativo
-    
-    previous_state = GPIO.input(PINO_SINAL)
-    print(f"🔍 Polling iniciado - Estado inicial: {'HIGH' if previous_state else 'LOW'}")
+def criar_framer(on_nota):
+    """Note framer over the pulse ring with one state machine per acceptor channel"""
+    return NoteFramer(
+        pulse_ring,
+        on_nota=on_nota,
+        canais=[CanalNota(canal.nome, **parametros_framing(canal)) for canal in canais.values()],
+        intervalo_log=LOG_PULSO_INTERVALO,
+    )
+
+def parametros_framing(canal):
+    """Global framing settings, overridden by the channel's profile timing, then by its own keys"""
+    parametros = {
+        "debounce": TEMPO_DEBOUNCE,
+        "debounce_min": DEBOUNCE_MIN,
+        "fator_debounce": FATOR_DEBOUNCE,
+        "largura_min": LARGURA_MIN_PULSO,
+        "timeout_max": TIMEOUT_SEM_PULSOS,
+        "timeout_min": TIMEOUT_MIN_NOTA,
+        "fator_gap": FATOR_GAP_FIM_NOTA,
+    }
+    parametros.update(canal.perfil.timing)
+    for chave in ("debounce", "largura_min", "timeout_max"):
+        if getattr(canal, chave):
+            parametros[chave] = getattr(canal, chave)
+    return parametros
+
+def iniciar_framing():
+    """Start the note framing worker and the note processing worker"""
+    global note_framer
     
+    note_framer = criar_framer(lambda pulsos, canal: fila_notas.put((pulsos, canal)))
+    note_framer.start()
+    threading.Thread(target=nota_worker_loop, name="notas", daemon=True).start()
+
+def nota_worker_loop():
+    """Process framed notes one at a time, off the framing worker"""
+    while not shutdown_event.is_set():
+        try:
+            pulsos, canal = fila_notas.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        try:
+            processar_nota(pulsos, canal)
+        except Exception as e:
+            print(f"❌ Erro ao processar nota: {e}")
+
+async def processar_notas_async(fila):
+    """Asyncio runtime: process framed notes one at a time (replaces the note worker thread)"""
     while True:
+        pulsos, canal = await fila.get()
         try:
-            current_state = GPIO.input(PINO_SINAL)
-            tempo_atual = time.time()
-            
-            # Detect falling edge (HIGH -> LOW) = pulse from bill acceptor
-            if previous_state == 1 and current_state == 0:
-                with lock:
-                    # Debounce filter
-                    if tempo_atual - ultimo_tempo > TEMPO_DEBOUNCE:
-                        contador_pulsos += 1
-                        ultimo_tempo = tempo_atual
-                        ultimo_tempo_pulso = tempo_atual  # Update last pulse time
-                        print(f"🟡 Pulso detectado! Total: {contador_pulsos}")
-                        
-                        # Cancel previous timer if exists and start new one
-                        if timer_ativo:
-                            timer_ativo.cancel()
-                        
-                        # Start/restart timeout to detect end of note insertion
-                        if not processando:
-                            processando = True
-                        
-                        timer_ativo = threading.Timer(TIMEOUT_SEM_PULSOS, processar_nota)
-                        timer_ativo.start()
-            
-            previous_state = current_state
-            time.sleep(0.01)  # 10ms polling interval
-            
+            processar_nota(pulsos, canal)
         except Exception as e:
-            print(f"❌ Erro no polling GPIO: {e}")
-            break
+            print(f"❌ Erro ao processar nota: {e}")
 
-def processar_nota():
-    """Process detected note after timeout (when pulses stop arriving)"""
-    global contador_pulsos, total_sessao, notas_sessao, processando, timer_ativo
-    
-    print(f"⏱️  Timeout atingido - processando nota...")
-    
-    with lock:
-        if not processando:  # Avoid double processing
-            return
-            
-        pulsos_detectados = contador_pulsos
-        contador_pulsos = 0  # Reset counter immediately
-        processando = False
-        timer_ativo = None  # Clear timer reference
+def processar_nota(pulsos_detectados, canal=None):
+    """Process a note framed by the note framer (after pulses stop arriving)"""
+    canal = canais.get(canal) or canal_padrao()
+    print(f"⏱️  Fim de nota detectado em '{canal.nome}' "
+          f"(janela {note_framer.timeout_atual(canal.indice):.2f}s) - processando nota...")
     
     if pulsos_detectados == 0:
         return
+    inicio.marco("primeira_nota")
     
-    print(f"\n📊 Processando nota com {pulsos_detectados} pulsos...")
+    ident = uuid.uuid4().hex[:12]  # Correlation id for this note and its withdraw
+    with correlacao(ident):
+        LOG.info("nota_enquadrada", f"\n📊 Processando nota com {pulsos_detectados} pulsos...",
+                 pulsos=pulsos_detectados, canal=canal.nome)
+        timing = note_framer.diagnostico(canal.indice)
+        if timing and timing["pulsos"] == pulsos_detectados and timing["largura"]:
+            periodo = f" a cada {timing['intervalo']['mediana_ms']:.0f} ms" if timing["intervalo"] else ""
+            LOG.info("nota_timing", f"📐 Pulsos de {timing['largura']['mediana_ms']:.0f} ms{periodo}, "
+                     f"debounce {timing['debounce_ms']:.0f} ms, {timing['glitches']} glitch(es)", **timing)
+        diario.registrar(journal.PULSOS, ident, pulsos=pulsos_detectados, canal=canal.nome)
+        identificar_nota(pulsos_detectados, ident, canal, timing=timing)
+
+def identificar_nota(pulsos_detectados, ident, canal, timing=None):
+    """Classify the pulse count to a note value with the channel's profile and queue its withdraw"""
+    classificacao = classificar_nota(pulsos_detectados, canal.mapa, canal.perfil, canal.nome)
+    if classificacao.resultado != "exata":
+        # Approximate matches are audited too: the operator can compare them with the cash box
+        auditoria.registrar(ident=ident, canal=canal.nome, perfil=canal.perfil.nome,
+                            timing=timing if timing and timing["pulsos"] == pulsos_detectados else None,
+                            **classificacao._asdict())
     
-    # Identify note value
-    if pulsos_detectados in PULSO_PARA_REAL:
-        valor = PULSO_PARA_REAL[pulsos_detectados]
+    if classificacao.valor is not None:
+        valor = classificacao.valor
+        if classificacao.resultado == "aproximada":
+            LOG.aviso("nota_aproximada", f"⚠️  {pulsos_detectados} pulsos classificados como R$ {valor:.2f} "
+                      f"({classificacao.esperado} esperados, confiança {classificacao.confianca:.0%})",
+                      pulsos=pulsos_detectados, esperado=classificacao.esperado,
+                      confianca=classificacao.confianca, valor_brl=valor, canal=canal.nome)
         
         nota = {
             "pulsos": pulsos_detectados,
@@ -361,95 +811,370 @@ def processar_nota():
             "timestamp": datetime.now().isoformat()
         }
         
-        notas_sessao.append(nota)
-        total_sessao += valor
+        with lock:
+            canal.notas_sessao.append(nota)
+            canal.total_sessao += valor
         
-        print("=" * 50)
-        print(f"💰 NOTA DETECTADA: R$ {valor:.2f}")
-        print(f"📈 Total da sessão: R$ {total_sessao:.2f}")
-        print(f"🗓️  Timestamp: {datetime.now().strftime('%H:%M:%S')}")
-        print("=" * 50)
+        LOG.info("nota_detectada", "=" * 50 + f"\n💰 NOTA DETECTADA: R$ {valor:.2f} ({canal.nome})\n"
+                 f"📈 Total da sessão: R$ {canal.total_sessao:.2f}\n"
+                 f"🗓️  Timestamp: {datetime.now().strftime('%H:%M:%S')}\n" + "=" * 50,
+                 valor_brl=valor, pulsos=pulsos_detectados, canal=canal.nome, total_sessao=canal.total_sessao)
+        reportar_frota("nota", valor_brl=valor, pulsos=pulsos_detectados, canal=canal.nome)
         
-        # Enviar pulsos para o frontend local
-        enviar_pulsos_para_frontend(pulsos_detectados, valor)
-        
-        # Automatically generate QR code for each note
-        print(f"\n⚡ Gerando QR code automaticamente para R$ {valor:.2f}...")
-        gerar_saque(valor)
+        if sessoes:
+            # One withdraw per customer: the note joins the open session and the display shows the running total
+            sessao = sessoes.adicionar(canal.nome, valor, pulsos=pulsos_detectados, ident=ident)
+            LOG.info("sessao_nota", f"🧾 Sessão: R$ {sessao['total']:.2f} em {sessao['notas']} nota(s) "
+                     f"(~{sessao['sats']:,} sats, provisório)", sessao=sessao["id"], valor_brl=sessao["total"],
+                     sats=sessao["sats"], notas=sessao["notas"], canal=canal.nome)
+            publicar_sessao(sessao)
+        else:
+            # Automatically generate QR code for each note (frontend notified by the pipeline)
+            print(f"\n⚡ Gerando QR code automaticamente para R$ {valor:.2f}...")
+            gerar_saque(valor, pulsos=pulsos_detectados, ident=ident, canal=canal.nome)
         
         print(f"\n💵 Aguardando próxima nota ou comandos...")
     
     else:
-        print(f"⚠️  Quantidade de pulsos não reconhecida: {pulsos_detectados}")
-        print(f"💡 Valores válidos: {list(PULSO_PARA_REAL.keys())} pulsos")
+        # The acceptor kept the note: recorded in the audit file, never silently dropped
+        provavel = canal.mapa.get(classificacao.esperado)
+        LOG.aviso("pulsos_desconhecidos", f"⚠️  Quantidade de pulsos não reconhecida: {pulsos_detectados} "
+                  f"({classificacao.motivo}"
+                  f"{f', mais próxima R$ {provavel:.2f} com confiança {classificacao.confianca:.0%}' if provavel else ''})\n"
+                  f"💡 Valores válidos: {list(canal.mapa.keys())} pulsos - registrado em {AUDITORIA_NOTAS}",
+                  pulsos=pulsos_detectados, esperado=classificacao.esperado, confianca=classificacao.confianca,
+                  motivo=classificacao.motivo, canal=canal.nome)
+        reportar_frota("erro", etapa="pulsos", erro=f"{pulsos_detectados} pulsos não reconhecidos "
+                       f"({classificacao.motivo})", canal=canal.nome, perfil=canal.perfil.nome,
+                       confianca=classificacao.confianca)
         # Don't reset session on unknown pulse count, just continue
 
-def gerar_saque(valor=None):
-    """Generate Lightning withdrawal QR code"""
-    global total_sessao
+def iniciar_pipeline():
+    """Start the staged withdraw pipeline (asyncio runtime: call from inside the loop)"""
+    global pipeline_saque
+    
+    on_erro = lambda etapa, saque, erro: reportar_frota("erro", etapa=etapa, erro=str(erro), id=saque.get("id"))
+    if RUNTIME == "asyncio":
+        # Network stages are awaited and only the QR render leaves the loop
+        pipeline_saque = (
+            AsyncPipeline("saque", on_erro=on_erro)
+            .etapa("nota", correlacionada(etapa_nota_async), capacidade=PIPELINE_CAPACIDADE)
+            .etapa("cotacao", correlacionada(etapa_cotacao), capacidade=PIPELINE_CAPACIDADE)
+            .etapa("saque", correlacionada(etapa_saque_async), workers=PIPELINE_WORKERS_SAQUE,
+                   capacidade=PIPELINE_CAPACIDADE)
+            .etapa("qr", correlacionada(etapa_qr), workers=PIPELINE_WORKERS_QR, capacidade=PIPELINE_CAPACIDADE,
+                   bloqueante=True)
+            .etapa("display", correlacionada(etapa_display_async), capacidade=PIPELINE_CAPACIDADE, ordenada=True)
+        )
+    else:
+        pipeline_saque = (
+            Pipeline("saque", on_erro=on_erro)
+            .etapa("nota", correlacionada(etapa_nota), capacidade=PIPELINE_CAPACIDADE)
+            .etapa("cotacao", correlacionada(etapa_cotacao), capacidade=PIPELINE_CAPACIDADE)
+            .etapa("saque", correlacionada(etapa_saque), workers=PIPELINE_WORKERS_SAQUE,
+                   capacidade=PIPELINE_CAPACIDADE)
+            .etapa("qr", correlacionada(etapa_qr), workers=PIPELINE_WORKERS_QR, capacidade=PIPELINE_CAPACIDADE)
+            .etapa("display", correlacionada(etapa_display), capacidade=PIPELINE_CAPACIDADE, ordenada=True)
+        )
+    pipeline_saque.start()
+
+def correlacionada(etapa):
+    """Run a pipeline stage with the withdraw id attached to every log record"""
+    if asyncio.iscoroutinefunction(etapa):
+        async def executar_async(saque):
+            with correlacao(saque["id"]):
+                return await etapa(saque)
+        return executar_async
+    
+    def executar(saque):
+        with correlacao(saque["id"]):
+            return etapa(saque)
+    return executar
+
+def etapa_nota(saque):
+    """Pipeline stage: tell the frontend a note was accepted"""
+    if saque.get("pulsos") and not saque.get("recuperado"):
+        with METRICA_FRONTEND.medir(tipo="pulsos"):
+            enviar_pulsos_para_frontend(saque["pulsos"], saque["valor"], saque.get("canal"))
+    return saque
+
+async def etapa_nota_async(saque):
+    """etapa_nota() for the asyncio runtime"""
+    if saque.get("pulsos") and not saque.get("recuperado"):
+        with METRICA_FRONTEND.medir(tipo="pulsos"):
+            await enviar_para_frontend_async("pulsos", dados_pulsos(saque["pulsos"], saque["valor"],
+                                                                    saque.get("canal")))
+    return saque
+
+def etapa_cotacao(saque):
+    """Pipeline stage: quote the withdraw amount in satoshis (5% fee)"""
+    if "amount_sats" not in saque:  # Recovered withdraws keep their original quote
+        saque["amount_sats"] = calculate_sats_from_brl(saque["valor"] * 0.95)
+        diario.registrar(journal.COTACAO, saque["id"], amount_sats=saque["amount_sats"],
+                         preco=get_btc_price())
+    return saque
+
+def etapa_saque(saque):
+    """Pipeline stage: create the LNbits withdraw link"""
+    if "resultado" in saque:  # Recovered withdraw whose link already exists
+        return saque
+    
+    inicio = time.perf_counter()
+    resultado = create_lnbits_withdraw(saque["valor"], amount_sats=saque["amount_sats"])
+    return concluir_saque(saque, resultado, inicio)
+
+async def etapa_saque_async(saque):
+    """etapa_saque() for the asyncio runtime"""
+    if "resultado" in saque:
+        return saque
+    
+    inicio = time.perf_counter()
+    resultado = await create_lnbits_withdraw_async(saque["valor"], amount_sats=saque["amount_sats"])
+    return concluir_saque(saque, resultado, inicio)
+
+def concluir_saque(saque, resultado, inicio):
+    """Record a created withdraw (log, fleet, journal) on the pipeline item"""
+    METRICA_SAQUE.observe(time.perf_counter() - inicio, origem=resultado.get("origem", "lnbits"))
+    
+    if not resultado["success"]:
+        raise RuntimeError(resultado.get('error', 'Erro desconhecido'))
+    
+    LOG.info("saque_criado", f"✅ Saque criado com sucesso!\n"
+             f"💰 Valor: R$ {resultado['amount_brl']:.2f} ({resultado['amount_sats']} sats)\n"
+             f"🆔 ID: {resultado['withdraw_id']}",
+             valor_brl=resultado["amount_brl"], sats=resultado["amount_sats"],
+             withdraw_id=resultado["withdraw_id"], origem=resultado.get("origem"))
+    
+    if resultado.get('simulated'):
+        print("🎯 MODO SIMULAÇÃO - QR Code de teste")
+    elif resultado.get('resgate'):
+        print(f"📥 LNbits indisponível - QR de resgate {resultado['resgate']}")
+    
+    saque["resultado"] = resultado
+    reportar_frota("saque", valor_brl=resultado["amount_brl"], sats=resultado["amount_sats"],
+                   origem=resultado.get("origem", "lnbits"), simulado=bool(resultado.get("simulated")),
+                   id=saque["id"])
+    diario.registrar(journal.SAQUE, saque["id"], resultado=resultado)
+    return saque
+
+def etapa_qr(saque):
+    """Pipeline stage: render the QR code (terminal + PNG)"""
+    resultado = saque["resultado"]
+    filename = f"saque_{int(time.time())}_{resultado['withdraw_id']}.png"
+    with METRICA_QR.medir():
+        saque["qr_ok"] = generate_qr_code(resultado["lnurl"], filename)
+    return saque
+
+def etapa_display(saque):
+    """Pipeline stage: send the QR to the frontend (in note order)"""
+    resultado = saque["resultado"]
+    
+    if saque["qr_ok"]:
+        LOG.info("qr_exibido", f"\n🔗 LNURL: {resultado['lnurl']}", lnurl=resultado["lnurl"],
+                 withdraw_id=resultado["withdraw_id"])
+        
+        # Enviar QR code para o frontend
+        with METRICA_FRONTEND.medir(tipo="qrcode"):
+            enviar_qrcode_para_frontend(resultado["lnurl"], resultado["amount_brl"], saque.get("canal"),
+                                        resultado.get("resgate"), resultado["withdraw_id"])
+        concluir_exibicao(saque)
+    
+    return saque
+
+async def etapa_display_async(saque):
+    """etapa_display() for the asyncio runtime"""
+    resultado = saque["resultado"]
+    
+    if saque["qr_ok"]:
+        LOG.info("qr_exibido", f"\n🔗 LNURL: {resultado['lnurl']}", lnurl=resultado["lnurl"],
+                 withdraw_id=resultado["withdraw_id"])
+        with METRICA_FRONTEND.medir(tipo="qrcode"):
+            await enviar_para_frontend_async("qrcode", dados_qrcode(resultado["lnurl"], resultado["amount_brl"],
+                                                                    saque.get("canal"), resultado.get("resgate"),
+                                                                    resultado["withdraw_id"]))
+        concluir_exibicao(saque)
+    
+    return saque
+
+def concluir_exibicao(saque):
+    """Journal a displayed QR and tell the operator what kind of QR it was"""
+    resultado = saque["resultado"]
+    diario.registrar(journal.QR, saque["id"], withdraw_id=resultado["withdraw_id"])
+    if "inicio" in saque:
+        METRICA_NOTA_DISPLAY.observe(time.monotonic() - saque["inicio"])
+    
+    if resultado.get('simulated'):
+        print("\n⚠️  Este é um QR code simulado para testes!")
+        print("   Configure LNbits para gerar QR codes reais.")
+    elif resultado.get('resgate'):
+        print(f"\n📥 QR de resgate exibido (código {resultado['resgate']})")
+        print("   O link de saque será liberado na página de resgate quando o LNbits voltar.")
+    else:
+        print("\n✅ QR code real gerado via LNbits!")
+        print("   Escaneie com sua wallet Lightning!")
+
+def recuperar_saques():
+    """Replay the journal and resume withdraws interrupted by a crash or restart"""
+    pendentes = diario.recuperar()
+    diario.start()
+    
+    for ident, campos in pendentes.items():
+        saque = {"id": ident, "valor": campos["valor"], "pulsos": campos.get("pulsos"),
+                 "canal": campos.get("canal"), "recuperado": True}
+        if "amount_sats" in campos:
+            saque["amount_sats"] = campos["amount_sats"]
+        if "resultado" in campos:
+            saque["resultado"] = campos["resultado"]
+        
+        print(f"♻️  Retomando saque {ident} de R$ {saque['valor']:.2f} (etapa: {campos['etapa']})")
+        pipeline_saque.submit(saque)
+
+def gerar_saque(valor=None, pulsos=None, ident=None, canal=None):
+    """Queue a Lightning withdrawal on the pipeline (blocks only if the pipeline is full)"""
+    canal = canais.get(canal) or canal_padrao()
     
     if valor is None:
-        valor = total_sessao
+        valor = canal.total_sessao
     
     if valor <= 0:
         print("❌ Nenhum valor disponível para saque")
         return
     
-    print(f"\n⚡ Gerando saque Lightning de R$ {valor:.2f}...")
+    enfileirar_saque(valor, pulsos=pulsos, ident=ident, canal=canal.nome)
     
-    # Create LNbits withdraw link
-    resultado = create_lnbits_withdraw(valor)
+    # Reset session if full amount was withdrawn
+    if valor == canal.total_sessao:
+        reset_sessao(canal.nome)
+
+def enfileirar_saque(valor, pulsos=None, ident=None, canal=None):
+    """Journal a withdraw and submit it to the pipeline"""
+    # Journal first: from here on the amount is owed to the customer
+    ident = ident or uuid.uuid4().hex[:12]
+    with correlacao(ident):
+        LOG.info("saque_solicitado", f"\n⚡ Gerando saque Lightning de R$ {valor:.2f}...", valor_brl=valor)
+    diario.registrar(journal.NOTA, ident, valor=valor, pulsos=pulsos, canal=canal)
+    pipeline_saque.submit({"id": ident, "valor": valor, "pulsos": pulsos, "canal": canal,
+                           "inicio": time.monotonic()})
+
+def iniciar_sessoes():
+    """Start session batching (MODO_SAQUE = "sessao")"""
+    global sessoes
     
-    if resultado["success"]:
-        print(f"✅ Saque criado com sucesso!")
-        print(f"💰 Valor: R$ {resultado['amount_brl']:.2f} ({resultado['amount_sats']} sats)")
-        print(f"🆔 ID: {resultado['withdraw_id']}")
-        
-        if resultado.get('simulated'):
-            print("🎯 MODO SIMULAÇÃO - QR Code de teste")
-        
-        # Generate and display QR code
-        filename = f"saque_{int(time.time())}.png"
-        qr_success = generate_qr_code(resultado["lnurl"], filename)
-        
-        if qr_success:
-            print(f"\n🔗 LNURL: {resultado['lnurl']}")
-            
-            # Enviar QR code para o frontend
-            enviar_qrcode_para_frontend(resultado["lnurl"], resultado["amount_brl"])
-            
-            if resultado.get('simulated'):
-                print("\n⚠️  Este é um QR code simulado para testes!")
-                print("   Configure LNbits para gerar QR codes reais.")
-            else:
-                print("\n✅ QR code real gerado via LNbits!")
-                print("   Escaneie com sua wallet Lightning!")
-        
-        # Reset session if full amount was withdrawn
-        if valor == total_sessao:
-            reset_sessao()
+    if MODO_SAQUE != "sessao":
+        return
     
-    else:
-        print(f"❌ Erro ao gerar saque: {resultado.get('error', 'Erro desconhecido')}")
+    sessoes = SessionBatcher(
+        fechar_sessao,
+        cotar=lambda total: calculate_sats_from_brl(total * 0.95),
+        ociosa=SESSAO_OCIOSA,
+        duracao_max=SESSAO_DURACAO_MAX,
+        # Running total journaled under the batcher lock, so it always precedes the withdraw record
+        on_nota=lambda sessao: diario.registrar(journal.SESSAO, sessao["id"], valor=sessao["total"],
+                                                canal=sessao["canal"], notas=sessao["notas"]),
+    )
+    sessoes.start()
+    print(f"🧾 Modo sessão: um saque por cliente (fecha após {SESSAO_OCIOSA:.0f}s sem notas)")
 
-def reset_sessao():
-    """Reset current session"""
-    global total_sessao, notas_sessao
-    total_sessao = 0.0
-    notas_sessao = []
-    print("🔄 Sessão resetada")
+def iniciar_comandos():
+    """Start the command socket used by the display (session confirmation, claim status, webhooks)"""
+    global servidor_comandos
+    
+    try:
+        servidor_comandos = ComandoServer(CONTROLE_SOCKET, tratar_comando)
+        servidor_comandos.start()
+    except OSError as e:
+        print(f"⚠️  Socket de comandos indisponível: {e}")
+        servidor_comandos = None
 
-def mostrar_status():
-    """Show current session status"""
-    print(f"\n📊 STATUS DA SESSÃO:")
-    print(f"💰 Total acumulado: R$ {total_sessao:.2f}")
-    print(f"📄 Notas detectadas: {len(notas_sessao)}")
+def fechar_sessao(sessao, motivo):
+    """Turn a closed session into one withdraw"""
+    canal = canais.get(sessao["canal"]) or canal_padrao()
+    with lock:
+        # Notes that arrived after the close already belong to the next session
+        canal.total_sessao = max(0.0, canal.total_sessao - sessao["total"])
+        canal.notas_sessao = canal.notas_sessao[sessao["notas"]:]
     
-    if notas_sessao:
-        print("📝 Histórico:")
-        for i, nota in enumerate(notas_sessao, 1):
-            timestamp = datetime.fromisoformat(nota['timestamp']).strftime('%H:%M:%S')
-            print(f"  {i}. R$ {nota['valor']:.2f} ({nota['pulsos']} pulsos) - {timestamp}")
+    with correlacao(sessao["id"]):
+        LOG.info("sessao_fechada", f"🧾 Sessão fechada ({motivo}): R$ {sessao['total']:.2f} "
+                 f"em {sessao['notas']} nota(s)", motivo=motivo, valor_brl=sessao["total"],
+                 notas=sessao["notas"], canal=canal.nome)
+    enfileirar_saque(sessao["total"], ident=sessao["id"], canal=canal.nome)
+
+def tratar_comando(tipo, dados):
+    """Commands from the display (see ComandoServer)"""
+    if tipo == "confirmar":
+        if not sessoes:
+            return {"success": False, "error": "Modo sessão desativado"}
+        fechadas = sessoes.confirmar(dados.get("canal"))
+        return {"success": fechadas > 0, "sessoes": fechadas}
+    if tipo == "status_links":
+        # Claim watcher polling: one provider request for every link on display
+        return {"success": True, "status": lightning.status_links(dados.get("ids") or [])}
+    if tipo == "webhook":
+        # Claim webhook received by app.py; the provider knows its payload and token
+        withdraw_id = lightning.interpretar_webhook(dados.get("corpo"), dados.get("cabecalhos") or {})
+        return {"success": withdraw_id is not None, "withdraw_id": withdraw_id}
+    if tipo == "link":
+        # Display outcome of a withdraw link, for reconciliation (expired links keep their funds in LNbits)
+        evento = "saque_resgatado" if dados.get("evento") == "resgatado" else "saque_expirado"
+        LOG.info(evento, f"{'✅ Saque resgatado' if evento == 'saque_resgatado' else '⌛ QR expirou sem resgate'}: "
+                 f"{dados.get('withdraw_id')}", withdraw_id=dados.get("withdraw_id"))
+        return {"success": True}
+    return {"success": False, "error": f"Comando desconhecido: {tipo}"}
+
+def canal_padrao():
+    """First configured acceptor (used by commands that do not name a channel)"""
+    return next(iter(canais.values()))
+
+def escolher_canal():
+    """Ask which acceptor to use when more than one is configured"""
+    if len(canais) == 1:
+        return canal_padrao()
+    nome = input(f"Canal {list(canais)}: ").strip()
+    return canais.get(nome) or canal_padrao()
+
+def reset_sessao(canal=None):
+    """Reset the session of one channel (or of every channel)"""
+    if sessoes:
+        # Discarded on purpose: nothing is owed for these any more
+        for sessao in sessoes.descartar(canal if canal in canais else None):
+            diario.registrar(journal.CANCELADO, sessao["id"])
+    with lock:
+        for c in ([canais[canal]] if canal in canais else canais.values()):
+            c.total_sessao = 0.0
+            c.notas_sessao = []
+    print(f"🔄 Sessão resetada{f' ({canal})' if canal in canais and len(canais) > 1 else ''}")
+
+def sacar_sessoes():
+    """Withdraw the accumulated total of every channel"""
+    if sessoes:
+        print(f"🧾 {sessoes.confirmar()} sessão(ões) confirmada(s)")
+        return
+    for canal in list(canais.values()):
+        if canal.total_sessao > 0 or len(canais) == 1:
+            gerar_saque(canal=canal.nome)
+
+def mostrar_status():
+    """Show current session status (per channel)"""
+    for canal in canais.values():
+        print(f"\n📊 STATUS DA SESSÃO{f' - {canal.nome} (pino {canal.pino})' if len(canais) > 1 else ''}:")
+        print(f"💰 Total acumulado: R$ {canal.total_sessao:.2f}")
+        print(f"📄 Notas detectadas: {len(canal.notas_sessao)}")
+        
+        if canal.notas_sessao:
+            print("📝 Histórico:")
+            for i, nota in enumerate(canal.notas_sessao, 1):
+                timestamp = datetime.fromisoformat(nota['timestamp']).strftime('%H:%M:%S')
+                print(f"  {i}. R$ {nota['valor']:.2f} ({nota['pulsos']} pulsos) - {timestamp}")
+
+def mostrar_http():
+    """Show per-endpoint HTTP latency counters"""
+    print(f"\n🌐 ESTATÍSTICAS HTTP:")
+    for nome, stats in http.estatisticas().items():
+        circuito = "🔴 aberto" if stats["circuito_aberto"] else "🟢 fechado"
+        print(f"  {nome}: {stats['chamadas']} chamadas, {stats['erros']} erros, "
+              f"{stats['retries']} retries, média {stats['latencia_media_ms']} ms, "
+              f"máx {stats['latencia_max_ms']} ms, circuito {circuito}")
 
 def mostrar_ajuda():
     """Show available commands"""
@@ -461,24 +1186,42 @@ def mostrar_ajuda():
     print("  'config'           - Mostrar configurações")
     print("  'preco' ou 'p'     - Atualizar preço do Bitcoin")
     print("  'mapa' ou 'm'      - Adicionar mapeamento de pulsos")
+    print("  'rejeitadas'       - Notas rejeitadas ou aproximadas (auditoria)")
+    print("  'http'             - Mostrar latência das APIs")
     print("  'ajuda' ou 'h'     - Mostrar esta ajuda")
     print("  'sair' ou 'q'      - Sair do programa")
 
 def atualizar_preco():
     """Force update Bitcoin price"""
-    global last_price_update
-    last_price_update = 0  # Force update
-    price = get_btc_price()
-    print(f"💰 Preço atual do Bitcoin: R$ {price:,.2f}")
+    print("💱 Atualizando preço do Bitcoin...")
+    price_feed.atualizar()
+    print(f"💰 Preço atual do Bitcoin: R$ {price_feed.preco():,.2f}")
 
 def mostrar_config():
     """Show current configuration"""
     print(f"\n⚙️  CONFIGURAÇÃO ATUAL:")
-    print(f"🔌 GPIO: Pino {PINO_SINAL}")
-    print(f"⚡ LNbits URL: {LNBITS_URL}")
-    print(f"💰 Preço BTC atual: R$ {btc_price_brl:,.2f}")
-    print(f"📊 Última atualização: {datetime.fromtimestamp(last_price_update).strftime('%H:%M:%S') if last_price_update else 'Nunca'}")
-    print(f"📋 Valores aceitos: {list(PULSO_PARA_REAL.values())} BRL")
+    for canal in canais.values():
+        print(f"🔌 GPIO: Pino {canal.pino} ({canal.nome})")
+    print(f"⚡ LNbits URL: {LNBITS_URL} (provedor {LIGHTNING_PROVIDER}, até {LIGHTNING_CONCORRENCIA} em paralelo)")
+    cotacao = price_feed.cotacao()
+    print(f"💰 Preço BTC atual: R$ {cotacao.preco:,.2f} ({cotacao.origem}: {', '.join(cotacao.fontes) or '-'})")
+    print(f"📊 Última atualização: {datetime.fromtimestamp(cotacao.atualizado_em).strftime('%H:%M:%S') if cotacao.atualizado_em else 'Nunca'}"
+          f"{' ⚠️  desatualizado' if price_feed.obsoleta() else ''}")
+    for canal in canais.values():
+        print(f"📋 Valores aceitos ({canal.nome}, perfil {canal.perfil.nome}: {canal.perfil.descricao}): "
+              f"{list(canal.mapa.values())} BRL")
+    if withdraw_pool:
+        print(f"🏦 Pool de saques: {withdraw_pool.disponiveis()} "
+              f"(acertos {withdraw_pool.acertos}, faltas {withdraw_pool.faltas})")
+    if fila_saques:
+        print(f"📥 Fila offline: {fila_saques.pendentes()} saques devidos "
+              f"({'LNbits fora do ar' if fila_saques.offline else 'LNbits ok'}, {fila_saques.criados} criados)")
+        for entrada in fila_saques.recusadas():
+            print(f"   ❌ Resgate {entrada['token']} (R$ {entrada['valor_brl']:.2f}) recusado pelo LNbits: "
+                  f"{entrada['recusado']} - acertar manualmente")
+    if diario.falhando:
+        print(f"❌ Journal sem gravar ({diario.erros} falhas): notas e saques ainda não estão em disco")
+    print(f"⏱️  Inicialização:\n{inicio.relatorio()}")
     
     # Show conversion examples
     print(f"\n💱 CONVERSÕES ATUAIS:")
@@ -491,44 +1234,50 @@ def adicionar_mapeamento():
     print("\n🔧 ADICIONAR NOVO MAPEAMENTO:")
     
     try:
+        canal = escolher_canal()
         pulsos = int(input("Quantidade de pulsos detectados: "))
         valor = float(input("Valor da nota em Reais (R$): "))
         
         if pulsos > 0 and valor > 0:
-            PULSO_PARA_REAL[pulsos] = valor
+            canal.mapa[pulsos] = valor
             print(f"✅ Mapeamento adicionado: {pulsos} pulsos = R$ {valor:.2f}")
-            print(f"📋 Mapeamentos atuais: {PULSO_PARA_REAL}")
+            print(f"📋 Mapeamentos atuais: {canal.mapa}")
         else:
             print("❌ Valores devem ser positivos")
             
     except ValueError:
         print("❌ Digite números válidos")
 
+def mostrar_auditoria():
+    """Show the latest rejected and approximately matched notes"""
+    registros = auditoria.recentes()
+    if not registros:
+        print("\n✅ Nenhuma nota rejeitada ou aproximada")
+        return
+    print(f"\n🧾 AUDITORIA DE NOTAS ({AUDITORIA_NOTAS}):")
+    for registro in registros:
+        quando = datetime.fromtimestamp(registro["ts"]).strftime('%d/%m %H:%M:%S')
+        desfecho = (f"R$ {registro['valor']:.2f}" if registro["valor"] is not None
+                    else f"rejeitada ({registro['motivo']})")
+        print(f"  {quando} [{registro['canal']}/{registro['perfil']}] {registro['pulsos']} pulsos "
+              f"(esperados {registro['esperado']}, confiança {registro['confianca']:.0%}) -> {desfecho}")
+
 def simular_nota():
     """Simulate note insertion for testing"""
-    global contador_pulsos, processando, timer_ativo
-    
     print("\n🎯 SIMULAÇÃO DE NOTA:")
-    print("Valores disponíveis:", list(PULSO_PARA_REAL.keys()))
     
     try:
+        canal = escolher_canal()
+        print("Valores disponíveis:", list(canal.mapa.keys()))
         pulsos = int(input("Digite a quantidade de pulsos: "))
         
-        if pulsos in PULSO_PARA_REAL:
-            with lock:
-                contador_pulsos = pulsos
-                processando = True
-                # Cancel any existing timer
-                if timer_ativo:
-                    timer_ativo.cancel()
-                # Start immediate processing for simulation
-                timer_ativo = threading.Timer(0.1, processar_nota)
-                timer_ativo.start()
+        if pulsos > 0:
+            # Hand the note straight to the framing worker (unknown counts exercise the classifier)
+            note_framer.simular(pulsos, canal.indice)
             
             print(f"🟡 Simulando {pulsos} pulsos...")
         else:
-            print(f"❌ Valor {pulsos} pulsos não reconhecido")
-            print(f"💡 Use 'mapa' para adicionar novos mapeamentos")
+            print("❌ Quantidade de pulsos deve ser positiva")
             
     except ValueError:
         print("❌ Digite um número válido")
@@ -559,6 +1308,71 @@ def run_daemon():
     
     print("🛑 Encerrando modo daemon...")
 
+async def executar_async(pronto=None):
+    """Asyncio runtime: framing, note processing, price refresh and the withdraw pipeline as tasks on one loop"""
+    global http_async, parada_async, loop_async, note_framer
+    
+    loop_async = asyncio.get_running_loop()
+    parada_async = asyncio.Event()
+    http_async = AsyncHttpClient(http)
+    fila = asyncio.Queue()  # Framed notes, filled on the loop thread by the framing task
+    
+    iniciar_pipeline()
+    recuperar_saques()
+    note_framer = criar_framer(lambda pulsos, canal: fila.put_nowait((pulsos, canal)))
+    tarefas = [
+        asyncio.create_task(note_framer.executar_async(), name="framing"),
+        asyncio.create_task(processar_notas_async(fila), name="notas"),
+        asyncio.create_task(price_feed.executar_async(http_async), name="preco"),
+    ]
+    print(f"⚙️  Runtime asyncio ativo (HTTP {'aiohttp' if http_async.nativo else 'síncrono em executor'})")
+    
+    if pronto:
+        pronto.set()
+    try:
+        await parada_async.wait()
+    finally:
+        pipeline_saque.stop()
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        await http_async.close()
+
+def parar_async():
+    """Ask the asyncio runtime to stop (any thread)"""
+    if loop_async and parada_async:
+        try:
+            loop_async.call_soon_threadsafe(parada_async.set)
+        except RuntimeError:
+            pass  # Loop already closed
+
+def run_async():
+    """Run the asyncio runtime: on the main thread in daemon mode, beside the prompt otherwise"""
+    if daemon_mode:
+        print("🤖 Modo daemon ativo (asyncio) - aguardando notas e sinais de shutdown...")
+        print("💵 Sistema pronto para detectar notas...")
+        
+        async def principal():
+            loop = asyncio.get_running_loop()
+            for sinal in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sinal, parar_async)
+            await executar_async()
+        
+        asyncio.run(principal())
+        print("🛑 Encerrando modo daemon...")
+        return
+    
+    # The prompt keeps the main thread; interactive commands reach the loop thread-safely
+    pronto = threading.Event()
+    runtime = threading.Thread(target=lambda: asyncio.run(executar_async(pronto)), name="asyncio", daemon=True)
+    runtime.start()
+    pronto.wait(timeout=10)
+    try:
+        run_interactive()
+    finally:
+        parar_async()
+        runtime.join(timeout=10)
+
 def run_interactive():
     """Run in interactive mode with command input"""
     print("\n🚀 Sistema iniciado! Digite 'ajuda' para ver os comandos.")
@@ -576,7 +1390,7 @@ def run_interactive():
             elif comando in ['status', 's']:
                 mostrar_status()
             elif comando in ['sacar', 'withdraw', 'w']:
-                gerar_saque()
+                sacar_sessoes()
             elif comando in ['reset', 'r']:
                 reset_sessao()
             elif comando in ['teste', 'test', 't']:
@@ -587,6 +1401,10 @@ def run_interactive():
                 atualizar_preco()
             elif comando in ['mapa', 'map', 'm']:
                 adicionar_mapeamento()
+            elif comando == 'http':
+                mostrar_http()
+            elif comando == 'rejeitadas':
+                mostrar_auditoria()
             elif comando == '':
                 continue
             else:
@@ -599,12 +1417,36 @@ def run_interactive():
 
 def main():
     """Main function"""
-    global btc_price_brl, last_price_update, daemon_mode
+    global daemon_mode, PULSE_BACKEND, SIM_TRACE, RUNTIME, MODO_SAQUE
     
     # Check for daemon mode flag
-    if len(sys.argv) > 1 and sys.argv[1] == '--daemon':
+    if '--daemon' in sys.argv[1:]:
         daemon_mode = True
     
+    # Single event loop instead of worker threads
+    if '--asyncio' in sys.argv[1:]:
+        RUNTIME = "asyncio"
+    
+    # One withdraw per customer session instead of one per note
+    if '--sessao' in sys.argv[1:]:
+        MODO_SAQUE = "sessao"
+    
+    # Replay an edge trace instead of reading GPIO: --sim <trace>
+    if '--sim' in sys.argv[1:]:
+        indice = sys.argv.index('--sim')
+        if indice + 1 >= len(sys.argv):
+            print("❌ Uso: atm-simple.py [--daemon] [--asyncio] [--sessao] [--sim arquivo_trace]")
+            return
+        PULSE_BACKEND = "sim"
+        SIM_TRACE = sys.argv[indice + 1]
+    
+    # Logs are written by a background thread; in daemon mode every print() goes
+    # through it too, so a slow journald flush never stalls the pulse path
+    LOG.configurar(nivel=LOG_NIVEL, formato=LOG_FORMATO or ("json" if daemon_mode else "texto"))
+    LOG.start()
+    if daemon_mode:
+        LOG.capturar_stdout()
+    
     print("=" * 60)
     print("    ATM BITCOIN LIGHTNING - VERSÃO TERMINAL SIMPLES")
     print("=" * 60)
@@ -614,12 +1456,22 @@ def main():
     else:
         print("🖥️  Iniciando em modo interativo")
     
-    # Initialize Bitcoin price
-    print("🔄 Inicializando preço do Bitcoin...")
-    get_btc_price()
+    # Arm pulse capture first: edges wait in the ring while the rest starts up,
+    # so a note inserted right after a power cut is still counted
+    with inicio.fase("captura"):
+        gpio_disponivel = setup_gpio()
+        if gpio_disponivel:
+            fonte_pulsos.start()
+    armada = inicio.marco("captura_armada")
+    if not gpio_disponivel:
+        print("❌ Erro na inicialização do GPIO - usando modo simulação")
+    else:
+        print(f"✅ Monitoramento de pulsos ativo ({fonte_pulsos.nome})")
+        if armada > INICIO_META_CAPTURA:
+            print(f"⚠️  Captura armada em {armada:.2f}s (meta: {INICIO_META_CAPTURA:.1f}s)")
     
     # Check LNbits configuration
-    if LNBITS_URL == "https://your-lnbits-instance.com":
+    if not lnbits_configurado():
         print("⚠️  AVISO: Configure suas credenciais LNbits antes de usar!")
         print("   Edite as variáveis no topo do script:")
         print("   - LNBITS_URL")
@@ -627,28 +1479,64 @@ def main():
         print("   - LNBITS_WALLET_ID")
         print()
     
-    # Setup GPIO
-    if not setup_gpio():
-        print("❌ Erro na inicialização do GPIO - usando modo simulação")
-        gpio_disponivel = False
-    else:
-        gpio_disponivel = True
-        print("✅ GPIO inicializado com sucesso")
-        
-        # Start polling thread instead of interrupts
-        print("🔍 Iniciando monitoramento por polling...")
-        polling_thread = threading.Thread(target=gpio_polling_loop, daemon=True)
-        polling_thread.start()
-        print("✅ Monitoramento de pulsos ativo")
+    # Local services only (sockets, spool files, journal): nothing here waits on the network.
+    # Note framing runs even without GPIO so 'teste' keeps working
+    with inicio.fase("servicos"):
+        iniciar_metricas()
+        iniciar_bus_frontend()
+        iniciar_lightning()
+        iniciar_fila_saques()
+        iniciar_sessoes()
+        iniciar_comandos()
+    if RUNTIME != "asyncio":  # Otherwise started inside the event loop (executar_async)
+        with inicio.fase("notas"):
+            iniciar_pipeline()
+            recuperar_saques()
+            iniciar_framing()
+    
+    # Price (served from the disk cache until a network quote arrives), pool refills and
+    # fleet reporting are background threads; library imports and the LNbits connection
+    # are warmed up on their own thread
+    with inicio.fase("rede"):
+        if RUNTIME != "asyncio":
+            price_feed.start()
+        iniciar_pool_saques()
+        iniciar_frota()
+    inicio.em_segundo_plano("aquecimento", aquecer_rede)
+    inicio.marco("pronto")
+    print("📋 Inicialização:\n" + inicio.relatorio())
     
     try:
-        if daemon_mode:
+        if RUNTIME == "asyncio":
+            run_async()
+        elif daemon_mode:
             run_daemon()
         else:
             run_interactive()
     finally:
         cleanup_gpio()
+        if servidor_comandos:
+            servidor_comandos.stop()
+        if sessoes:
+            sessoes.stop()  # Open sessions stay journaled and are withdrawn on restart
+        price_feed.stop()
+        if withdraw_pool:
+            withdraw_pool.stop()
+        if fila_saques:
+            fila_saques.stop()  # Whatever is still owed stays in the spool
+        if bus_frontend:
+            bus_frontend.stop()
+        diario.stop()
+        auditoria.stop()
+        if servidor_metricas:
+            servidor_metricas.stop()
+        if frota:
+            frota.stop()
+        if lightning:
+            lightning.close()
+        http.close()
         print("👋 Obrigado por usar o ATM Bitcoin Lightning!")
+        LOG.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
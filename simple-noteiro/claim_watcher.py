@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Claim Watcher
+Follows the withdraw links on display until they are claimed or expire
+
+Claims normally arrive as webhooks (resgatado()); links the webhook never
+reported are polled in one batch through `consultar(ids)`, so a kiosk behind
+NAT, where LNbits cannot reach the webhook, still frees its screen.
+"""
+
+import threading
+import time
+
+
+class ClaimWatcher:
+    """Watched links keyed by withdraw id, each with an expiry deadline.
+
+    consultar(ids) returns {withdraw_id: {"usado": bool}} (ids it does not
+    know are left out) and may raise OSError/ValueError while the backend is
+    down. on_resgate(id) and on_expirado(id) are called once per link, from
+    the watcher thread or from the webhook caller, never with the lock held.
+    """
+
+    def __init__(self, consultar, on_resgate, on_expirado, intervalo=3.0, intervalo_max=30.0):
+        self.consultar = consultar
+        self.on_resgate = on_resgate
+        self.on_expirado = on_expirado
+        self.intervalo = intervalo
+        self.intervalo_max = intervalo_max
+        self._observados = {}  # withdraw_id -> monotonic expiry
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition(self._lock)
+        self._parar = False
+        self._thread = None
+        self.resgatados = 0
+        self.expirados = 0
+
+    def observar(self, withdraw_id, ttl):
+        """Watch a link for `ttl` seconds"""
+        with self._mudou:
+            self._observados[withdraw_id] = time.monotonic() + ttl
+            self._mudou.notify()
+
+    def esquecer(self, withdraw_id):
+        with self._lock:
+            self._observados.pop(withdraw_id, None)
+
+    def resgatado(self, withdraw_id):
+        """Claim reported by webhook; False if the link was not being watched"""
+        with self._lock:
+            if self._observados.pop(withdraw_id, None) is None:
+                return False
+            self.resgatados += 1
+        self._notificar(self.on_resgate, withdraw_id)
+        return True
+
+    def observados(self):
+        with self._lock:
+            return len(self._observados)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="resgates", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._mudou:
+            self._parar = True
+            self._mudou.notify()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _notificar(self, callback, withdraw_id):
+        try:
+            callback(withdraw_id)
+        except Exception as e:
+            print(f"⚠️  Erro ao tratar link {withdraw_id}: {e}")
+
+    def _loop(self):
+        espera = self.intervalo
+        while True:
+            with self._mudou:
+                while not self._observados and not self._parar:
+                    self._mudou.wait()
+                if self._parar:
+                    return
+                proximo = min(self._observados.values()) - time.monotonic()
+                self._mudou.wait(max(0.0, min(espera, proximo)))
+                if self._parar:
+                    return
+                agora = time.monotonic()
+                expirados = [i for i, prazo in self._observados.items() if prazo <= agora]
+                for withdraw_id in expirados:
+                    del self._observados[withdraw_id]
+                self.expirados += len(expirados)
+                ids = list(self._observados)
+
+            for withdraw_id in expirados:
+                self._notificar(self.on_expirado, withdraw_id)
+            if not ids:
+                continue
+
+            try:
+                status = self.consultar(ids)
+                espera = self.intervalo
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Consulta de resgates indisponível: {e}")
+                espera = min(espera * 2, self.intervalo_max)  # Backend or LNbits down: back off
+                continue
+
+            for withdraw_id, estado in status.items():
+                if estado.get("usado"):
+                    with self._lock:
+                        if self._observados.pop(withdraw_id, None) is None:
+                            continue  # Webhook got there first
+                        self.resgatados += 1
+                    self._notificar(self.on_resgate, withdraw_id)
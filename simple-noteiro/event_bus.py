@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Local Event Bus
+Backend -> frontend events over a Unix domain socket, with a durable spool and replay on reconnect
+
+Frame format: 4-byte big-endian length + UTF-8 JSON object.
+  publisher -> server: {"id": "<unique id>", "tipo": "...", "dados": {...}}
+  server -> publisher: {"ack": "<id>"}
+
+Commands from the frontend to the backend (e.g. the customer confirming a
+session) use a second socket served by the backend, one request per connection:
+  frontend -> backend: {"tipo": "...", "dados": {...}}
+  backend -> frontend: {"success": true, ...}
+"""
+
+import collections
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+
+_CABECALHO = struct.Struct(">I")
+TAMANHO_MAX_FRAME = 1024 * 1024
+_COMPACTAR = object()  # Spool queue marker: everything was acknowledged, rewrite the spool
+
+
+def enviar_frame(sock, obj):
+    """Write one length-prefixed JSON frame"""
+    dados = json.dumps(obj).encode()
+    sock.sendall(_CABECALHO.pack(len(dados)) + dados)
+
+
+def _ler_exato(sock, n):
+    partes = []
+    while n:
+        parte = sock.recv(n)
+        if not parte:
+            raise ConnectionError("Conexão encerrada")
+        partes.append(parte)
+        n -= len(parte)
+    return b"".join(partes)
+
+
+def ler_frame(sock):
+    """Read one length-prefixed JSON frame"""
+    (tamanho,) = _CABECALHO.unpack(_ler_exato(sock, _CABECALHO.size))
+    if tamanho > TAMANHO_MAX_FRAME:
+        raise ValueError(f"Frame muito grande: {tamanho} bytes")
+    return json.loads(_ler_exato(sock, tamanho))
+
+
+class BusPublisher:
+    """Backend side: queues events durably and delivers them in order until acknowledged.
+
+    Pending events live in memory and in an append-friendly spool file, so
+    neither a frontend restart nor a backend restart loses a display update.
+    The spool is written by its own thread, which keeps the file open and
+    fsyncs in batches at most every `intervalo_fsync` seconds (as journal.py
+    does), so publishers and the delivery thread never wait on the disk.
+    """
+
+    def __init__(self, caminho_socket, arquivo_spool=None, reconexao_max=5.0, intervalo_fsync=0.05):
+        self.caminho_socket = caminho_socket
+        self.arquivo_spool = arquivo_spool
+        self.reconexao_max = reconexao_max
+        self.intervalo_fsync = intervalo_fsync
+        self._pendentes = collections.OrderedDict()  # id -> event, in publish order
+        self._lock = threading.Lock()
+        self._novo = threading.Condition(self._lock)
+        self._parar = threading.Event()
+        self._thread = None
+        self._spool = queue.SimpleQueue()  # Events to append (and _COMPACTAR markers), in publish order
+        self._thread_spool = None
+        self.conectado = False
+        self.entregues = 0
+        self._carregar_spool()
+
+    def publicar(self, tipo, dados):
+        """Queue an event for the frontend; returns immediately"""
+        evento = {"id": uuid.uuid4().hex, "tipo": tipo, "dados": dados}
+        with self._novo:
+            self._pendentes[evento["id"]] = evento
+            self._novo.notify()
+        if self.arquivo_spool:
+            self._spool.put(evento)
+        return True
+
+    def pendentes(self):
+        with self._lock:
+            return len(self._pendentes)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="bus", daemon=True)
+        self._thread.start()
+        if self.arquivo_spool:
+            self._thread_spool = threading.Thread(target=self._loop_spool, name="bus-spool", daemon=True)
+            self._thread_spool.start()
+
+    def stop(self):
+        """Stop delivering; events still pending stay in the spool for the next run"""
+        self._parar.set()
+        with self._novo:
+            self._novo.notify_all()
+        if self._thread_spool:
+            self._spool.put(None)
+            self._thread_spool.join(timeout=5)
+
+    def _loop(self):
+        espera = 0.1
+        while not self._parar.is_set():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.caminho_socket)
+                    self.conectado = True
+                    espera = 0.1
+                    if self.pendentes():
+                        print(f"📨 Bus conectado - reenviando {self.pendentes()} eventos pendentes")
+                    self._entregar(sock)
+            except (OSError, ValueError) as e:
+                if self.conectado:
+                    print(f"⚠️  Bus desconectado do frontend: {e}")
+            finally:
+                self.conectado = False
+
+            # Reconnect with exponential backoff (frontend restarting)
+            self._parar.wait(espera)
+            espera = min(self.reconexao_max, espera * 2)
+
+    def _entregar(self, sock):
+        while not self._parar.is_set():
+            with self._novo:
+                while not self._pendentes and not self._parar.is_set():
+                    self._novo.wait()
+                lote = list(self._pendentes.values())
+
+            # Deliver in order; each event stays pending until its ack arrives
+            for evento in lote:
+                enviar_frame(sock, evento)
+                resposta = ler_frame(sock)
+                if resposta.get("ack") != evento["id"]:
+                    raise ValueError(f"Ack inesperado: {resposta}")
+                with self._lock:
+                    self._pendentes.pop(evento["id"], None)
+                    self.entregues += 1
+                    if not self._pendentes and self.arquivo_spool:
+                        self._spool.put(_COMPACTAR)
+
+    def _coletar_spool(self):
+        """Everything queued for the spool within one fsync window"""
+        lote = [self._spool.get()]
+        limite = time.monotonic() + self.intervalo_fsync
+        while (restante := limite - time.monotonic()) > 0:
+            try:
+                lote.append(self._spool.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _loop_spool(self):
+        f = None
+        while True:
+            lote = self._coletar_spool()
+            try:
+                if _COMPACTAR in lote:
+                    # The rewrite holds every event still pending, including the ones in this batch
+                    if f is not None:
+                        f.close()
+                        f = None
+                    self._reescrever_spool()
+                else:
+                    with self._lock:
+                        # Events acknowledged while queued need no spooling
+                        eventos = [e for e in lote if e is not None and e["id"] in self._pendentes]
+                    if eventos:
+                        if f is None:
+                            f = open(self.arquivo_spool, "a")
+                        f.write("".join(json.dumps(e) + "\n" for e in eventos))
+                        f.flush()
+                        os.fsync(f.fileno())
+            except OSError as e:
+                print(f"⚠️  Erro ao gravar spool do bus: {e}")
+                if f is not None:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                    f = None
+            if None in lote:
+                if f is not None:
+                    f.close()
+                return
+
+    def _reescrever_spool(self):
+        # Spool thread only: the file holds exactly the events not yet acknowledged
+        with self._lock:
+            pendentes = list(self._pendentes.values())
+        try:
+            tmp = f"{self.arquivo_spool}.tmp"
+            with open(tmp, "w") as f:
+                for evento in pendentes:
+                    f.write(json.dumps(evento) + "\n")
+            os.replace(tmp, self.arquivo_spool)
+        except OSError as e:
+            print(f"⚠️  Erro ao compactar spool do bus: {e}")
+
+    def _carregar_spool(self):
+        if not self.arquivo_spool or not os.path.exists(self.arquivo_spool):
+            return
+        try:
+            with open(self.arquivo_spool) as f:
+                for linha in f:
+                    try:
+                        evento = json.loads(linha)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    self._pendentes[evento["id"]] = evento
+            if self._pendentes:
+                print(f"💾 Bus: {len(self._pendentes)} eventos pendentes recuperados")
+        except OSError as e:
+            print(f"⚠️  Erro ao ler spool do bus: {e}")
+
+
+class BusServer:
+    """Frontend side: accepts publisher connections and applies events exactly once"""
+
+    def __init__(self, caminho_socket, handler, memoria_ids=1000):
+        self.caminho_socket = caminho_socket
+        self.handler = handler  # Called with (tipo, dados)
+        self._vistos = collections.OrderedDict()  # Recently applied ids (replay dedup)
+        self._memoria_ids = memoria_ids
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def start(self):
+        if os.path.exists(self.caminho_socket):
+            os.unlink(self.caminho_socket)  # Stale socket from a previous run
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.caminho_socket)
+        os.chmod(self.caminho_socket, 0o600)
+        self._sock.listen(4)
+        threading.Thread(target=self._aceitar, name="bus-server", daemon=True).start()
+
+    def stop(self):
+        if self._sock:
+            self._sock.close()
+        try:
+            os.unlink(self.caminho_socket)
+        except OSError:
+            pass
+
+    def _aceitar(self):
+        while True:
+            try:
+                conexao, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._atender, args=(conexao,), daemon=True).start()
+
+    def _atender(self, conexao):
+        with conexao:
+            try:
+                while True:
+                    evento = ler_frame(conexao)
+                    self._aplicar(evento)
+                    enviar_frame(conexao, {"ack": evento["id"]})
+            except (ConnectionError, OSError):
+                pass
+            except Exception as e:
+                print(f"⚠️  Erro no bus: {e}")
+
+    def _aplicar(self, evento):
+        with self._lock:
+            if evento["id"] in self._vistos:
+                return  # Replayed after a lost ack
+            try:
+                self.handler(evento["tipo"], evento["dados"])
+            except Exception as e:
+                # Still acknowledged: a malformed event must not block the queue
+                print(f"⚠️  Erro ao aplicar evento '{evento['tipo']}': {e}")
+            self._vistos[evento["id"]] = True
+            while len(self._vistos) > self._memoria_ids:
+                self._vistos.popitem(last=False)
+
+
+class ComandoServer:
+    """Backend side of the command socket: handler(tipo, dados) returns the reply dict"""
+
+    def __init__(self, caminho_socket, handler):
+        self.caminho_socket = caminho_socket
+        self.handler = handler
+        self._sock = None
+
+    def start(self):
+        if os.path.exists(self.caminho_socket):
+            os.unlink(self.caminho_socket)  # Stale socket from a previous run
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.caminho_socket)
+        os.chmod(self.caminho_socket, 0o600)
+        self._sock.listen(4)
+        threading.Thread(target=self._aceitar, name="comandos", daemon=True).start()
+
+    def stop(self):
+        if self._sock:
+            self._sock.close()
+        try:
+            os.unlink(self.caminho_socket)
+        except OSError:
+            pass
+
+    def _aceitar(self):
+        while True:
+            try:
+                conexao, _ = self._sock.accept()
+            except OSError:
+                return
+            # One thread per command: a claim status poll waiting on LNbits must not delay a confirmation
+            threading.Thread(target=self._atender, args=(conexao,), name="comando", daemon=True).start()
+
+    def _atender(self, conexao):
+        with conexao:
+            try:
+                conexao.settimeout(1.0)
+                comando = ler_frame(conexao)
+                try:
+                    resposta = self.handler(comando.get("tipo"), comando.get("dados") or {})
+                except Exception as e:
+                    resposta = {"success": False, "error": str(e)}
+                enviar_frame(conexao, resposta)
+            except (ConnectionError, OSError, ValueError):
+                pass
+
+
+def enviar_comando(caminho_socket, tipo, dados=None, timeout=1.0):
+    """Send one command to a ComandoServer and return its reply (OSError if the backend is down)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(caminho_socket)
+        enviar_frame(sock, {"tipo": tipo, "dados": dados or {}})
+        return ler_frame(sock)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Fleet Reporter
+Kiosk side of the fleet service: buffers events and ships them as gzip-compressed batches
+
+POST {url}/api/ingest, Content-Encoding: gzip, body:
+  {"maquina": "<kiosk id>", "lote": "<batch id>", "eventos": [{"ts": ..., "tipo": "nota", ...}, ...]}
+A batch keeps its id across retries, so the server can drop duplicates.
+"""
+
+import collections
+import gzip
+import json
+import threading
+import time
+import uuid
+
+
+class FleetReporter:
+    """Bounded event buffer flushed to the fleet server every `intervalo` seconds or `lote_max` events.
+
+    registrar() never blocks and never does I/O; when the server is
+    unreachable the oldest events are dropped once `capacidade` is reached.
+    """
+
+    def __init__(self, http, url, maquina, intervalo=10.0, lote_max=500, capacidade=5000, token=None):
+        self.http = http
+        self.url = url.rstrip("/") + "/api/ingest"
+        self.maquina = maquina
+        self.intervalo = intervalo
+        self.lote_max = lote_max
+        self.token = token
+        self._eventos = collections.deque(maxlen=capacidade)
+        self._lote = None  # (id, events) being delivered; kept until acknowledged
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self.enviados = 0
+        self.descartados = 0
+
+    def registrar(self, tipo, **dados):
+        """Queue one event (nota, saque, erro, preco)"""
+        dados.update({"ts": time.time(), "tipo": tipo})
+        with self._lock:
+            if len(self._eventos) == self._eventos.maxlen:
+                self.descartados += 1
+            self._eventos.append(dados)
+            cheio = len(self._eventos) >= self.lote_max
+        if cheio:
+            self._acordar.set()
+
+    def pendentes(self):
+        with self._lock:
+            return len(self._eventos) + (len(self._lote[1]) if self._lote else 0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="frota", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sender after one last flush attempt"""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread:
+            self._thread.join(timeout=15)
+
+    def descarregar(self):
+        """Send pending events batch by batch; returns False when the server did not accept one"""
+        while True:
+            with self._lock:
+                if self._lote is None:
+                    if not self._eventos:
+                        return True
+                    eventos = [self._eventos.popleft() for _ in range(min(self.lote_max, len(self._eventos)))]
+                    self._lote = (uuid.uuid4().hex, eventos)
+                lote_id, eventos = self._lote
+
+            if not self._enviar(lote_id, eventos):
+                return False
+
+            with self._lock:
+                self._lote = None
+                self.enviados += len(eventos)
+
+    def _enviar(self, lote_id, eventos):
+        corpo = gzip.compress(json.dumps(
+            {"maquina": self.maquina, "lote": lote_id, "eventos": eventos},
+            separators=(",", ":"), default=str,
+        ).encode(), compresslevel=6)
+        cabecalhos = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        if self.token:
+            cabecalhos["Authorization"] = f"Bearer {self.token}"
+        try:
+            # Idempotent: the server deduplicates by batch id
+            response = self.http.post("frota", self.url, data=corpo, headers=cabecalhos, idempotente=True)
+        except Exception as e:
+            print(f"⚠️  Servidor da frota indisponível: {e}")
+            return False
+        if response.status_code in (200, 202):
+            return True
+        print(f"⚠️  Servidor da frota recusou lote: {response.status_code}")
+        return False
+
+    def _loop(self):
+        espera = self.intervalo
+        while not self._parar.is_set():
+            self._acordar.wait(espera)
+            self._acordar.clear()
+            # Back off while the server is down; the buffer bounds memory meanwhile
+            espera = self.intervalo if self.descarregar() else min(espera * 2, self.intervalo * 12)
+        self.descarregar()
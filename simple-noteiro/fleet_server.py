@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Servidor da Frota
+Recebe lotes de eventos (gzip) de vários quiosques e serve a API do painel da frota
+"""
+
+import collections
+import gzip
+import io
+import json
+import os
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+from fleet_store import NOTA, TIPOS, FleetStore
+
+app = Flask(__name__)
+
+# Configuração
+FROTA_ARQUIVO = "frota.db"  # Banco SQLite (eventos brutos + rollups por hora)
+FROTA_RETENCAO_DIAS = 30  # Eventos brutos mais antigos são apagados (rollups ficam)
+FROTA_TOKEN = os.environ.get("FROTA_TOKEN")  # Se definido, exigido no header Authorization
+FROTA_LIMITE_ONLINE = 120  # Segundos sem eventos até um quiosque aparecer offline
+TAMANHO_MAX_LOTE = 8 * 1024 * 1024  # Lote descomprimido máximo (bytes)
+MEMORIA_LOTES = 100000  # Ids de lotes lembrados para descartar reenvios
+
+# Servidor de produção (waitress), como no frontend do quiosque: um processo, várias threads
+# compartilhando o store (a thread de gravação do SQLite vive nele)
+SERVIDOR_PRODUCAO = True  # False: servidor de desenvolvimento do Flask
+SERVIDOR_THREADS = 8
+
+store = FleetStore(FROTA_ARQUIVO, retencao_dias=FROTA_RETENCAO_DIAS)
+
+lotes_vistos = collections.OrderedDict()
+lotes_lock = threading.Lock()
+
+def lote_repetido(lote_id):
+    """True se o lote já foi aceito (reenvio depois de um ack perdido)"""
+    with lotes_lock:
+        if lote_id in lotes_vistos:
+            return True
+        lotes_vistos[lote_id] = True
+        while len(lotes_vistos) > MEMORIA_LOTES:
+            lotes_vistos.popitem(last=False)
+        return False
+
+def esquecer_lote(lote_id):
+    with lotes_lock:
+        lotes_vistos.pop(lote_id, None)
+
+def periodo():
+    """Janela pedida na query string (?horas=24 ou ?desde=<epoch>&ate=<epoch>)"""
+    agora = time.time()
+    desde = request.args.get("desde", type=float)
+    if desde is None:
+        desde = agora - request.args.get("horas", default=24, type=float) * 3600
+    return desde, request.args.get("ate", type=float)
+
+@app.route('/api/ingest', methods=['POST'])
+def ingerir():
+    """Lote de eventos de um quiosque (gzip)"""
+    if FROTA_TOKEN and request.headers.get("Authorization") != f"Bearer {FROTA_TOKEN}":
+        return jsonify({"success": False, "error": "Não autorizado"}), 401
+
+    try:
+        corpo = request.get_data()
+        if request.headers.get("Content-Encoding") == "gzip":
+            corpo = gzip.GzipFile(fileobj=io.BytesIO(corpo)).read(TAMANHO_MAX_LOTE + 1)
+        if len(corpo) > TAMANHO_MAX_LOTE:
+            return jsonify({"success": False, "error": "Lote muito grande"}), 413
+        lote = json.loads(corpo)
+        maquina = str(lote["maquina"])
+        eventos = lote["eventos"]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return jsonify({"success": False, "error": f"Lote inválido: {e}"}), 400
+
+    lote_id = lote.get("lote")
+    if lote_id and lote_repetido(lote_id):
+        return jsonify({"success": True, "repetido": True}), 200
+
+    if not store.ingerir(maquina, eventos):
+        # Gravação saturada: o quiosque mantém o lote e reenvia depois
+        if lote_id:
+            esquecer_lote(lote_id)
+        return jsonify({"success": False, "error": "Servidor ocupado"}), 503, {"Retry-After": "5"}
+
+    return jsonify({"success": True, "eventos": len(eventos)}), 202
+
+@app.route('/api/frota')
+def frota():
+    """Resumo de todos os quiosques e totais da frota"""
+    maquinas = store.maquinas(limite_online=FROTA_LIMITE_ONLINE)
+    return jsonify({
+        "maquinas": maquinas,
+        "totais": {
+            "maquinas": len(maquinas),
+            "online": sum(1 for m in maquinas if m["online"]),
+            "notas": sum(m["notas"] for m in maquinas),
+            "total_brl": sum(m["total_brl"] for m in maquinas),
+            "saques": sum(m["saques"] for m in maquinas),
+            "erros": sum(m["erros"] for m in maquinas),
+        },
+    })
+
+@app.route('/api/frota/<maquina>')
+def detalhe_maquina(maquina):
+    """Resumo, eventos recentes e notas por denominação de um quiosque"""
+    resumo = store.maquina(maquina, limite_online=FROTA_LIMITE_ONLINE)
+    if resumo is None:
+        return jsonify({"success": False, "error": "Máquina desconhecida"}), 404
+
+    desde, ate = periodo()
+    return jsonify({
+        "resumo": resumo,
+        "denominacoes": store.denominacoes(desde, ate, maquina=maquina),
+        "recentes": store.eventos_recentes(maquina, limite=request.args.get("limite", default=50, type=int),
+                                           tipo=request.args.get("tipo")),
+    })
+
+@app.route('/api/denominacoes')
+def denominacoes():
+    """Notas (ou saques, ?tipo=saque) por denominação, de toda a frota ou de ?maquina="""
+    desde, ate = periodo()
+    tipo = request.args.get("tipo", NOTA)
+    return jsonify(store.denominacoes(desde, ate, maquina=request.args.get("maquina"), tipo=tipo))
+
+@app.route('/api/serie')
+def serie():
+    """Série temporal por tipo de evento (?tipo=nota&passo=3600&horas=24&maquina=)"""
+    tipo = request.args.get("tipo", NOTA)
+    if tipo not in TIPOS:
+        return jsonify({"success": False, "error": f"Tipo inválido: {tipo}"}), 400
+    desde, ate = periodo()
+    return jsonify(store.serie(tipo, desde, ate, passo=request.args.get("passo", default=3600, type=int),
+                               maquina=request.args.get("maquina")))
+
+@app.route('/api/ranking')
+def ranking():
+    """Quiosques com mais volume no período"""
+    desde, _ = periodo()
+    return jsonify(store.ranking(desde, tipo=request.args.get("tipo", NOTA),
+                                 limite=request.args.get("limite", default=20, type=int)))
+
+@app.route('/api/saude')
+def saude():
+    """Estado da ingestão"""
+    return jsonify({
+        "fila": store.pendentes(),
+        "ingeridos": store.ingeridos,
+        "recusados": store.recusados,
+        "invalidos": store.invalidos,
+        "arquivo_bytes": store.tamanho_arquivo(),
+    })
+
+def servir(host='0.0.0.0', port=3010):
+    """Serve com waitress (produção) ou, sem ele instalado, com o servidor de desenvolvimento do Flask"""
+    if SERVIDOR_PRODUCAO:
+        try:
+            from waitress import serve
+        except ImportError:
+            print("⚠️  waitress não instalado (pip install waitress): usando o servidor de desenvolvimento")
+        else:
+            print(f"🏭 Servidor de produção: waitress com {SERVIDOR_THREADS} threads")
+            serve(app, host=host, port=port, threads=SERVIDOR_THREADS, ident="atm-frota")
+            return
+    app.run(host=host, port=port, debug=False, threaded=True)
+
+if __name__ == '__main__':
+    print("🚀 Iniciando servidor da frota ATM Bitcoin Lightning...")
+    print("📥 Ingestão em: http://localhost:3010/api/ingest")
+    print("📊 Painel em: http://localhost:3010/api/frota")
+
+    store.start()
+    try:
+        servir()
+    finally:
+        store.stop()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Fleet Load Simulator
+Drives many simulated kiosks against fleet_server.py and reports ingestion throughput
+
+Every kiosk is a FleetReporter buffering synthetic notes, withdraws, errors and
+quotes; a small thread pool flushes them, so thousands of kiosks do not need
+thousands of threads.
+
+Uso:
+  python3 fleet_server.py &
+  python3 fleet_sim.py --maquinas 500 --duracao 60
+  python3 fleet_sim.py --maquinas 2000 --taxa 0.5 --url http://frota.local:3010
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fleet_reporter import FleetReporter  # noqa: E402
+from http_client import HttpClient  # noqa: E402
+
+NOTAS = (2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+PRECO_BTC = 350000.0
+
+
+def gerar_eventos(reporter, rng, quantidade):
+    """Queue `quantidade` notes on a kiosk, each followed by its withdraw, plus the odd error/quote"""
+    for _ in range(quantidade):
+        valor = rng.choice(NOTAS)
+        reporter.registrar("nota", valor_brl=valor, pulsos=int(valor // 2), canal="principal")
+        if rng.random() < 0.02:
+            reporter.registrar("erro", etapa="saque", erro="LNbits indisponível")
+        else:
+            reporter.registrar("saque", valor_brl=valor, sats=int(valor * 0.95 / PRECO_BTC * 1e8),
+                               origem=rng.choice(("lnbits", "pool")), simulado=False)
+    if rng.random() < 0.05:
+        reporter.registrar("preco", preco=PRECO_BTC * rng.uniform(0.99, 1.01), fontes=["coingecko"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador de carga da frota de ATMs")
+    parser.add_argument("--url", default="http://localhost:3010", help="Servidor da frota")
+    parser.add_argument("--maquinas", type=int, default=100, help="Quiosques simulados")
+    parser.add_argument("--duracao", type=float, default=30.0, help="Duração em segundos")
+    parser.add_argument("--intervalo", type=float, default=5.0, help="Segundos entre lotes de cada quiosque")
+    parser.add_argument("--taxa", type=float, default=1.0, help="Notas por quiosque por intervalo")
+    parser.add_argument("--workers", type=int, default=32, help="Envios simultâneos")
+    parser.add_argument("--token", help="FROTA_TOKEN do servidor")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    http = HttpClient(tentativas=2)
+    http.endpoint("frota", timeout=(3.05, 15.0))
+    quiosques = [FleetReporter(http, args.url, f"atm-{n:05d}", intervalo=args.intervalo, token=args.token)
+                 for n in range(args.maquinas)]
+
+    print(f"🚀 Simulando {args.maquinas} quiosques por {args.duracao:.0f}s contra {args.url}")
+    falhas = 0
+    lotes = 0
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        while time.monotonic() - inicio < args.duracao:
+            rodada = time.monotonic()
+            for reporter in quiosques:
+                # Poisson-ish note arrivals per kiosk
+                gerar_eventos(reporter, rng, sum(1 for _ in range(4) if rng.random() < args.taxa / 4))
+            # Kiosks flush at staggered moments in real life; here each round sends every batch
+            resultados = list(executor.map(lambda r: r.descarregar(), quiosques))
+            lotes += len(resultados)
+            falhas += resultados.count(False)
+            time.sleep(max(0.0, args.intervalo - (time.monotonic() - rodada)))
+
+    # Last flush of whatever is still buffered
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        falhas += list(executor.map(lambda r: r.descarregar(), quiosques)).count(False)
+    decorrido = time.monotonic() - inicio
+    http.close()
+
+    enviados = sum(r.enviados for r in quiosques)
+    pendentes = sum(r.pendentes() for r in quiosques)
+    descartados = sum(r.descartados for r in quiosques)
+    print("=" * 50)
+    print(f"📤 Eventos aceitos:   {enviados} ({enviados / decorrido:,.0f}/s)")
+    print(f"📦 Descargas:         {lotes} (falhas: {falhas})")
+    print(f"⏳ Pendentes:         {pendentes}")
+    print(f"🗑️  Descartados:       {descartados}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Fleet Store
+Indexed time-series store for events reported by many kiosks (SQLite, WAL)
+
+Raw events are kept for `retencao_dias` and indexed by machine and by type;
+hourly rollups per machine, type and denomination are updated at ingestion so
+dashboard queries never scan raw events. Ingestion is batched through one
+writer thread with a bounded queue, and the in-memory state is one summary
+row per machine, so memory does not grow with event volume.
+"""
+
+import collections
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Event types accepted from kiosks
+NOTA = "nota"
+SAQUE = "saque"
+ERRO = "erro"
+PRECO = "preco"
+TIPOS = (NOTA, SAQUE, ERRO, PRECO)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS eventos (
+    ts REAL NOT NULL,
+    maquina TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    valor REAL,
+    dados TEXT
+);
+CREATE INDEX IF NOT EXISTS eventos_maquina_ts ON eventos (maquina, ts);
+CREATE INDEX IF NOT EXISTS eventos_tipo_ts ON eventos (tipo, ts);
+CREATE TABLE IF NOT EXISTS rollup_hora (
+    hora INTEGER NOT NULL,
+    maquina TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    denominacao REAL NOT NULL,
+    contagem INTEGER NOT NULL,
+    soma REAL NOT NULL,
+    PRIMARY KEY (hora, maquina, tipo, denominacao)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollup_maquina_hora ON rollup_hora (maquina, hora);
+CREATE TABLE IF NOT EXISTS maquinas (
+    maquina TEXT PRIMARY KEY,
+    resumo TEXT NOT NULL
+);
+"""
+
+
+def _resumo_vazio():
+    return {"visto_em": 0.0, "notas": 0, "total_brl": 0.0, "saques": 0, "sats": 0,
+            "erros": 0, "ultimo_erro": None, "preco": None, "eventos": 0}
+
+
+def _valor(evento):
+    """Numeric value indexed for an event (BRL for notes/withdraws, BTC price for quotes)"""
+    if evento["tipo"] == PRECO:
+        return evento.get("preco")
+    return evento.get("valor_brl")
+
+
+def _numero(valor):
+    """float(valor) for a finite number (or numeric string); None otherwise"""
+    if valor is None or isinstance(valor, bool):
+        return None
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return numero if math.isfinite(numero) else None
+
+
+def _normalizar(evento):
+    """Validated copy of a kiosk event with numeric fields coerced; None if it cannot be stored"""
+    if not isinstance(evento, dict) or evento.get("tipo") not in TIPOS:
+        return None
+    evento = dict(evento)
+    if evento.get("ts") is not None:
+        evento["ts"] = _numero(evento["ts"])
+        if evento["ts"] is None:
+            return None
+    for campo in ("valor_brl", "preco", "sats"):
+        if evento.get(campo) is not None:
+            evento[campo] = _numero(evento[campo])
+            if evento[campo] is None:
+                return None
+    return evento
+
+
+class FleetStore:
+    """Time-series store of fleet events with per-machine summaries and hourly rollups"""
+
+    def __init__(self, arquivo="frota.db", retencao_dias=30, fila_max=1000, lotes_por_commit=50):
+        self.arquivo = arquivo
+        self.retencao = retencao_dias * 86400
+        self.lotes_por_commit = lotes_por_commit
+        self._fila = queue.Queue(maxsize=fila_max)  # (maquina, eventos) waiting for the writer
+        self._maquinas = {}  # maquina -> summary dict (one entry per kiosk)
+        self._maquinas_lock = threading.Lock()
+        self._local = threading.local()  # Read connection per thread
+        self._thread = None
+        self.ingeridos = 0
+        self.recusados = 0  # Batches refused because the writer queue was full
+        self.invalidos = 0  # Malformed events dropped on ingest
+
+        with self._conectar() as conexao:
+            conexao.executescript(_ESQUEMA)
+            for maquina, resumo in conexao.execute("SELECT maquina, resumo FROM maquinas"):
+                self._maquinas[maquina] = json.loads(resumo)
+
+    def _conectar(self):
+        conexao = sqlite3.connect(self.arquivo, timeout=30)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("PRAGMA synchronous=NORMAL")
+        return conexao
+
+    def _leitura(self):
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = self._local.conexao = self._conectar()
+        return conexao
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="frota-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write what is queued and stop the writer"""
+        if self._thread:
+            self._fila.put(None)
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def ingerir(self, maquina, eventos):
+        """Queue a batch of events from one kiosk; False if the writer is saturated (caller retries)"""
+        eventos = eventos if isinstance(eventos, list) else []
+        validos = [evento for evento in map(_normalizar, eventos) if evento is not None]
+        self.invalidos += len(eventos) - len(validos)
+        try:
+            self._fila.put_nowait((maquina, validos))
+            return True
+        except queue.Full:
+            self.recusados += 1
+            return False
+
+    def pendentes(self):
+        return self._fila.qsize()
+
+    # ---- Writer ----
+
+    def _loop(self):
+        conexao = self._conectar()
+        proxima_limpeza = 0.0
+        try:
+            while True:
+                lotes = [self._fila.get()]
+                while len(lotes) < self.lotes_por_commit:
+                    try:
+                        lotes.append(self._fila.get_nowait())
+                    except queue.Empty:
+                        break
+
+                fim = None in lotes
+                lotes = [lote for lote in lotes if lote is not None]
+                if lotes:
+                    try:
+                        self._gravar(conexao, lotes)
+                    except Exception as e:  # One bad batch must not stop ingestion for the fleet
+                        print(f"❌ Erro ao gravar eventos da frota: {e}")
+
+                if time.monotonic() >= proxima_limpeza:
+                    self._limpar(conexao)
+                    proxima_limpeza = time.monotonic() + 3600
+
+                if fim:
+                    return
+        finally:
+            conexao.close()
+
+    def _gravar(self, conexao, lotes):
+        linhas = []
+        rollups = collections.defaultdict(lambda: [0, 0.0])
+        alterados = {}
+
+        for maquina, eventos in lotes:
+            with self._maquinas_lock:
+                resumo = self._maquinas.setdefault(maquina, _resumo_vazio())
+            for evento in eventos:
+                ts = float(evento.get("ts") or time.time())
+                tipo = evento["tipo"]
+                valor = _valor(evento)
+                dados = {k: v for k, v in evento.items() if k not in ("ts", "tipo")}
+                linhas.append((ts, maquina, tipo, valor, json.dumps(dados, separators=(",", ":"))))
+
+                denominacao = valor if tipo in (NOTA, SAQUE) and valor is not None else 0.0
+                rollup = rollups[(int(ts // 3600) * 3600, maquina, tipo, denominacao)]
+                rollup[0] += 1
+                rollup[1] += valor or 0.0
+                self._resumir(resumo, ts, tipo, valor, evento)
+            alterados[maquina] = resumo
+
+        with conexao:
+            conexao.executemany("INSERT INTO eventos VALUES (?, ?, ?, ?, ?)", linhas)
+            conexao.executemany(
+                "INSERT INTO rollup_hora VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (hora, maquina, tipo, denominacao) DO UPDATE SET "
+                "contagem = contagem + excluded.contagem, soma = soma + excluded.soma",
+                [chave + tuple(valores) for chave, valores in rollups.items()],
+            )
+            conexao.executemany(
+                "INSERT OR REPLACE INTO maquinas VALUES (?, ?)",
+                [(maquina, json.dumps(resumo)) for maquina, resumo in alterados.items()],
+            )
+        self.ingeridos += len(linhas)
+
+    def _resumir(self, resumo, ts, tipo, valor, evento):
+        with self._maquinas_lock:
+            resumo["visto_em"] = max(resumo["visto_em"], ts)
+            resumo["eventos"] += 1
+            if tipo == NOTA:
+                resumo["notas"] += 1
+                resumo["total_brl"] += valor or 0.0
+            elif tipo == SAQUE:
+                resumo["saques"] += 1
+                resumo["sats"] += int(evento.get("sats") or 0)
+            elif tipo == ERRO:
+                resumo["erros"] += 1
+                resumo["ultimo_erro"] = {"ts": ts, "etapa": evento.get("etapa"), "erro": evento.get("erro")}
+            elif tipo == PRECO:
+                resumo["preco"] = valor
+
+    def _limpar(self, conexao):
+        """Drop raw events past retention (rollups are kept)"""
+        try:
+            with conexao:
+                conexao.execute("DELETE FROM eventos WHERE ts < ?", (time.time() - self.retencao,))
+        except sqlite3.Error as e:
+            print(f"⚠️  Erro na limpeza da frota: {e}")
+
+    # ---- Queries ----
+
+    def maquinas(self, limite_online=120):
+        """Summary of every kiosk (from memory)"""
+        agora = time.time()
+        with self._maquinas_lock:
+            itens = [(maquina, dict(resumo)) for maquina, resumo in self._maquinas.items()]
+        for maquina, resumo in itens:
+            resumo["maquina"] = maquina
+            resumo["online"] = agora - resumo["visto_em"] <= limite_online
+        return sorted((resumo for _, resumo in itens), key=lambda r: r["maquina"])
+
+    def maquina(self, maquina, limite_online=120):
+        with self._maquinas_lock:
+            resumo = self._maquinas.get(maquina)
+            resumo = dict(resumo) if resumo else None
+        if resumo:
+            resumo["maquina"] = maquina
+            resumo["online"] = time.time() - resumo["visto_em"] <= limite_online
+        return resumo
+
+    def eventos_recentes(self, maquina, limite=100, tipo=None):
+        """Latest raw events of one kiosk (index on maquina, ts)"""
+        consulta = "SELECT ts, tipo, dados FROM eventos WHERE maquina = ?"
+        parametros = [maquina]
+        if tipo:
+            consulta += " AND tipo = ?"
+            parametros.append(tipo)
+        consulta += " ORDER BY ts DESC LIMIT ?"
+        parametros.append(limite)
+        return [dict(json.loads(dados), ts=ts, tipo=t)
+                for ts, t, dados in self._leitura().execute(consulta, parametros)]
+
+    def denominacoes(self, desde, ate=None, maquina=None, tipo=NOTA):
+        """Count and BRL total per denomination from the hourly rollups"""
+        consulta = ("SELECT denominacao, SUM(contagem), SUM(soma) FROM rollup_hora "
+                    "WHERE tipo = ? AND hora >= ? AND hora < ?")
+        parametros = [tipo, int(desde // 3600) * 3600, ate or time.time() + 3600]
+        if maquina:
+            consulta += " AND maquina = ?"
+            parametros.append(maquina)
+        consulta += " GROUP BY denominacao ORDER BY denominacao"
+        return [{"denominacao": d, "contagem": c, "total_brl": s}
+                for d, c, s in self._leitura().execute(consulta, parametros)]
+
+    def serie(self, tipo, desde, ate=None, passo=3600, maquina=None):
+        """Time series of counts and sums in buckets of `passo` seconds (multiple of one hour)"""
+        passo = max(3600, int(passo) // 3600 * 3600)
+        consulta = ("SELECT (hora / ?) * ?, SUM(contagem), SUM(soma) FROM rollup_hora "
+                    "WHERE tipo = ? AND hora >= ? AND hora < ?")
+        parametros = [passo, passo, tipo, int(desde // 3600) * 3600, ate or time.time() + 3600]
+        if maquina:
+            consulta += " AND maquina = ?"
+            parametros.append(maquina)
+        consulta += " GROUP BY 1 ORDER BY 1"
+        return [{"ts": ts, "contagem": c, "soma": s} for ts, c, s in self._leitura().execute(consulta, parametros)]
+
+    def ranking(self, desde, tipo=NOTA, limite=20):
+        """Kiosks with the most BRL (or events) of a type since `desde`"""
+        consulta = ("SELECT maquina, SUM(contagem), SUM(soma) FROM rollup_hora WHERE tipo = ? AND hora >= ? "
+                    "GROUP BY maquina ORDER BY SUM(soma) DESC, SUM(contagem) DESC LIMIT ?")
+        return [{"maquina": m, "contagem": c, "soma": s}
+                for m, c, s in self._leitura().execute(consulta, (tipo, int(desde // 3600) * 3600, limite))]
+
+    def tamanho_arquivo(self):
+        try:
+            return os.path.getsize(self.arquivo)
+        except OSError:
+            return 0
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Shared HTTP Client
+Keep-alive connection pools per host, jittered retries, circuit breakers and latency counters
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics import REGISTRO
+
+# HTTP libraries are imported on first use (carregar_bibliotecas): importing
+# requests and friends takes a good part of a second on a Pi, and the backend
+# arms pulse capture before anything touches the network
+requests = None
+HTTPAdapter = None
+NewConnectionError = None
+httpx = None
+aiohttp = None
+HTTP2_DISPONIVEL = False
+_carregadas = False
+_carregar_lock = threading.Lock()
+
+
+def carregar_bibliotecas():
+    """Import requests (required), httpx+h2 and aiohttp (optional) once"""
+    global requests, HTTPAdapter, NewConnectionError, httpx, aiohttp, HTTP2_DISPONIVEL, _carregadas
+
+    if _carregadas:
+        return
+    with _carregar_lock:
+        if _carregadas:
+            return
+        import requests as _requests
+        from requests.adapters import HTTPAdapter as _HTTPAdapter
+        from urllib3.exceptions import NewConnectionError as _NewConnectionError
+        requests, HTTPAdapter, NewConnectionError = _requests, _HTTPAdapter, _NewConnectionError
+
+        try:
+            import httpx as _httpx  # Optional: enables HTTP/2 when the 'h2' package is installed
+            import h2  # noqa: F401
+            httpx, HTTP2_DISPONIVEL = _httpx, True
+        except ImportError:
+            pass
+
+        try:
+            import aiohttp as _aiohttp  # Optional: native async HTTP for the asyncio runtime
+            aiohttp = _aiohttp
+        except ImportError:
+            pass
+        _carregadas = True
+
+METRICA_LATENCIA = REGISTRO.histograma("atm_http_requisicao_segundos",
+                                       "Duração de cada tentativa HTTP por endpoint", ("endpoint",))
+METRICA_ERROS = REGISTRO.contador("atm_http_erros_total",
+                                  "Tentativas HTTP com erro de conexão, 5xx ou 429", ("endpoint",))
+METRICA_RETRIES = REGISTRO.contador("atm_http_retries_total", "Tentativas HTTP repetidas", ("endpoint",))
+METRICA_REJEITADAS = REGISTRO.contador("atm_http_circuito_rejeitadas_total",
+                                       "Requisições recusadas por circuito aberto", ("endpoint",))
+
+
+class HttpError(Exception):
+    """Network failure after retries (callers fall back on this)"""
+
+
+class CircuitOpenError(HttpError):
+    """Endpoint is failing; request refused without touching the network"""
+
+
+class CircuitBreaker:
+    """Opens after `limite` consecutive failures and lets one trial through after `reset` seconds.
+
+    While that trial is in flight (half-open) every other caller is refused;
+    its success closes the circuit and its failure reopens it for another
+    `reset` seconds. A trial that never reports back (e.g. a cancelled task)
+    stops blocking new trials after `reset` seconds.
+    """
+
+    def __init__(self, limite=5, reset=30.0):
+        self.limite = limite
+        self.reset = reset
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.sonda_ate = 0.0  # Half-open: a trial request is in flight until this deadline
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if not self.aberto_ate:
+                return True
+            agora = time.monotonic()
+            if agora < self.aberto_ate or agora < self.sonda_ate:
+                return False
+            self.sonda_ate = agora + self.reset
+            return True
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_ate = 0.0
+            self.sonda_ate = 0.0
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self.falhas >= self.limite:
+                self.aberto_ate = time.monotonic() + self.reset
+                self.sonda_ate = 0.0
+
+    @property
+    def aberto(self):
+        return bool(self.aberto_ate) and time.monotonic() < self.aberto_ate
+
+
+class _Endpoint:
+    """Per-endpoint configuration, breaker and latency counters"""
+
+    def __init__(self, nome, timeout, tentativas, breaker):
+        self.nome = nome
+        self.timeout = timeout  # (connect, read) seconds
+        self.tentativas = tentativas
+        self.breaker = breaker
+        self.chamadas = 0
+        self.erros = 0
+        self.retries = 0
+        self.rejeitadas = 0  # Refused by open circuit
+        self.latencia_total_ms = 0.0
+        self.latencia_max_ms = 0.0
+        self.ultima_ms = 0.0
+
+    def registrar(self, latencia_ms, erro=False):
+        self.chamadas += 1
+        if erro:
+            self.erros += 1
+        self.latencia_total_ms += latencia_ms
+        self.latencia_max_ms = max(self.latencia_max_ms, latencia_ms)
+        self.ultima_ms = latencia_ms
+        METRICA_LATENCIA.observe(latencia_ms / 1000, endpoint=self.nome)
+        if erro:
+            METRICA_ERROS.inc(endpoint=self.nome)
+
+
+class HttpClient:
+    """Shared client: one pooled keep-alive session per host.
+
+    Idempotent requests are retried on network errors, 5xx and 429 with full
+    jitter exponential backoff; non-idempotent requests (e.g. withdraw
+    creation) are only retried when the connection was never established.
+    """
+
+    def __init__(self, timeout=(3.05, 10.0), tentativas=3, backoff_base=0.25, backoff_max=4.0,
+                 falhas_circuito=5, reset_circuito=30.0, pool_maxsize=4, http2=True):
+        self.timeout = timeout
+        self.tentativas = tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.falhas_circuito = falhas_circuito
+        self.reset_circuito = reset_circuito
+        self.pool_maxsize = pool_maxsize
+        self.http2 = http2  # Used only if httpx and h2 turn out to be installed
+        self._sessoes = {}
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def endpoint(self, nome, timeout=None, tentativas=None, falhas_circuito=None, reset_circuito=None):
+        """Configure a named endpoint (timeouts, retries, breaker)"""
+        with self._lock:
+            self._endpoints[nome] = _Endpoint(
+                nome,
+                timeout or self.timeout,
+                tentativas or self.tentativas,
+                CircuitBreaker(falhas_circuito or self.falhas_circuito,
+                               reset_circuito or self.reset_circuito),
+            )
+        return self._endpoints[nome]
+
+    def get(self, nome, url, **kwargs):
+        return self.request("GET", nome, url, idempotente=True, **kwargs)
+
+    def post(self, nome, url, idempotente=False, **kwargs):
+        return self.request("POST", nome, url, idempotente=idempotente, **kwargs)
+
+    def request(self, metodo, nome, url, idempotente=True, **kwargs):
+        """Send a request through the endpoint's breaker, retry policy and pool"""
+        ep = self._endpoints.get(nome) or self.endpoint(nome)
+        sessao = self._sessao(url)
+        timeout = kwargs.pop("timeout", ep.timeout)
+        if httpx is not None and isinstance(sessao, httpx.Client):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        kwargs["timeout"] = timeout
+        response = None
+
+        for tentativa in range(ep.tentativas):
+            if not ep.breaker.permitir():
+                ep.rejeitadas += 1
+                METRICA_REJEITADAS.inc(endpoint=nome)
+                raise CircuitOpenError(f"Circuito aberto para '{nome}'")
+
+            inicio = time.monotonic()
+            try:
+                response = sessao.request(metodo, url, **kwargs)
+            except Exception as e:
+                ep.registrar((time.monotonic() - inicio) * 1000, erro=True)
+                ep.breaker.falha()
+                if tentativa + 1 < ep.tentativas and (idempotente or self._nao_enviada(e)):
+                    ep.retries += 1
+                    METRICA_RETRIES.inc(endpoint=nome)
+                    self._esperar(tentativa)
+                    continue
+                raise HttpError(f"{nome}: {e}") from e
+
+            falhou = response.status_code >= 500 or response.status_code == 429
+            ep.registrar((time.monotonic() - inicio) * 1000, erro=falhou)
+
+            if not falhou:
+                ep.breaker.sucesso()
+                return response
+
+            ep.breaker.falha()
+            if not idempotente or tentativa + 1 >= ep.tentativas:
+                return response
+            ep.retries += 1
+            METRICA_RETRIES.inc(endpoint=nome)
+            self._esperar(tentativa)
+
+        return response
+
+    def estatisticas(self):
+        """Per-endpoint latency and error counters"""
+        return {
+            nome: {
+                "chamadas": ep.chamadas,
+                "erros": ep.erros,
+                "retries": ep.retries,
+                "rejeitadas": ep.rejeitadas,
+                "circuito_aberto": ep.breaker.aberto,
+                "latencia_media_ms": round(ep.latencia_total_ms / ep.chamadas, 1) if ep.chamadas else 0.0,
+                "latencia_max_ms": round(ep.latencia_max_ms, 1),
+                "latencia_ultima_ms": round(ep.ultima_ms, 1),
+            }
+            for nome, ep in list(self._endpoints.items())
+        }
+
+    def close(self):
+        """Close every pooled session"""
+        with self._lock:
+            for sessao in self._sessoes.values():
+                sessao.close()
+            self._sessoes.clear()
+
+    def _sessao(self, url):
+        partes = urlsplit(url)
+        host = f"{partes.scheme}://{partes.netloc}"
+        sessao = self._sessoes.get(host)
+        if sessao is not None:
+            return sessao
+
+        carregar_bibliotecas()
+        with self._lock:
+            if host not in self._sessoes:
+                if self.http2 and HTTP2_DISPONIVEL and partes.scheme == "https":
+                    limites = httpx.Limits(max_connections=self.pool_maxsize,
+                                           max_keepalive_connections=self.pool_maxsize)
+                    self._sessoes[host] = httpx.Client(http2=True, limits=limites)
+                else:
+                    sessao = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                    sessao.mount(host, adapter)
+                    self._sessoes[host] = sessao
+            return self._sessoes[host]
+
+    def _esperar(self, tentativa):
+        # Full jitter exponential backoff
+        limite = min(self.backoff_max, self.backoff_base * (2 ** tentativa))
+        time.sleep(random.uniform(0, limite))
+
+    @staticmethod
+    def _nao_enviada(erro):
+        """True if the request surely never reached the server (safe to retry a POST)"""
+        if isinstance(erro, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(erro, requests.exceptions.ConnectionError):
+            motivo = getattr(erro.args[0], "reason", None) if erro.args else None
+            return isinstance(motivo, NewConnectionError)
+        if httpx is not None:
+            return isinstance(erro, (httpx.ConnectError, httpx.ConnectTimeout))
+        return False
+
+
+class RespostaAsync:
+    """Fully read response with the parts of the requests.Response API the backend uses"""
+
+    def __init__(self, status_code, corpo, headers):
+        self.status_code = status_code
+        self.content = corpo
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHttpClient:
+    """Async counterpart of HttpClient for the asyncio runtime.
+
+    Shares the endpoints (timeouts, retry counts, circuit breakers and
+    counters) of the HttpClient it wraps, so both runtimes report the same
+    statistics. With aiohttp installed requests run on the event loop with
+    one keep-alive connector; without it each request runs the synchronous
+    client in the loop's default executor.
+    """
+
+    def __init__(self, http, limite_conexoes=16):
+        self.http = http
+        self.limite_conexoes = limite_conexoes
+        self._sessao = None
+        carregar_bibliotecas()
+        self.nativo = aiohttp is not None
+
+    async def get(self, nome, url, **kwargs):
+        return await self.request("GET", nome, url, idempotente=True, **kwargs)
+
+    async def post(self, nome, url, idempotente=False, **kwargs):
+        return await self.request("POST", nome, url, idempotente=idempotente, **kwargs)
+
+    async def request(self, metodo, nome, url, idempotente=True, **kwargs):
+        """Same retry/breaker policy as HttpClient.request, without blocking the loop"""
+        if not self.nativo:
+            return await asyncio.to_thread(self.http.request, metodo, nome, url,
+                                           idempotente=idempotente, **kwargs)
+
+        ep = self.http._endpoints.get(nome) or self.http.endpoint(nome)
+        conexao, leitura = kwargs.pop("timeout", ep.timeout)
+        kwargs["timeout"] = aiohttp.ClientTimeout(sock_connect=conexao, sock_read=leitura)
+        if "data" in kwargs and isinstance(kwargs["data"], str):
+            kwargs["data"] = kwargs["data"].encode()
+        sessao = self._obter_sessao()
+        response = None
+
+        for tentativa in range(ep.tentativas):
+            if not ep.breaker.permitir():
+                ep.rejeitadas += 1
+                METRICA_REJEITADAS.inc(endpoint=nome)
+                raise CircuitOpenError(f"Circuito aberto para '{nome}'")
+
+            inicio = time.monotonic()
+            try:
+                async with sessao.request(metodo, url, **kwargs) as r:
+                    response = RespostaAsync(r.status, await r.read(), dict(r.headers))
+            except Exception as e:
+                ep.registrar((time.monotonic() - inicio) * 1000, erro=True)
+                ep.breaker.falha()
+                if tentativa + 1 < ep.tentativas and (idempotente or isinstance(e, aiohttp.ClientConnectorError)):
+                    ep.retries += 1
+                    METRICA_RETRIES.inc(endpoint=nome)
+                    await self._esperar(tentativa)
+                    continue
+                raise HttpError(f"{nome}: {e}") from e
+
+            falhou = response.status_code >= 500 or response.status_code == 429
+            ep.registrar((time.monotonic() - inicio) * 1000, erro=falhou)
+
+            if not falhou:
+                ep.breaker.sucesso()
+                return response
+
+            ep.breaker.falha()
+            if not idempotente or tentativa + 1 >= ep.tentativas:
+                return response
+            ep.retries += 1
+            METRICA_RETRIES.inc(endpoint=nome)
+            await self._esperar(tentativa)
+
+        return response
+
+    async def close(self):
+        if self._sessao is not None:
+            await self._sessao.close()
+            self._sessao = None
+
+    def _obter_sessao(self):
+        if self._sessao is None:
+            conector = aiohttp.TCPConnector(limit=self.limite_conexoes, limit_per_host=self.http.pool_maxsize)
+            self._sessao = aiohttp.ClientSession(connector=conector)
+        return self._sessao
+
+    async def _esperar(self, tentativa):
+        limite = min(self.http.backoff_max, self.http.backoff_base * (2 ** tentativa))
+        await asyncio.sleep(random.uniform(0, limite))
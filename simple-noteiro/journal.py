@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Transaction Journal
+Append-only, checksummed write-ahead log of every note and withdraw, with batched fsync and recovery
+
+Each line is "<crc32 hex> <json>" where the JSON object holds "t" (record type),
+"id" (note/withdraw correlation id), "ts" (wall clock) and the record fields.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+from metrics import REGISTRO
+
+# Record types, in the order a withdraw goes through them
+PULSOS = "pulsos"      # Pulse batch framed by the note framer
+SESSAO = "sessao"      # Note added to an open session (running total owed to the customer)
+NOTA = "nota"          # Note accepted (amount owed to the customer)
+COTACAO = "cotacao"    # Amount quoted in sats
+SAQUE = "saque"        # Withdraw link created
+QR = "qr"              # QR displayed: withdraw complete
+CANCELADO = "cancelado"  # Session discarded by the operator: nothing owed
+ESTADO = "estado"      # Merged snapshot written by compaction
+
+ETAPAS_ABERTAS = (SESSAO, NOTA, COTACAO, SAQUE)
+
+ESPERA_MAX_FALHA = 5.0  # Longest pause between write retries while the disk keeps failing (seconds)
+
+METRICA_FALHA = REGISTRO.medidor("atm_journal_falhando", "1 enquanto o journal não consegue gravar")
+METRICA_ERROS = REGISTRO.contador("atm_journal_erros_total", "Falhas de gravação do journal")
+METRICA_PENDENTES = REGISTRO.medidor("atm_journal_pendentes", "Registros aguardando gravação após falha")
+
+
+def _codificar(registro):
+    dados = json.dumps(registro, separators=(",", ":"))
+    return f"{zlib.crc32(dados.encode()) & 0xffffffff:08x} {dados}\n"
+
+
+def _decodificar(linha):
+    """Parse one line; None if torn or corrupt"""
+    try:
+        crc, dados = linha.rstrip("\n").split(" ", 1)
+        if int(crc, 16) != zlib.crc32(dados.encode()) & 0xffffffff:
+            return None
+        return json.loads(dados)
+    except ValueError:
+        return None
+
+
+class Journal:
+    """Write-ahead journal.
+
+    registrar() only enqueues the record; a writer thread appends batches and
+    fsyncs at most every `intervalo_fsync` seconds, so callers never wait on
+    the disk. Open withdraws are tracked in memory and compaction rewrites
+    the file with one merged snapshot per open withdraw. Write failures are
+    retried with backoff (records stay queued in order) and reported through
+    `falhando` and the atm_journal_* metrics.
+    """
+
+    def __init__(self, arquivo, intervalo_fsync=0.05, limite_compactacao=1000):
+        self.arquivo = arquivo
+        self.intervalo_fsync = intervalo_fsync
+        self.limite_compactacao = limite_compactacao
+        self._fila = queue.SimpleQueue()
+        self._abertos = {}  # id -> merged fields of withdraws not yet displayed
+        self._registros = 0  # Records appended since last compaction
+        self._parar = threading.Event()
+        self._thread = None
+        self.corrompidos = 0
+        self.falhando = False  # Health flag: records are queued but not yet on disk
+        self.erros = 0
+
+    def registrar(self, tipo, ident, **dados):
+        """Enqueue a record for withdraw `ident` (never blocks on disk)"""
+        dados.update({"t": tipo, "id": ident, "ts": time.time()})
+        self._fila.put(dados)
+
+    def recuperar(self):
+        """Replay the journal; returns {id: merged fields} of withdraws left unfinished"""
+        self._abertos = {}
+        if not os.path.exists(self.arquivo):
+            return {}
+
+        inicio = time.monotonic()
+        total = 0
+        with open(self.arquivo) as f:
+            for linha in f:
+                registro = _decodificar(linha)
+                if registro is None:
+                    self.corrompidos += 1
+                    continue
+                self._aplicar(registro)
+                total += 1
+
+        self._registros = total
+        print(f"📒 Journal recuperado: {total} registros, {len(self._abertos)} saques pendentes "
+              f"({(time.monotonic() - inicio) * 1000:.1f} ms)")
+        if self.corrompidos:
+            print(f"⚠️  Journal: {self.corrompidos} registros corrompidos ignorados")
+        return {ident: dict(campos) for ident, campos in self._abertos.items()}
+
+    def start(self):
+        """Start the writer thread (after recuperar())"""
+        self._thread = threading.Thread(target=self._loop, name="journal", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush pending records and stop the writer"""
+        self._parar.set()
+        self._fila.put(None)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _aplicar(self, registro):
+        tipo = registro.get("t")
+        ident = registro.get("id")
+        if tipo in (QR, CANCELADO):
+            self._abertos.pop(ident, None)
+        elif tipo in ETAPAS_ABERTAS or tipo == ESTADO:
+            campos = self._abertos.setdefault(ident, {})
+            campos.update({k: v for k, v in registro.items() if k not in ("t", "ts")})
+            campos["etapa"] = registro.get("etapa", tipo) if tipo == ESTADO else tipo
+
+    def _abrir(self):
+        """Open for append, ending a line torn by an earlier failed write so the next record parses"""
+        f = open(self.arquivo, "a")
+        if f.tell() > 0:
+            with open(self.arquivo, "rb") as leitura:
+                leitura.seek(-1, os.SEEK_END)
+                if leitura.read(1) != b"\n":
+                    f.write("\n")
+        return f
+
+    def _coletar(self, bloquear):
+        """Everything that arrives within one fsync window ([] if not blocking and nothing is queued)"""
+        try:
+            lote = [self._fila.get() if bloquear else self._fila.get_nowait()]
+        except queue.Empty:
+            return []
+        limite = time.monotonic() + self.intervalo_fsync
+        while (restante := limite - time.monotonic()) > 0:
+            try:
+                lote.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _falha(self, erro, pendentes):
+        self.erros += 1
+        METRICA_ERROS.inc()
+        METRICA_PENDENTES.set(pendentes)
+        if not self.falhando:
+            self.falhando = True
+            METRICA_FALHA.set(1)
+            print(f"❌ Erro ao gravar journal: {erro} - registros retidos em memória, tentando novamente")
+
+    def _loop(self):
+        f = None
+        pendentes = []  # Records not yet on disk, kept across write failures and retried in order
+        espera = self.intervalo_fsync
+        fim = False
+        while True:
+            if not fim:
+                # Group everything that arrives within the fsync window into one sync
+                lote = self._coletar(bloquear=not pendentes)
+                fim = None in lote
+                pendentes += [r for r in lote if r is not None]
+
+            if pendentes:
+                try:
+                    if f is None:
+                        f = self._abrir()
+                    f.write("".join(_codificar(r) for r in pendentes))
+                    f.flush()
+                    os.fsync(f.fileno())
+                except OSError as e:
+                    self._falha(e, len(pendentes))
+                    try:
+                        if f is not None:
+                            f.close()
+                    except OSError:
+                        pass
+                    f = None  # Reopened on the next attempt (the file may have been replaced or remounted)
+                    if fim:
+                        print(f"❌ Journal encerrado com {len(pendentes)} registros não gravados")
+                        return
+                    self._parar.wait(espera)
+                    espera = min(espera * 2, ESPERA_MAX_FALHA)
+                    continue
+
+                for r in pendentes:
+                    self._aplicar(r)
+                self._registros += len(pendentes)
+                pendentes = []
+                espera = self.intervalo_fsync
+                if self.falhando:
+                    self.falhando = False
+                    METRICA_FALHA.set(0)
+                    METRICA_PENDENTES.set(0)
+                    print("✅ Journal voltou a gravar")
+
+            if fim:
+                if f is not None:
+                    f.close()
+                return
+
+            if self._registros >= self.limite_compactacao:
+                if f is not None:
+                    f.close()
+                    f = None
+                self._compactar()
+
+    def _compactar(self):
+        """Rewrite the journal with one snapshot per open withdraw"""
+        tmp = f"{self.arquivo}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                for ident, campos in list(self._abertos.items()):
+                    registro = dict(campos, t=ESTADO, id=ident, ts=time.time())
+                    f.write(_codificar(registro))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.arquivo)
+            self._registros = 0
+            print(f"🗜️  Journal compactado: {len(self._abertos)} saques pendentes")
+        except OSError as e:
+            print(f"⚠️  Erro ao compactar journal: {e}")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Mock Lightning Server
+Local stand-in for the LNbits withdraw extension, for tests and load runs without a wallet
+
+Implements the part of /withdraw/api/v1/links the LNbits provider uses (create,
+list, get, delete) and claim simulation: POST /mock/resgatar/<id> marks the
+link as used and fires its webhook the way LNbits does.
+
+Uso:
+  python3 lightning_mock.py --porta 5001
+  python3 lightning_mock.py --atraso 0.5 --falhas 0.1 --resgate-auto 20
+  # atm-simple.py: LNBITS_URL = "http://localhost:5001"
+"""
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIXO = "/withdraw/api/v1/links"
+
+
+class MockLightning:
+    """In-memory withdraw links with LNbits semantics"""
+
+    def __init__(self, chave=None, atraso=0.0, falhas=0.0, resgate_auto=None):
+        self.chave = chave
+        self.atraso = atraso
+        self.falhas = falhas
+        self.resgate_auto = resgate_auto
+        self.links = {}
+        self.lock = threading.Lock()
+        self.criados = 0
+        self.resgatados = 0
+
+    def criar(self, pedido):
+        link = {
+            "id": secrets.token_hex(11),
+            "title": pedido.get("title", ""),
+            "min_withdrawable": pedido.get("min_withdrawable"),
+            "max_withdrawable": pedido.get("max_withdrawable"),
+            "uses": pedido.get("uses", 1),
+            "used": 0,
+            "webhook_url": pedido.get("webhook_url") or None,
+            "webhook_headers": pedido.get("webhook_headers") or None,
+            "webhook_body": pedido.get("webhook_body") or None,
+            "criado_em": time.time(),
+        }
+        link["lnurl"] = f"LNURL1MOCK{link['id'].upper()}"
+        with self.lock:
+            self.links[link["id"]] = link
+            self.criados += 1
+        if self.resgate_auto is not None:
+            threading.Timer(self.resgate_auto, self.resgatar, args=(link["id"],)).start()
+        return link
+
+    def resgatar(self, ident):
+        """Simulate a wallet claiming the link; False if unknown or already used up"""
+        with self.lock:
+            link = self.links.get(ident)
+            if link is None or link["used"] >= link["uses"]:
+                return False
+            link["used"] += 1
+            self.resgatados += 1
+        if link["webhook_url"]:
+            threading.Thread(target=self._webhook, args=(link,), daemon=True).start()
+        return True
+
+    def _webhook(self, link):
+        # Same payload as the LNbits withdraw extension
+        corpo = {
+            "payment_hash": secrets.token_hex(32),
+            "payment_request": f"lnbc{link['max_withdrawable']}n1mock",
+            "lnurlw": link["id"],
+            "body": json.loads(link["webhook_body"]) if link["webhook_body"] else {},
+        }
+        cabecalhos = {"Content-Type": "application/json"}
+        cabecalhos.update(json.loads(link["webhook_headers"]) if link["webhook_headers"] else {})
+        pedido = urllib.request.Request(link["webhook_url"], data=json.dumps(corpo).encode(),
+                                        headers=cabecalhos, method="POST")
+        try:
+            with urllib.request.urlopen(pedido, timeout=5) as resposta:
+                print(f"📨 Webhook {link['id']} -> {resposta.status}")
+        except Exception as e:
+            print(f"⚠️  Webhook {link['id']} falhou: {e}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _autorizado(self):
+        if self.mock.chave and self.headers.get("X-Api-Key") != self.mock.chave:
+            self._responder(401, {"detail": "Invalid key"})
+            return False
+        return True
+
+    def _link(self):
+        return self.path[len(PREFIXO) + 1:].split("?")[0]
+
+    def do_GET(self):
+        if not self._autorizado():
+            return
+        caminho = self.path.split("?")[0]
+        if caminho == PREFIXO:
+            with self.mock.lock:
+                self._responder(200, list(self.mock.links.values()))
+        elif caminho.startswith(PREFIXO + "/"):
+            with self.mock.lock:
+                link = self.mock.links.get(self._link())
+            if link:
+                self._responder(200, link)
+            else:
+                self._responder(404, {"detail": "Withdraw link does not exist."})
+        else:
+            self._responder(404, {"detail": "Not found"})
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        corpo = json.loads(self.rfile.read(tamanho) or b"{}")
+        if self.path.startswith("/mock/resgatar/"):
+            ok = self.mock.resgatar(self.path.rsplit("/", 1)[1])
+            self._responder(200 if ok else 404, {"success": ok})
+        elif self.path == PREFIXO:
+            if not self._autorizado():
+                return
+            time.sleep(self.mock.atraso)
+            if random.random() < self.mock.falhas:
+                self._responder(503, {"detail": "Service Unavailable"})
+                return
+            self._responder(201, self.mock.criar(corpo))
+        else:
+            self._responder(404, {"detail": "Not found"})
+
+    def do_DELETE(self):
+        if not self._autorizado():
+            return
+        with self.mock.lock:
+            link = self.mock.links.pop(self._link(), None)
+        self._responder(200 if link else 404, {"success": link is not None})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Lightning simulado (API de saques do LNbits)")
+    parser.add_argument("--porta", type=int, default=5001)
+    parser.add_argument("--chave", help="X-Api-Key exigida (padrão: qualquer uma)")
+    parser.add_argument("--atraso", type=float, default=0.0, help="Segundos por criação de link")
+    parser.add_argument("--falhas", type=float, default=0.0, help="Fração de criações respondidas com 503")
+    parser.add_argument("--resgate-auto", type=float, help="Resgatar cada link N segundos após criado")
+    args = parser.parse_args()
+
+    _Handler.mock = MockLightning(chave=args.chave, atraso=args.atraso, falhas=args.falhas,
+                                  resgate_auto=args.resgate_auto)
+    servidor = ThreadingHTTPServer(("0.0.0.0", args.porta), _Handler)
+    print(f"⚡ Lightning simulado em http://localhost:{args.porta}{PREFIXO}")
+    print(f"🎯 Resgatar um link: curl -X POST http://localhost:{args.porta}/mock/resgatar/<id>")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"📊 {_Handler.mock.criados} links criados, {_Handler.mock.resgatados} resgatados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Lightning Providers
+Withdraw link creation, deletion and claim detection behind one interface
+
+Every provider returns withdraw dicts shaped like
+  {"success": True, "lnurl": ..., "withdraw_id": ..., "amount_brl": ..., "amount_sats": ..., "origem": ...}
+and raises HttpError when the backend cannot be reached (worth retrying) or
+LinkRecusado when it answered and refused the link (not worth retrying). criar_links() creates a
+whole batch with at most `concorrencia` requests in flight (shared with single
+calls), which is what the withdraw pool and the offline queue use.
+"""
+
+import abc
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import HttpError
+from metrics import REGISTRO
+
+METRICA_LINKS = REGISTRO.contador("atm_lightning_links_total", "Links de saque criados por provedor",
+                                  ("provedor", "resultado"))
+METRICA_EM_VOO = REGISTRO.medidor("atm_lightning_em_voo", "Requisições ao provedor Lightning em andamento")
+
+
+class LinkRecusado(Exception):
+    """The provider answered and refused the link (bad key, wallet balance, amount): retrying will not help"""
+
+
+class LightningProvider(abc.ABC):
+    """Base provider: subclasses implement _criar, _status and (optionally) apagar_link.
+
+    Both are abstract, so a half-implemented backend fails when it is
+    created rather than on the first withdraw.
+    """
+
+    nome = "base"
+
+    def __init__(self, concorrencia=8, webhook_url=None, webhook_token=None):
+        self.concorrencia = concorrencia
+        self.webhook_url = webhook_url
+        self.webhook_token = webhook_token  # Sent back by the provider on every claim webhook
+        self._limite = threading.BoundedSemaphore(concorrencia)
+        self._limite_async = None
+        self._executor = ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix=f"ln-{self.nome}")
+
+    def criar_link(self, amount_brl, amount_sats):
+        """Create one single-use withdraw link; the withdraw dict (LinkRecusado / HttpError otherwise)"""
+        with self._limite:
+            METRICA_EM_VOO.inc()
+            try:
+                resultado = self._criar(amount_brl, amount_sats)
+            except LinkRecusado:
+                METRICA_LINKS.inc(provedor=self.nome, resultado="recusado")
+                raise
+            finally:
+                METRICA_EM_VOO.inc(-1)
+        METRICA_LINKS.inc(provedor=self.nome, resultado="ok")
+        return resultado
+
+    def criar_links(self, pedidos, recusas=False):
+        """Create a batch of links from (amount_brl, amount_sats) pairs; one result per pair, None on failure.
+
+        With recusas=True a permanent refusal comes back as its LinkRecusado
+        instead of None (the offline queue stops replaying those).
+        """
+        return list(self._executor.map(lambda pedido: self._criar_ou_nada(pedido, recusas), pedidos))
+
+    async def criar_link_async(self, http_async, amount_brl, amount_sats):
+        """criar_link() awaited on the event loop (asyncio runtime)"""
+        if self._limite_async is None:
+            self._limite_async = asyncio.Semaphore(self.concorrencia)
+        async with self._limite_async:
+            METRICA_EM_VOO.inc()
+            try:
+                resultado = await self._criar_async(http_async, amount_brl, amount_sats)
+            except LinkRecusado:
+                METRICA_LINKS.inc(provedor=self.nome, resultado="recusado")
+                raise
+            finally:
+                METRICA_EM_VOO.inc(-1)
+        METRICA_LINKS.inc(provedor=self.nome, resultado="ok")
+        return resultado
+
+    def apagar_link(self, withdraw_id):
+        """Delete an unused link (best effort)"""
+
+    def status_links(self, withdraw_ids):
+        """Claim status of many links: {withdraw_id: {"usado": bool}}; links the provider no longer has are left out"""
+        with self._limite:
+            return self._status(list(withdraw_ids))
+
+    def interpretar_webhook(self, corpo, cabecalhos):
+        """Withdraw id of a claim webhook sent by this provider, or None if it is not one of ours"""
+        return None
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _criar_ou_nada(self, pedido, recusas=False):
+        try:
+            return self.criar_link(*pedido)
+        except LinkRecusado as e:
+            print(f"⚠️  {self.nome}: link de R$ {pedido[0]:.2f} recusado: {e}")
+            return e if recusas else None
+        except Exception as e:  # HttpError while offline, or an unexpected response
+            METRICA_LINKS.inc(provedor=self.nome, resultado="erro")
+            print(f"⚠️  {self.nome}: falha ao criar link de R$ {pedido[0]:.2f}: {e}")
+            return None
+
+    @abc.abstractmethod
+    def _criar(self, amount_brl, amount_sats):
+        """Create one withdraw link; the withdraw dict"""
+
+    async def _criar_async(self, http_async, amount_brl, amount_sats):
+        return await asyncio.to_thread(self._criar, amount_brl, amount_sats)
+
+    @abc.abstractmethod
+    def _status(self, withdraw_ids):
+        """{withdraw_id: {"usado": bool}} for the given ids that the provider still lists"""
+
+
+class LNbitsProvider(LightningProvider):
+    """LNbits withdraw extension (/withdraw/api/v1/links) through the shared HttpClient endpoint "lnbits" """
+
+    nome = "lnbits"
+
+    def __init__(self, http, url, admin_key, **kwargs):
+        super().__init__(**kwargs)
+        self.http = http
+        self.url = url.rstrip("/")
+        self.admin_key = admin_key
+
+    def _pedido(self, amount_brl, amount_sats):
+        """URL, headers and body of a single-use withdraw link creation"""
+        url = f"{self.url}/withdraw/api/v1/links"
+        headers = {
+            "X-Api-Key": self.admin_key,
+            "Content-Type": "application/json"
+        }
+        data = {
+            "title": f"ATM Withdraw R${amount_brl:.2f}",
+            "min_withdrawable": amount_sats,
+            "max_withdrawable": amount_sats,
+            "uses": 1,
+            "wait_time": 1,
+            "is_unique": True,
+            "webhook_url": self.webhook_url or "",
+            # LNbits posts these back with the claim, so the receiver can tell our webhooks apart
+            "webhook_headers": json.dumps({"X-ATM-Token": self.webhook_token}) if self.webhook_token else "",
+            "webhook_body": json.dumps({"amount_brl": amount_brl}) if self.webhook_url else ""
+        }
+        return url, headers, data
+
+    def _resultado(self, response, amount_brl, amount_sats):
+        if response.status_code == 201:
+            result = response.json()
+            return {
+                "success": True,
+                "lnurl": result["lnurl"],
+                "withdraw_id": result["id"],
+                "amount_brl": amount_brl,
+                "amount_sats": amount_sats,
+                "origem": self.nome
+            }
+
+        print(f"❌ Erro LNbits: {response.status_code} - {response.text}")
+        if response.status_code >= 500 or response.status_code == 429:
+            raise HttpError(f"lnbits: criação de link retornou {response.status_code}")
+        raise LinkRecusado(f"LNbits recusou o link: {response.status_code} - {response.text[:200]}")
+
+    def _criar(self, amount_brl, amount_sats):
+        url, headers, data = self._pedido(amount_brl, amount_sats)
+        print(f"🔗 Conectando com LNbits: {url}")
+        response = self.http.post("lnbits", url, headers=headers, json=data)
+        return self._resultado(response, amount_brl, amount_sats)
+
+    async def _criar_async(self, http_async, amount_brl, amount_sats):
+        url, headers, data = self._pedido(amount_brl, amount_sats)
+        print(f"🔗 Conectando com LNbits: {url}")
+        response = await http_async.post("lnbits", url, headers=headers, json=data)
+        return self._resultado(response, amount_brl, amount_sats)
+
+    def apagar_link(self, withdraw_id):
+        try:
+            self.http.request("DELETE", "lnbits", f"{self.url}/withdraw/api/v1/links/{withdraw_id}",
+                              headers={"X-Api-Key": self.admin_key})
+        except Exception as e:
+            print(f"⚠️  Erro ao apagar link {withdraw_id}: {e}")
+
+    def _status(self, withdraw_ids):
+        # One listing of the wallet's links answers for the whole batch
+        response = self.http.get("lnbits", f"{self.url}/withdraw/api/v1/links",
+                                 headers={"X-Api-Key": self.admin_key})
+        if response.status_code != 200:
+            raise HttpError(f"lnbits: listagem de links retornou {response.status_code}")
+        links = response.json()
+        if isinstance(links, dict):  # Newer LNbits pages the listing: {"data": [...], "total": n}
+            links = links.get("data", [])
+        procurados = set(withdraw_ids)
+        return {
+            link["id"]: {"usado": link.get("used", 0) >= link.get("uses", 1)}
+            for link in links if link.get("id") in procurados
+        }
+
+    def interpretar_webhook(self, corpo, cabecalhos):
+        if self.webhook_token and cabecalhos.get("X-ATM-Token") != self.webhook_token:
+            return None
+        return corpo.get("lnurlw") if isinstance(corpo, dict) else None
+
+
+# Provider name -> class (LIGHTNING_PROVIDER in atm-simple.py)
+PROVEDORES = {
+    LNbitsProvider.nome: LNbitsProvider,
+}
+
+
+def criar_provedor(nome, **kwargs):
+    """Instantiate a provider by name"""
+    if nome not in PROVEDORES:
+        raise ValueError(f"Provedor Lightning desconhecido: {nome} (disponíveis: {', '.join(PROVEDORES)})")
+    return PROVEDORES[nome](**kwargs)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Metrics
+In-process counters, gauges and latency histograms exported in the Prometheus text format
+
+Hot-path updates only take a per-metric lock and bump a few numbers; the text
+exposition is built on scrape. The backend serves it on a local Unix socket
+(MetricsServer) and app.py re-exports it on /metrics next to its own metrics.
+"""
+
+import bisect
+import contextlib
+import os
+import socket
+import threading
+import time
+
+# Latency buckets (seconds): sub-millisecond pulse handling up to slow network calls
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _formatar_numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}  # Label values tuple -> state
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        if len(rotulos) != len(self.rotulos):
+            raise ValueError(f"{self.nome}: rótulos esperados {self.rotulos}, recebidos {tuple(rotulos)}")
+        return tuple(str(rotulos[r]) for r in self.rotulos)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            itens = list(self._valores.items())
+        for chave, valor in itens:
+            linhas.extend(self._amostras(chave, valor))
+        return linhas
+
+    def _amostras(self, chave, valor):
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}"]
+
+
+class Contador(_Metrica):
+    """Monotonic counter"""
+
+    tipo = "counter"
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Value that goes up and down"""
+
+    tipo = "gauge"
+
+    def set(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = valor
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Histograma(_Metrica):
+    """Latency distribution in fixed buckets (seconds)"""
+
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            estado = self._valores.get(chave)
+            if estado is None:
+                estado = self._valores[chave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            estado[0][indice] += 1
+            estado[1] += valor
+            estado[2] += 1
+
+    @contextlib.contextmanager
+    def medir(self, **rotulos):
+        """Observe the duration of a with-block"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **rotulos)
+
+    def _amostras(self, chave, estado):
+        contagens, soma, total = estado[0][:], estado[1], estado[2]
+        linhas = []
+        acumulado = 0
+        for limite, contagem in zip(self.buckets + (float("inf"),), contagens):
+            acumulado += contagem
+            rotulos = _formatar_rotulos(self.rotulos, chave, ("le", _formatar_numero(float(limite))))
+            linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+        rotulos = _formatar_rotulos(self.rotulos, chave)
+        linhas.append(f"{self.nome}_sum{rotulos} {_formatar_numero(soma)}")
+        linhas.append(f"{self.nome}_count{rotulos} {total}")
+        return linhas
+
+
+class _Funcao(_Metrica):
+    """Value read from a callback at scrape time (existing counters, queue sizes)"""
+
+    def __init__(self, nome, ajuda, funcao, tipo="gauge"):
+        super().__init__(nome, ajuda)
+        self.funcao = funcao
+        self.tipo = tipo
+
+    def exportar(self):
+        try:
+            valor = self.funcao()
+        except Exception:
+            return []
+        if valor is None:
+            return []
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}",
+                f"{self.nome} {_formatar_numero(valor)}"]
+
+
+class Registro:
+    """Named set of metrics; registering the same name twice returns the existing metric"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            existente = self._metricas.get(metrica.nome)
+            if existente is not None:
+                return existente
+            self._metricas[metrica.nome] = metrica
+            return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def medidor(self, nome, ajuda, rotulos=()):
+        return self._registrar(Medidor(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_LATENCIA):
+        return self._registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+    def funcao(self, nome, ajuda, funcao, tipo="gauge"):
+        """Metric whose value is funcao() at scrape time"""
+        with self._lock:
+            self._metricas[nome] = _Funcao(nome, ajuda, funcao, tipo)
+
+    def exportar(self):
+        """Prometheus text exposition (version 0.0.4)"""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return "\n".join(linhas) + "\n"
+
+
+# Process-wide registry used by the instrumented modules
+REGISTRO = Registro()
+
+
+class MetricsServer:
+    """Serves the registry on a Unix socket: every connection receives one exposition and is closed"""
+
+    def __init__(self, caminho_socket, registro=REGISTRO):
+        self.caminho_socket = caminho_socket
+        self.registro = registro
+        self._sock = None
+
+    def start(self):
+        if os.path.exists(self.caminho_socket):
+            os.unlink(self.caminho_socket)  # Stale socket from a previous run
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.caminho_socket)
+        os.chmod(self.caminho_socket, 0o600)
+        self._sock.listen(4)
+        threading.Thread(target=self._aceitar, name="metricas", daemon=True).start()
+
+    def stop(self):
+        if self._sock:
+            self._sock.close()
+        try:
+            os.unlink(self.caminho_socket)
+        except OSError:
+            pass
+
+    def _aceitar(self):
+        while True:
+            try:
+                conexao, _ = self._sock.accept()
+            except OSError:
+                return
+            with conexao:
+                try:
+                    conexao.sendall(self.registro.exportar().encode())
+                except OSError:
+                    pass
+
+
+def ler_metricas(caminho_socket, timeout=1.0):
+    """Scrape a MetricsServer socket; returns the exposition text"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(caminho_socket)
+        partes = []
+        while True:
+            parte = sock.recv(65536)
+            if not parte:
+                break
+            partes.append(parte)
+    return b"".join(partes).decode()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Note Framing
+Groups debounced pulses from the edge ring into notes on a single long-lived worker,
+for one or several acceptors (channels) at once
+
+Signal conditioning: a pulse is counted on its rising edge once its LOW width
+passed the glitch filter, and the debounce between pulse starts is learned
+from the acceptor's own pulse period, so fast acceptors are not capped by a
+fixed debounce.
+"""
+
+import asyncio
+import bisect
+import collections
+import statistics
+import threading
+import time
+
+from async_log import LOG
+from metrics import REGISTRO
+from pulse_source import BORDA_DESCIDA
+
+# Pulse detection: edge timestamp (kernel or capture thread) -> handled by the framing worker
+BUCKETS_PULSO = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+METRICA_DETECCAO = REGISTRO.histograma("atm_pulso_deteccao_segundos",
+                                       "Atraso entre cada borda no pino e seu processamento",
+                                       buckets=BUCKETS_PULSO)
+METRICA_PULSOS = REGISTRO.contador("atm_pulsos_total", "Pulsos aceitos pelo framing", ("canal",))
+METRICA_REJEITADOS = REGISTRO.contador("atm_pulsos_rejeitados_total", "Pulsos descartados",
+                                       ("canal", "motivo"))
+METRICA_NOTAS = REGISTRO.contador("atm_notas_enquadradas_total", "Notas fechadas pelo framing",
+                                  ("canal", "origem"))
+METRICA_ENQUADRAMENTO = REGISTRO.histograma("atm_nota_enquadramento_segundos",
+                                            "Do primeiro pulso da nota até o fechamento da nota")
+
+# Pulse timing (width of the LOW pulse, interval between pulse starts), observed once per note
+BUCKETS_TIMING = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5)
+
+METRICA_LARGURA = REGISTRO.histograma("atm_pulso_largura_segundos", "Largura dos pulsos aceitos",
+                                      ("canal",), buckets=BUCKETS_TIMING)
+METRICA_INTERVALO = REGISTRO.histograma("atm_pulso_intervalo_segundos", "Intervalo entre inícios de pulsos da nota",
+                                        ("canal",), buckets=BUCKETS_TIMING)
+METRICA_DEBOUNCE = REGISTRO.medidor("atm_debounce_segundos", "Debounce aprendido por canal", ("canal",))
+
+
+def resumo_timing(valores_ns):
+    """min/median/max in ms plus counts per BUCKETS_TIMING bucket (ms upper bound -> count) of one note"""
+    if not valores_ns:
+        return None
+    histograma = collections.Counter()
+    for valor in valores_ns:
+        indice = bisect.bisect_left(BUCKETS_TIMING, valor / 1e9)
+        histograma[f"{BUCKETS_TIMING[indice] * 1000:g}" if indice < len(BUCKETS_TIMING) else "+Inf"] += 1
+    return {
+        "min_ms": round(min(valores_ns) / 1e6, 2),
+        "mediana_ms": round(statistics.median(valores_ns) / 1e6, 2),
+        "max_ms": round(max(valores_ns) / 1e6, 2),
+        "histograma": dict(histograma),
+    }
+
+
+class CanalNota:
+    """Framing state of one acceptor: current note, pulse filters and learned timing.
+
+    The end-of-note timeout is learned from the acceptor's inter-pulse gap:
+    once enough gaps have been seen, a note is closed after `fator_gap` times
+    the average gap, clamped to [timeout_min, timeout_max].
+
+    A falling edge starts a pending pulse; its rising edge counts it unless
+    the pulse was shorter than `largura_min` (glitch). Falling edges closer
+    than the debounce to the previous pulse start are dropped. The debounce
+    starts at `debounce_min` and, after every note, becomes `fator_debounce`
+    times the median of the recent inter-pulse gaps, clamped to
+    [debounce_min, debounce]: a stray 2x gap from a missed pulse does not
+    move it.
+    """
+
+    def __init__(self, nome="principal", debounce=0.1, timeout_max=3.0, timeout_min=0.25,
+                 fator_gap=4.0, amostras_min=3, debounce_min=0.01, fator_debounce=0.5, largura_min=0.01):
+        self.nome = nome
+        self.debounce_max_ns = int(debounce * 1e9)
+        self.debounce_min_ns = int(min(debounce_min, debounce) * 1e9)
+        self.fator_debounce = fator_debounce
+        self.largura_min_ns = int(largura_min * 1e9)
+        self.timeout_max_ns = int(timeout_max * 1e9)
+        self.timeout_min_ns = int(timeout_min * 1e9)
+        self.fator_gap = fator_gap
+        self.amostras_min = amostras_min
+        self.debounce_ns = self.debounce_min_ns  # Until the acceptor's pulse period is known
+
+        # Current note
+        self.pulsos = 0
+        self.primeiro_ns = 0
+        self.ultimo_ns = 0  # Start of the last counted pulse
+        self.deadline_ns = 0
+        self.pendente_ns = 0  # Falling edge waiting for its rising edge
+        self.larguras_nota = []
+        self.gaps_nota = []
+        self.glitches_nota = 0
+        self.debounce_nota = 0
+
+        # Learned inter-pulse gap (EWMA for the timeout, recent window for the debounce)
+        self.gap_medio_ns = 0.0
+        self.amostras_gap = 0
+        self.gaps_recentes = collections.deque(maxlen=32)
+
+        self.rejeitados_debounce = 0
+        self.rejeitados_glitch = 0
+        self.ultimo_diagnostico = None  # Timing summary of the last closed note
+
+    def ativo(self):
+        return bool(self.pulsos or self.pendente_ns)
+
+    def prazo_ns(self):
+        """When the current note closes; a pulse still LOW holds it open until timeout_max (stuck line)"""
+        if self.pendente_ns:
+            return max(self.deadline_ns if self.pulsos else 0, self.pendente_ns + self.timeout_max_ns)
+        return self.deadline_ns
+
+    def timeout_ns(self):
+        if self.amostras_gap < self.amostras_min:
+            return self.timeout_max_ns
+        timeout = int(self.gap_medio_ns * self.fator_gap)
+        return max(self.timeout_min_ns, min(self.timeout_max_ns, timeout))
+
+    def aprender_gap(self, gap_ns):
+        if self.amostras_gap == 0:
+            self.gap_medio_ns = float(gap_ns)
+        else:
+            self.gap_medio_ns += 0.2 * (gap_ns - self.gap_medio_ns)
+        self.amostras_gap += 1
+        self.gaps_recentes.append(gap_ns)
+
+    def aprender_debounce(self):
+        if len(self.gaps_recentes) < self.amostras_min:
+            return
+        debounce = int(statistics.median(self.gaps_recentes) * self.fator_debounce)
+        self.debounce_ns = max(self.debounce_min_ns, min(self.debounce_max_ns, debounce))
+        METRICA_DEBOUNCE.set(self.debounce_ns / 1e9, canal=self.nome)
+
+    def concluir_nota(self, agora_ns):
+        """Timing summary of the note being closed; resets the per-note counters"""
+        diagnostico = {
+            "canal": self.nome,
+            "pulsos": self.pulsos,
+            "duracao_ms": round((agora_ns - self.primeiro_ns) / 1e6, 1) if self.pulsos else 0.0,
+            "largura": resumo_timing(self.larguras_nota),
+            "intervalo": resumo_timing(self.gaps_nota),
+            "glitches": self.glitches_nota,
+            "rejeitados_debounce": self.debounce_nota,
+            "debounce_ms": round(self.debounce_ns / 1e6, 2),
+        }
+        for largura in self.larguras_nota:
+            METRICA_LARGURA.observe(largura / 1e9, canal=self.nome)
+        for gap in self.gaps_nota:
+            METRICA_INTERVALO.observe(gap / 1e9, canal=self.nome)
+        self.larguras_nota = []
+        self.gaps_nota = []
+        self.glitches_nota = 0
+        self.debounce_nota = 0
+        self.aprender_debounce()
+        return diagnostico
+
+
+class NoteFramer:
+    """Event-driven note framing for every acceptor channel.
+
+    One worker thread sleeps on the shared pulse ring until either an edge
+    arrives or the earliest end-of-note deadline (monotonic) among the
+    channels expires, so N acceptors cost one thread and each channel keeps
+    its own timing. on_nota is called with (pulse count, channel name).
+    Under the asyncio runtime the same framing runs as a task instead
+    (executar_async), with a small bridge thread handing edges to the loop.
+    """
+
+    def __init__(self, ring, on_nota, canais=None, intervalo_log=1.0, **parametros):
+        self.ring = ring
+        self.on_nota = on_nota
+        # Channel index in the ring -> state; a single default channel takes the timing parameters
+        self.canais = list(canais) if canais else [CanalNota(**parametros)]
+        self.intervalo_log = intervalo_log  # At most one per-pulse log record per interval
+        self._injetados = collections.deque()  # Simulated notes (pulse counts, channel index)
+        self._parar = threading.Event()
+        self._thread = None
+
+    @property
+    def rejeitados_debounce(self):
+        return sum(canal.rejeitados_debounce for canal in self.canais)
+
+    @property
+    def rejeitados_glitch(self):
+        return sum(canal.rejeitados_glitch for canal in self.canais)
+
+    def start(self):
+        """Start the framing worker"""
+        self._thread = threading.Thread(target=self._loop, name="framing", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the framing worker"""
+        self._parar.set()
+        self.ring.wakeup()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def simular(self, pulsos, canal=0):
+        """Inject a whole note (for tests) without touching the edge ring"""
+        self._injetados.append((pulsos, canal))
+        self.ring.wakeup()
+
+    def timeout_atual(self, canal=0):
+        """Current end-of-note silence window of a channel in seconds"""
+        return self.canais[canal].timeout_ns() / 1e9
+
+    def diagnostico(self, canal=0):
+        """Timing summary (pulse widths, intervals, rejections) of the channel's last closed note"""
+        return self.canais[canal].ultimo_diagnostico
+
+    def _borda(self, canal, tempo_ns, nivel):
+        # Falling edge (HIGH -> LOW) = start of a pulse from the bill acceptor
+        if nivel == BORDA_DESCIDA:
+            if canal.pendente_ns:
+                return  # Line already LOW (rising edge missed or misread): same pulse
+            if canal.ultimo_ns and tempo_ns - canal.ultimo_ns <= canal.debounce_ns:
+                canal.rejeitados_debounce += 1
+                canal.debounce_nota += 1
+                METRICA_REJEITADOS.inc(canal=canal.nome, motivo="debounce")
+                return
+            canal.pendente_ns = tempo_ns
+            return
+
+        # Rising edge (LOW -> HIGH) = end of the pulse: count it unless it was a glitch
+        inicio_ns = canal.pendente_ns
+        if not inicio_ns:
+            return  # Capture started mid-pulse, or its falling edge was debounced
+        canal.pendente_ns = 0
+        largura = tempo_ns - inicio_ns
+        if largura < canal.largura_min_ns:
+            canal.rejeitados_glitch += 1
+            canal.glitches_nota += 1
+            METRICA_REJEITADOS.inc(canal=canal.nome, motivo="glitch")
+            return
+        self._contar(canal, inicio_ns, largura)
+
+    def _contar(self, canal, tempo_ns, largura):
+        if canal.pulsos:
+            gap = tempo_ns - canal.ultimo_ns
+            if gap > canal.timeout_ns():
+                # Worker woke up late: the silence already ended the previous note
+                self._fechar(canal)
+            else:
+                canal.aprender_gap(gap)
+                canal.gaps_nota.append(gap)
+
+        if not canal.pulsos:
+            canal.primeiro_ns = tempo_ns
+        canal.pulsos += 1
+        canal.larguras_nota.append(largura)
+        METRICA_PULSOS.inc(canal=canal.nome)
+        if LOG.habilitado("debug"):
+            LOG.debug("pulso", f"🟡 Pulso detectado! Total: {canal.pulsos} ({canal.nome})",
+                      limite=self.intervalo_log, pulsos=canal.pulsos, canal=canal.nome)
+        canal.ultimo_ns = tempo_ns
+        canal.deadline_ns = tempo_ns + canal.timeout_ns()
+
+    def _fechar(self, canal):
+        pulsos = canal.pulsos
+        if not pulsos:
+            return
+        agora = time.monotonic_ns()
+        canal.ultimo_diagnostico = canal.concluir_nota(agora)
+        canal.pulsos = 0
+        METRICA_NOTAS.inc(canal=canal.nome, origem="pulsos")
+        METRICA_ENQUADRAMENTO.observe((agora - canal.primeiro_ns) / 1e9)
+        self.on_nota(pulsos, canal.nome)
+
+    def _prazo(self):
+        """Seconds until the earliest end-of-note deadline (1 s when idle, only to notice stop())"""
+        deadlines = [canal.prazo_ns() for canal in self.canais if canal.ativo()]
+        if deadlines:
+            return max(0.0, (min(deadlines) - time.monotonic_ns()) / 1e9)
+        return 1.0
+
+    def _consumir(self, bordas):
+        """Apply drained edges and injected notes, then close notes whose deadline passed"""
+        agora = time.monotonic_ns()
+        for tempo_ns, nivel, indice in bordas:
+            METRICA_DETECCAO.observe(max(0, agora - tempo_ns) / 1e9)
+            if indice < len(self.canais):
+                self._borda(self.canais[indice], tempo_ns, nivel)
+
+        while self._injetados:
+            pulsos, indice = self._injetados.popleft()
+            canal = self.canais[indice]
+            self._fechar(canal)
+            canal.ultimo_diagnostico = None  # No pulse timing for an injected note
+            METRICA_NOTAS.inc(canal=canal.nome, origem="simulada")
+            self.on_nota(pulsos, canal.nome)
+
+        agora = time.monotonic_ns()
+        for canal in self.canais:
+            if canal.ativo() and agora >= canal.prazo_ns():
+                if canal.pendente_ns:
+                    # LOW for longer than timeout_max: stuck line, not a pulse
+                    canal.pendente_ns = 0
+                    METRICA_REJEITADOS.inc(canal=canal.nome, motivo="travado")
+                self._fechar(canal)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                self._consumir(self.ring.pop_all() if self.ring.wait(self._prazo()) else [])
+            except Exception as e:
+                print(f"❌ Erro no framing de notas: {e}")
+
+    async def executar_async(self):
+        """Framing task for the asyncio runtime (on_nota is called on the loop thread)"""
+        loop = asyncio.get_running_loop()
+        fila = asyncio.Queue()
+        ponte = threading.Thread(target=self._ponte, args=(loop, fila), name="framing-ponte", daemon=True)
+        ponte.start()
+
+        while not self._parar.is_set():
+            try:
+                bordas = await asyncio.wait_for(fila.get(), self._prazo())
+            except asyncio.TimeoutError:
+                bordas = []
+            try:
+                self._consumir(bordas)
+            except Exception as e:
+                print(f"❌ Erro no framing de notas: {e}")
+
+    def _ponte(self, loop, fila):
+        # Blocking ring wait off the loop; each batch of edges (or a bare wakeup) is handed over thread-safely
+        while not self._parar.is_set():
+            if not self.ring.wait(1.0):
+                continue
+            try:
+                loop.call_soon_threadsafe(fila.put_nowait, self.ring.pop_all())
+            except RuntimeError:
+                return  # Loop closed
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Staged Pipeline
+Bounded queues and worker pools per stage, so note detection never waits on network or disk
+
+Pipeline runs each stage on a pool of threads; AsyncPipeline runs the same
+stages as tasks on one asyncio loop (the asyncio runtime of atm-simple.py).
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import queue
+import threading
+
+
+class _Etapa:
+    """One pipeline stage: an input queue drained by a pool of workers"""
+
+    def __init__(self, nome, func, workers, capacidade, ordenada):
+        self.nome = nome
+        self.func = func
+        self.workers = 1 if ordenada else workers  # Ordered stages run one item at a time
+        self.ordenada = ordenada
+        self.fila = queue.Queue(maxsize=capacidade)
+        self.processados = 0
+        self.falhas = 0
+        # Reorder buffer for ordered stages: items enter strictly by sequence number
+        self._lock = threading.Lock()
+        self._pendentes = []
+        self._proximo = 0
+
+    def entrar(self, seq, item, erro, timeout=None):
+        """Queue an item for this stage (blocks when full = back-pressure)"""
+        if not self.ordenada:
+            self.fila.put((seq, item, erro), timeout=timeout)
+            return
+
+        with self._lock:
+            heapq.heappush(self._pendentes, (seq, item, erro))
+            while self._pendentes and self._pendentes[0][0] == self._proximo:
+                self.fila.put(heapq.heappop(self._pendentes))
+                self._proximo += 1
+
+
+class Pipeline:
+    """Staged pipeline: each item flows through every stage in order.
+
+    Stage functions receive the item and return it (possibly updated). If a
+    stage raises, the item is marked as failed and skipped by later stages but
+    still keeps its place in the sequence, so ordered stages never stall.
+    on_erro(etapa, item, erro) is called for every stage failure.
+    """
+
+    def __init__(self, nome="pipeline", on_erro=None):
+        self.nome = nome
+        self.on_erro = on_erro
+        self._etapas = []
+        self._seq = itertools.count()
+        self._seq_lock = threading.Lock()
+        self._parar = threading.Event()
+        self._threads = []
+
+    def etapa(self, nome, func, workers=1, capacidade=8, ordenada=False):
+        """Append a stage; returns the pipeline for chaining"""
+        self._etapas.append(_Etapa(nome, func, workers, capacidade, ordenada))
+        return self
+
+    def start(self):
+        """Start every stage's worker pool"""
+        for indice, etapa in enumerate(self._etapas):
+            for n in range(etapa.workers):
+                t = threading.Thread(target=self._worker, args=(indice,),
+                                     name=f"{self.nome}-{etapa.nome}-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        """Stop workers (items still queued are dropped)"""
+        self._parar.set()
+        for t in self._threads:
+            t.join(timeout=2)
+
+    def submit(self, item, timeout=None):
+        """Feed an item into the first stage; raises queue.Full if timeout expires"""
+        # Sequence is assigned and queued atomically so ordered first stages stay in order
+        with self._seq_lock:
+            seq = next(self._seq)
+            self._etapas[0].entrar(seq, item, None, timeout=timeout)
+        return seq
+
+    def pendentes(self):
+        """Number of items waiting in stage queues"""
+        return sum(etapa.fila.qsize() for etapa in self._etapas)
+
+    def estatisticas(self):
+        """Per-stage counters"""
+        return {
+            etapa.nome: {
+                "fila": etapa.fila.qsize(),
+                "processados": etapa.processados,
+                "falhas": etapa.falhas,
+            }
+            for etapa in self._etapas
+        }
+
+    def _worker(self, indice):
+        etapa = self._etapas[indice]
+        proxima = self._etapas[indice + 1] if indice + 1 < len(self._etapas) else None
+
+        while not self._parar.is_set():
+            try:
+                seq, item, erro = etapa.fila.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            if erro is None:
+                try:
+                    item = etapa.func(item)
+                    etapa.processados += 1
+                except Exception as e:
+                    erro = e
+                    etapa.falhas += 1
+                    print(f"❌ Erro na etapa '{etapa.nome}': {e}")
+                    if self.on_erro:
+                        try:
+                            self.on_erro(etapa.nome, item, e)
+                        except Exception:
+                            pass
+
+            if proxima:
+                proxima.entrar(seq, item, erro)
+
+
+class _EtapaAsync:
+    """AsyncPipeline stage: an asyncio queue drained by worker tasks"""
+
+    def __init__(self, nome, func, workers, capacidade, ordenada, bloqueante):
+        self.nome = nome
+        self.func = func
+        self.workers = 1 if ordenada else workers
+        self.ordenada = ordenada
+        self.bloqueante = bloqueante  # Plain function that may block: run it in the default executor
+        self.corrotina = inspect.iscoroutinefunction(func)
+        # Ordered stages are fed only in sequence, so the reorder buffer bounds them instead
+        self.fila = asyncio.Queue(maxsize=0 if ordenada else capacidade)
+        self.processados = 0
+        self.falhas = 0
+        self._pendentes = []
+        self._proximo = 0
+
+    async def entrar(self, seq, item, erro):
+        if not self.ordenada:
+            await self.fila.put((seq, item, erro))
+            return
+
+        # Single loop thread: no lock needed between the heap push and the drain
+        heapq.heappush(self._pendentes, (seq, item, erro))
+        while self._pendentes and self._pendentes[0][0] == self._proximo:
+            self.fila.put_nowait(heapq.heappop(self._pendentes))
+            self._proximo += 1
+
+    async def executar(self, item):
+        if self.corrotina:
+            return await self.func(item)
+        if self.bloqueante:
+            return await asyncio.to_thread(self.func, item)
+        return self.func(item)
+
+
+class AsyncPipeline:
+    """Pipeline with the same stages, ordering and error semantics, run as tasks on one loop.
+
+    Stage functions may be coroutine functions (awaited), plain non-blocking
+    functions (called inline) or plain blocking ones (bloqueante=True, run in
+    the loop's executor). start() must be called from inside the running
+    loop; submit() may be called from any thread.
+    """
+
+    def __init__(self, nome="pipeline", on_erro=None):
+        self.nome = nome
+        self.on_erro = on_erro
+        self._etapas = []
+        self._seq = itertools.count()
+        self._seq_lock = threading.Lock()
+        self._loop = None
+        self._tarefas = []
+
+    def etapa(self, nome, func, workers=1, capacidade=8, ordenada=False, bloqueante=False):
+        """Append a stage; returns the pipeline for chaining"""
+        self._etapas.append(_EtapaAsync(nome, func, workers, capacidade, ordenada, bloqueante))
+        return self
+
+    def start(self):
+        """Start every stage's worker tasks on the running loop"""
+        self._loop = asyncio.get_running_loop()
+        for indice, etapa in enumerate(self._etapas):
+            for n in range(etapa.workers):
+                self._tarefas.append(self._loop.create_task(self._worker(indice),
+                                                            name=f"{self.nome}-{etapa.nome}-{n}"))
+
+    def stop(self):
+        """Cancel worker tasks (items still queued are dropped)"""
+        for tarefa in self._tarefas:
+            self._loop.call_soon_threadsafe(tarefa.cancel)
+
+    def submit(self, item, timeout=None):
+        """Feed an item into the first stage without blocking the caller (any thread)"""
+        with self._seq_lock:
+            seq = next(self._seq)
+            futuro = asyncio.run_coroutine_threadsafe(self._etapas[0].entrar(seq, item, None), self._loop)
+        if timeout is not None and not self._no_loop():
+            futuro.result(timeout)  # Off-loop callers may still wait for room (back-pressure)
+        return seq
+
+    def pendentes(self):
+        """Number of items waiting in stage queues"""
+        return sum(etapa.fila.qsize() for etapa in self._etapas)
+
+    def estatisticas(self):
+        """Per-stage counters"""
+        return {
+            etapa.nome: {
+                "fila": etapa.fila.qsize(),
+                "processados": etapa.processados,
+                "falhas": etapa.falhas,
+            }
+            for etapa in self._etapas
+        }
+
+    def _no_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def _worker(self, indice):
+        etapa = self._etapas[indice]
+        proxima = self._etapas[indice + 1] if indice + 1 < len(self._etapas) else None
+
+        while True:
+            seq, item, erro = await etapa.fila.get()
+
+            if erro is None:
+                try:
+                    item = await etapa.executar(item)
+                    etapa.processados += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    erro = e
+                    etapa.falhas += 1
+                    print(f"❌ Erro na etapa '{etapa.nome}': {e}")
+                    if self.on_erro:
+                        try:
+                            self.on_erro(etapa.nome, item, e)
+                        except Exception:
+                            pass
+
+            if proxima:
+                await proxima.entrar(seq, item, erro)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Price Feed
+Background BTC/BRL quote from several sources with median aggregation and a disk-backed cache
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRO
+
+
+def _coingecko(data):
+    return float(data["bitcoin"]["brl"])
+
+
+def _binance(data):
+    return float(data["price"])
+
+
+def _mercadobitcoin(data):
+    return float(data[0]["last"])
+
+
+# Source name -> (url, query params, response parser)
+FONTES_PRECO = {
+    "coingecko": ("https://api.coingecko.com/api/v3/simple/price",
+                  {"ids": "bitcoin", "vs_currencies": "brl"}, _coingecko),
+    "binance": ("https://api.binance.com/api/v3/ticker/price",
+                {"symbol": "BTCBRL"}, _binance),
+    "mercadobitcoin": ("https://api.mercadobitcoin.net/api/v4/tickers",
+                       {"symbols": "BTC-BRL"}, _mercadobitcoin),
+}
+
+METRICA_ATUALIZACAO = REGISTRO.histograma("atm_preco_atualizacao_segundos",
+                                          "Duração de uma atualização de preço (todas as fontes)")
+METRICA_FALHAS = REGISTRO.contador("atm_preco_falhas_total", "Atualizações de preço sem nenhuma fonte válida")
+METRICA_DIVERGENCIA = REGISTRO.contador("atm_preco_divergencia_total",
+                                        "Atualizações em que nenhuma fonte concordou com a mediana")
+METRICA_FONTE = REGISTRO.contador("atm_preco_fonte_erros_total",
+                                  "Fontes de preço que falharam ou foram descartadas", ("fonte", "motivo"))
+
+# Immutable quote snapshot; replaced as a whole so readers never need a lock
+Cotacao = namedtuple("Cotacao", ["preco", "atualizado_em", "fontes", "origem"])
+
+
+def agregar_precos(precos, desvio_max=0.02):
+    """Median of the quotes after rejecting those more than desvio_max away from the median.
+
+    If none is that close (e.g. two sources far apart), the median of all
+    quotes is returned with every source; publicar() reports it as divergent.
+    """
+    if not precos:
+        return None, []
+    mediana = statistics.median(precos.values())
+    aceitos = {nome: p for nome, p in precos.items() if abs(p - mediana) / mediana <= desvio_max}
+    if not aceitos:
+        return mediana, sorted(precos)
+    return statistics.median(aceitos.values()), sorted(aceitos)
+
+
+class PriceFeed:
+    """Continuously refreshed quote (stale-while-revalidate).
+
+    preco() and cotacao() only read the current snapshot from memory; all
+    network I/O happens on the refresh thread. The last good quote is
+    persisted so a restart serves a price immediately. Under the asyncio
+    runtime executar_async() replaces the refresh thread.
+    """
+
+    def __init__(self, http, fontes=("coingecko",), intervalo=300, intervalo_erro=30, idade_max=900,
+                 arquivo=None, preco_padrao=500000.0, desvio_max=0.02, on_atualizacao=None):
+        self.http = http
+        self.fontes = [f for f in fontes if f in FONTES_PRECO]
+        self.intervalo = intervalo
+        self.intervalo_erro = intervalo_erro  # Retry delay after a failed refresh
+        self.idade_max = idade_max
+        self.arquivo = arquivo
+        self.desvio_max = desvio_max
+        self.on_atualizacao = on_atualizacao  # Called with each new Cotacao fetched from the network
+        self._cotacao = Cotacao(preco_padrao, 0.0, [], "padrao")
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._loop_async = None
+        self._acordar_async = None
+        self._carregar()
+
+    def cotacao(self):
+        """Current quote snapshot (never blocks)"""
+        return self._cotacao
+
+    def preco(self):
+        """Current BTC price in BRL (never blocks)"""
+        return self._cotacao.preco
+
+    def idade(self):
+        """Seconds since the last successful refresh (inf if never refreshed)"""
+        atualizado_em = self._cotacao.atualizado_em
+        return time.time() - atualizado_em if atualizado_em else float("inf")
+
+    def obsoleta(self):
+        return self.idade() > self.idade_max
+
+    def confiavel(self):
+        """Fresh and agreed on by the sources: required before committing money ahead of a customer"""
+        cotacao = self._cotacao
+        return cotacao.origem in ("rede", "disco") and not self.obsoleta()
+
+    def start(self):
+        """Start the background refresh thread"""
+        self._thread = threading.Thread(target=self._loop, name="preco", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
+        self.solicitar_atualizacao()
+
+    def solicitar_atualizacao(self):
+        """Ask the refresh thread (or task) to update now (does not wait)"""
+        if self._loop_async:
+            self._loop_async.call_soon_threadsafe(self._acordar_async.set)
+        else:
+            self._acordar.set()
+
+    def atualizar(self):
+        """Fetch every source once and publish the aggregated quote; returns True on success"""
+        precos = {}
+        with METRICA_ATUALIZACAO.medir(), ThreadPoolExecutor(max_workers=max(1, len(self.fontes))) as executor:
+            futuros = {nome: executor.submit(self._buscar, nome) for nome in self.fontes}
+            for nome, futuro in futuros.items():
+                preco = futuro.result()
+                if preco:
+                    precos[nome] = preco
+                else:
+                    METRICA_FONTE.inc(fonte=nome, motivo="erro")
+        return self.publicar(precos)
+
+    async def atualizar_async(self, http_async):
+        """atualizar() with every source fetched concurrently on the event loop"""
+        with METRICA_ATUALIZACAO.medir():
+            resultados = await asyncio.gather(*(self._buscar_async(http_async, nome) for nome in self.fontes))
+        precos = {}
+        for nome, preco in zip(self.fontes, resultados):
+            if preco:
+                precos[nome] = preco
+            else:
+                METRICA_FONTE.inc(fonte=nome, motivo="erro")
+        return self.publicar(precos)
+
+    def publicar(self, precos):
+        """Aggregate fetched quotes {source: price} and publish the result; returns True on success"""
+        preco, aceitos = agregar_precos(precos, self.desvio_max)
+        if preco is None:
+            print("⚠️  Nenhuma fonte de preço respondeu - mantendo último preço")
+            METRICA_FALHAS.inc()
+            return False
+
+        origem = "rede"
+        rejeitados = sorted(set(precos) - set(aceitos))
+        if rejeitados:
+            print(f"⚠️  Fontes de preço descartadas (outlier): {rejeitados}")
+            for nome in rejeitados:
+                METRICA_FONTE.inc(fonte=nome, motivo="outlier")
+        elif any(abs(precos[nome] - preco) / preco > self.desvio_max for nome in aceitos):
+            # Sources disagree: the median of all of them beats pricing withdraws from an old quote
+            origem = "divergente"
+            METRICA_DIVERGENCIA.inc()
+            print("⚠️  Fontes de preço divergem (" +
+                  ", ".join(f"{nome} R$ {precos[nome]:,.2f}" for nome in aceitos) + ") - usando a mediana")
+
+        self._cotacao = Cotacao(preco, time.time(), aceitos, origem)
+        print(f"✅ Preço atualizado: 1 BTC = R$ {preco:,.2f} ({', '.join(aceitos)})")
+        self._salvar()
+        if self.on_atualizacao:
+            try:
+                self.on_atualizacao(self._cotacao)
+            except Exception as e:
+                print(f"⚠️  Erro no callback de preço: {e}")
+        return True
+
+    def _buscar(self, nome):
+        url, params, parser = FONTES_PRECO[nome]
+        try:
+            response = self.http.get(nome, url, params=params)
+            if response.status_code != 200:
+                print(f"⚠️  Erro na API {nome}: {response.status_code}")
+                return None
+            return parser(response.json())
+        except Exception as e:
+            print(f"⚠️  Erro ao buscar preço em {nome}: {e}")
+            return None
+
+    async def _buscar_async(self, http_async, nome):
+        url, params, parser = FONTES_PRECO[nome]
+        try:
+            response = await http_async.get(nome, url, params=params)
+            if response.status_code != 200:
+                print(f"⚠️  Erro na API {nome}: {response.status_code}")
+                return None
+            return parser(response.json())
+        except Exception as e:
+            print(f"⚠️  Erro ao buscar preço em {nome}: {e}")
+            return None
+
+    async def executar_async(self, http_async):
+        """Refresh task for the asyncio runtime (same schedule as the refresh thread)"""
+        self._loop_async = asyncio.get_running_loop()
+        self._acordar_async = asyncio.Event()
+        proxima = time.monotonic() + max(0.0, self.intervalo - self.idade())
+
+        try:
+            while not self._parar.is_set():
+                if time.monotonic() >= proxima or self._acordar_async.is_set():
+                    self._acordar_async.clear()
+                    print("💱 Atualizando preço do Bitcoin...")
+                    try:
+                        ok = await self.atualizar_async(http_async)
+                    except Exception as e:
+                        print(f"⚠️  Erro ao atualizar preço: {e}")
+                        ok = False
+                    proxima = time.monotonic() + (self.intervalo if ok else self.intervalo_erro)
+
+                try:
+                    await asyncio.wait_for(self._acordar_async.wait(), max(0.0, proxima - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop_async = None
+
+    def _loop(self):
+        # A persisted quote younger than one interval delays the first refresh
+        proxima = time.monotonic() + max(0.0, self.intervalo - self.idade())
+
+        while not self._parar.is_set():
+            if time.monotonic() >= proxima or self._acordar.is_set():
+                self._acordar.clear()
+                print("💱 Atualizando preço do Bitcoin...")
+                try:
+                    ok = self.atualizar()
+                except Exception as e:
+                    print(f"⚠️  Erro ao atualizar preço: {e}")
+                    ok = False
+                proxima = time.monotonic() + (self.intervalo if ok else self.intervalo_erro)
+
+            self._acordar.wait(max(0.0, proxima - time.monotonic()))
+
+    def _carregar(self):
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return
+        try:
+            with open(self.arquivo) as f:
+                data = json.load(f)
+            self._cotacao = Cotacao(float(data["preco"]), float(data["atualizado_em"]),
+                                    list(data.get("fontes", [])), "disco")
+            print(f"💾 Preço carregado do disco: R$ {self._cotacao.preco:,.2f}")
+        except Exception as e:
+            print(f"⚠️  Erro ao carregar preço salvo: {e}")
+
+    def _salvar(self):
+        if not self.arquivo:
+            return
+        cotacao = self._cotacao
+        tmp = f"{self.arquivo}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"preco": cotacao.preco, "atualizado_em": cotacao.atualizado_em,
+                           "fontes": cotacao.fontes}, f)
+            os.replace(tmp, self.arquivo)
+        except Exception as e:
+            print(f"⚠️  Erro ao salvar preço: {e}")
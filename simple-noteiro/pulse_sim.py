@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Simulated Pulse Source
+Replays recorded or synthetic acceptor edge traces into the pulse ring without GPIO hardware
+
+Trace files are plain text, one edge per line: "<seconds since start> <level> [channel]",
+where level 0 is a falling edge (pulse start) and 1 a rising edge, and channel
+is the acceptor index (default 0). Lines starting with '#' are ignored.
+"""
+
+import random
+import threading
+import time
+
+from pulse_source import BORDA_DESCIDA, BORDA_SUBIDA, PulseSource
+
+
+class SimulatedSource(PulseSource):
+    """Replays a trace at real speed (velocidade=1) or accelerated.
+
+    Each edge is pushed with its scheduled monotonic timestamp, the way the
+    kernel timestamps real edges, so late wakeups do not distort pulse timing.
+    """
+
+    nome = "sim"
+
+    def __init__(self, pinos, ring, trace, velocidade=1.0):
+        super().__init__(pinos, ring)
+        self.trace = sorted(tuple(borda) + (0,) * (3 - len(borda)) for borda in trace)
+        self.velocidade = velocidade
+        self.inicio_ns = None
+        self.concluido = threading.Event()
+
+    def instante_ns(self, t):
+        """Monotonic timestamp of trace time t (valid after start)"""
+        return self.inicio_ns + int(t / self.velocidade * 1e9)
+
+    def _loop(self):
+        self.inicio_ns = time.monotonic_ns()
+        for t, nivel, canal in self.trace:
+            alvo = self.instante_ns(t)
+            espera = (alvo - time.monotonic_ns()) / 1e9
+            if espera > 0 and self._parar.wait(espera):
+                return
+            self.ring.push(alvo, nivel, canal)
+        self.concluido.set()
+
+
+def gerar_trace(notas, periodo=0.15, largura=0.05, gap_notas=3.5, jitter=0.0, bounce=0.0,
+                dropout=0.0, inicio=0.5, seed=None, canal=0):
+    """Synthetic trace for a list of notes given as pulse counts.
+
+    jitter: relative random variation of pulse width and period
+    bounce: probability of a contact bounce (extra 1 ms glitch) after a falling edge
+    dropout: probability of a pulse being lost entirely
+    canal: acceptor index of every edge (merge traces of several channels with sorted())
+    Returns (edges, notes) where notes is a list of (pulses, time of last falling edge).
+    """
+    rnd = random.Random(seed)
+    bordas = []
+    resumo = []
+    t = inicio
+
+    def variar(valor):
+        return valor * (1 + jitter * rnd.uniform(-1, 1))
+
+    for pulsos in notas:
+        ultima = t
+        for _ in range(pulsos):
+            if dropout and rnd.random() < dropout:
+                t += variar(periodo)
+                continue
+            bordas.append((t, BORDA_DESCIDA, canal))
+            if bounce and rnd.random() < bounce:
+                bordas.append((t + 0.001, BORDA_SUBIDA, canal))
+                bordas.append((t + 0.002, BORDA_DESCIDA, canal))
+            bordas.append((t + variar(largura), BORDA_SUBIDA, canal))
+            ultima = t
+            t += variar(periodo)
+        resumo.append((pulsos, ultima))
+        t = ultima + gap_notas
+
+    return bordas, resumo
+
+
+def notas_do_trace(bordas, gap=1.0, canal=0):
+    """Infer one channel's notes from a recorded trace: falling edges separated by more than `gap` seconds"""
+    resumo = []
+    pulsos = 0
+    ultima = None
+    for t, nivel, *resto in sorted(bordas):
+        if nivel != BORDA_DESCIDA or (resto[0] if resto else 0) != canal:
+            continue
+        if ultima is not None and t - ultima > gap:
+            resumo.append((pulsos, ultima))
+            pulsos = 0
+        pulsos += 1
+        ultima = t
+    if pulsos:
+        resumo.append((pulsos, ultima))
+    return resumo
+
+
+def carregar_trace(arquivo):
+    """Read a trace file into a list of (seconds, level, channel)"""
+    bordas = []
+    with open(arquivo) as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha or linha.startswith("#"):
+                continue
+            t, nivel, *canal = linha.split()
+            bordas.append((float(t), int(nivel), int(canal[0]) if canal else 0))
+    return bordas
+
+
+def salvar_trace(arquivo, bordas):
+    """Write a list of (seconds, level[, channel]) as a trace file"""
+    with open(arquivo, "w") as f:
+        f.write("# segundos nivel canal (0 = descida, 1 = subida)\n")
+        for t, nivel, *canal in bordas:
+            f.write(f"{t:.6f} {nivel} {canal[0] if canal else 0}\n")
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Pulse Sources
+Captures edges from the banknote acceptor signals into a ring buffer of monotonic timestamps
+
+Every source watches one or more pins (one per acceptor) from a single thread or
+kernel request; each edge is tagged with the channel index of its pin.
+"""
+
+import abc
+import threading
+import time
+
+# Edge kinds stored in the ring (line level right after the edge)
+BORDA_DESCIDA = 0  # HIGH -> LOW = pulse from bill acceptor
+BORDA_SUBIDA = 1   # LOW -> HIGH = end of pulse
+
+# Default GPIO character device (Pi 5 on older kernels exposes the header as gpiochip4)
+GPIO_CHIP_PADRAO = "/dev/gpiochip0"
+
+# Fallback poller interval (seconds)
+INTERVALO_POLLING = 0.01
+
+
+class PulseRing:
+    """Single-producer / single-consumer ring buffer of (timestamp, level, channel) edges.
+
+    The capture thread only advances the write index and the consumer only
+    advances the read index, so no lock is taken per edge. The consumer can
+    block in wait() and is only woken when it is actually sleeping.
+    """
+
+    def __init__(self, capacidade=4096):
+        self._capacidade = capacidade
+        self._tempos = [0] * capacidade
+        self._niveis = [0] * capacidade
+        self._canais = [0] * capacidade
+        self._escrita = 0
+        self._leitura = 0
+        self._aguardando = False
+        self._sinal = threading.Event()
+        self.descartados = 0  # Edges lost because the consumer fell behind
+
+    def __len__(self):
+        return self._escrita - self._leitura
+
+    def push(self, timestamp_ns, nivel=BORDA_DESCIDA, canal=0):
+        """Store one edge (producer side). Returns False if the ring is full"""
+        if self._escrita - self._leitura >= self._capacidade:
+            self.descartados += 1
+            return False
+
+        i = self._escrita % self._capacidade
+        self._tempos[i] = timestamp_ns
+        self._niveis[i] = nivel
+        self._canais[i] = canal
+        self._escrita += 1  # Publish only after the slot is written
+
+        if self._aguardando:
+            self._sinal.set()
+        return True
+
+    def pop_all(self):
+        """Drain every pending edge as a list of (timestamp_ns, nivel, canal) (consumer side)"""
+        fim = self._escrita
+        eventos = []
+        while self._leitura < fim:
+            i = self._leitura % self._capacidade
+            eventos.append((self._tempos[i], self._niveis[i], self._canais[i]))
+            self._leitura += 1
+        return eventos
+
+    def wait(self, timeout=None):
+        """Block until edges are pending or timeout expires (consumer side)"""
+        if self._escrita != self._leitura:
+            return True
+
+        self._aguardando = True
+        try:
+            # Re-check after announcing we are waiting to avoid a lost wakeup
+            if self._escrita != self._leitura:
+                return True
+            acordou = self._sinal.wait(timeout)
+            self._sinal.clear()
+            return acordou
+        finally:
+            self._aguardando = False
+
+    def wakeup(self):
+        """Wake a blocked consumer without pushing an edge"""
+        self._sinal.set()
+
+
+class PulseSource(abc.ABC):
+    """Base class for edge capture backends feeding a PulseRing.
+
+    `pinos` is a pin number or a list of pins; edges are tagged with the
+    pin's index in that list (the acceptor channel). Backends implement
+    _loop(), so a backend missing it fails when it is created.
+    """
+
+    nome = "base"
+
+    def __init__(self, pinos, ring):
+        self.pinos = list(pinos) if isinstance(pinos, (list, tuple)) else [pinos]
+        self.canal_do_pino = {pino: i for i, pino in enumerate(self.pinos)}
+        self.ring = ring
+        self._parar = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start capturing edges in a background thread"""
+        self._thread = threading.Thread(target=self._loop, name=f"pulsos-{self.nome}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop capturing edges"""
+        self._parar.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    @abc.abstractmethod
+    def _loop(self):
+        """Capture edges into the ring until _parar is set"""
+
+
+class GpiodEdgeSource(PulseSource):
+    """Edge-interrupt backend using the kernel GPIO character device (libgpiod v2).
+
+    The kernel timestamps every edge with CLOCK_MONOTONIC, so pulse timing is
+    independent of how quickly this thread gets scheduled.
+    """
+
+    nome = "gpiod"
+
+    def __init__(self, pinos, ring, chip=GPIO_CHIP_PADRAO):
+        super().__init__(pinos, ring)
+        import gpiod
+        from gpiod.line import Bias, Clock, Direction, Edge
+
+        self._gpiod = gpiod
+        # One request for every acceptor line: a single fd and thread for N channels
+        self._request = gpiod.request_lines(
+            chip,
+            consumer="atm-simple",
+            config={
+                tuple(self.pinos): gpiod.LineSettings(
+                    direction=Direction.INPUT,
+                    edge_detection=Edge.BOTH,
+                    bias=Bias.PULL_UP,
+                    event_clock=Clock.MONOTONIC,
+                )
+            },
+        )
+
+    def _loop(self):
+        descida = self._gpiod.EdgeEvent.Type.FALLING_EDGE
+        try:
+            while not self._parar.is_set():
+                # Sleeps in the kernel until an edge arrives; timeout only to notice stop()
+                if not self._request.wait_edge_events(1.0):
+                    continue
+                for evento in self._request.read_edge_events():
+                    nivel = BORDA_DESCIDA if evento.event_type == descida else BORDA_SUBIDA
+                    self.ring.push(evento.timestamp_ns, nivel, self.canal_do_pino.get(evento.line_offset, 0))
+        except Exception as e:
+            if not self._parar.is_set():
+                print(f"❌ Erro na captura gpiod: {e}")
+
+    def stop(self):
+        super().stop()
+        try:
+            self._request.release()
+        except Exception:
+            pass
+
+
+class RPiEdgeSource(PulseSource):
+    """Edge-interrupt backend using RPi.GPIO event detection callbacks"""
+
+    nome = "rpi-edge"
+
+    def __init__(self, pinos, ring, gpio):
+        super().__init__(pinos, ring)
+        self._gpio = gpio
+        gpio.setmode(gpio.BCM)
+        for pino in self.pinos:
+            gpio.setup(pino, gpio.IN, pull_up_down=gpio.PUD_UP)
+            # Registered here so an unsupported edge detection fails during backend selection
+            gpio.add_event_detect(pino, gpio.BOTH, callback=self._callback)
+
+    def _callback(self, pino):
+        # Timestamp first; reading the level afterwards is best effort
+        agora = time.monotonic_ns()
+        nivel = BORDA_SUBIDA if self._gpio.input(pino) else BORDA_DESCIDA
+        self.ring.push(agora, nivel, self.canal_do_pino[pino])
+
+    def start(self):
+        pass  # Callbacks already run on the RPi.GPIO event thread
+
+    def _loop(self):
+        pass  # No capture thread: edges arrive through _callback
+
+    def stop(self):
+        for pino in self.pinos:
+            try:
+                self._gpio.remove_event_detect(pino)
+            except Exception:
+                pass
+
+
+class PollingSource(PulseSource):
+    """Fallback backend: polls the pin levels (original behaviour, limited by INTERVALO_POLLING).
+
+    Every pin is sampled by the same thread, so N acceptors still cost one poller.
+    """
+
+    nome = "polling"
+
+    def __init__(self, pinos, ring, gpio, intervalo=INTERVALO_POLLING):
+        super().__init__(pinos, ring)
+        self._gpio = gpio
+        self._intervalo = intervalo
+        gpio.setmode(gpio.BCM)
+        for pino in self.pinos:
+            gpio.setup(pino, gpio.IN, pull_up_down=gpio.PUD_UP)
+
+    def _loop(self):
+        previous_states = [self._gpio.input(pino) for pino in self.pinos]
+        print(f"🔍 Polling iniciado - Estado inicial: "
+              f"{', '.join('HIGH' if estado else 'LOW' for estado in previous_states)}")
+
+        while not self._parar.is_set():
+            try:
+                for canal, pino in enumerate(self.pinos):
+                    current_state = self._gpio.input(pino)
+                    if current_state != previous_states[canal]:
+                        nivel = BORDA_SUBIDA if current_state else BORDA_DESCIDA
+                        self.ring.push(time.monotonic_ns(), nivel, canal)
+                    previous_states[canal] = current_state
+                self._parar.wait(self._intervalo)
+            except Exception as e:
+                print(f"❌ Erro no polling GPIO: {e}")
+                break
+
+
+def criar_fonte_pulsos(pinos, ring, backend="auto", gpio=None, chip=GPIO_CHIP_PADRAO, trace=None):
+    """Create the best available pulse source (gpiod -> RPi.GPIO edge -> polling, or sim)"""
+    if backend == "sim":
+        from pulse_sim import SimulatedSource, carregar_trace
+        if isinstance(trace, str):
+            trace = carregar_trace(trace)
+        return SimulatedSource(pinos, ring, trace or [])
+
+    ordem = ["gpiod", "rpi-edge", "polling"] if backend == "auto" else [backend]
+    ultimo_erro = None
+
+    for nome in ordem:
+        try:
+            if nome == "gpiod":
+                return GpiodEdgeSource(pinos, ring, chip=chip)
+            if gpio is None:
+                raise RuntimeError("RPi.GPIO não disponível")
+            if nome == "rpi-edge":
+                return RPiEdgeSource(pinos, ring, gpio)
+            if nome == "polling":
+                return PollingSource(pinos, ring, gpio)
+            raise ValueError(f"Backend de pulsos desconhecido: {nome}")
+        except Exception as e:
+            ultimo_erro = e
+            if backend == "auto":
+                print(f"⚠️  Backend de pulsos '{nome}' indisponível: {e}")
+
+    raise RuntimeError(f"Nenhuma fonte de pulsos disponível: {ultimo_erro}")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - QR Rendering Cache
+Encodes each payload once, keeps the module matrix in a bounded LRU and renders SVG/PNG/ASCII lazily
+"""
+
+import base64
+import collections
+import hashlib
+import struct
+import threading
+import zlib
+
+
+class QrImagem:
+    """One encoded payload: the module matrix plus lazily rendered outputs"""
+
+    def __init__(self, payload, matriz):
+        self.payload = payload
+        self.matriz = matriz  # List of rows of booleans (True = dark), without quiet zone
+        self.id = hashlib.sha256(payload.encode()).hexdigest()[:16]
+        self._variantes = {}
+        self._lock = threading.Lock()
+
+    def etag(self, formato):
+        return f'"{self.id}-{formato}"'
+
+    def svg(self, borda=4):
+        """SVG document (scales to any size, a few KB)"""
+        return self._variante(("svg", borda), lambda: self._render_svg(borda))
+
+    def png(self, box_size=10, borda=4):
+        """PNG bytes (1-bit grayscale)"""
+        return self._variante(("png", box_size, borda), lambda: self._render_png(box_size, borda))
+
+    def data_uri(self, box_size=10, borda=4):
+        """PNG as a data: URI for inline <img> tags"""
+        return self._variante(("uri", box_size, borda), lambda: "data:image/png;base64," +
+                              base64.b64encode(self.png(box_size, borda)).decode())
+
+    def ascii(self, borda=2):
+        """Terminal rendering using half-block characters (two rows per line)"""
+        return self._variante(("ascii", borda), lambda: self._render_ascii(borda))
+
+    def exportar(self):
+        """Compact matrix for sending to another process (one hex string per row)"""
+        return [format(int("".join("1" if m else "0" for m in linha), 2), "x") for linha in self.matriz]
+
+    def _variante(self, chave, render):
+        valor = self._variantes.get(chave)
+        if valor is None:
+            with self._lock:
+                valor = self._variantes.get(chave)
+                if valor is None:
+                    valor = self._variantes[chave] = render()
+        return valor
+
+    def _com_borda(self, borda):
+        largura = len(self.matriz) + 2 * borda
+        vazia = [False] * largura
+        linhas = [vazia] * borda
+        linhas += [[False] * borda + list(linha) + [False] * borda for linha in self.matriz]
+        linhas += [vazia] * borda
+        return linhas
+
+    def _render_svg(self, borda):
+        tamanho = len(self.matriz) + 2 * borda
+        caminho = "".join(
+            f"M{x + borda},{y + borda}h1v1h-1z"
+            for y, linha in enumerate(self.matriz)
+            for x, escuro in enumerate(linha) if escuro
+        )
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {tamanho} {tamanho}" '
+            f'shape-rendering="crispEdges"><rect width="100%" height="100%" fill="#fff"/>'
+            f'<path d="{caminho}" fill="#000"/></svg>'
+        )
+
+    def _render_png(self, box_size, borda):
+        linhas = self._com_borda(borda)
+        largura = len(linhas[0]) * box_size
+
+        dados = bytearray()
+        for linha in linhas:
+            # 1 bit per pixel, 1 = white
+            bits = "".join(("0" if escuro else "1") * box_size for escuro in linha)
+            bits += "0" * (-len(bits) % 8)
+            pixels = int(bits, 2).to_bytes(len(bits) // 8, "big")
+            dados += (b"\x00" + pixels) * box_size  # Filter type 0 per scanline
+
+        def chunk(tipo, conteudo):
+            return (struct.pack(">I", len(conteudo)) + tipo + conteudo +
+                    struct.pack(">I", zlib.crc32(tipo + conteudo) & 0xffffffff))
+
+        return (b"\x89PNG\r\n\x1a\n" +
+                chunk(b"IHDR", struct.pack(">IIBBBBB", largura, largura, 1, 0, 0, 0, 0)) +
+                chunk(b"IDAT", zlib.compress(bytes(dados), 9)) +
+                chunk(b"IEND", b""))
+
+    def _render_ascii(self, borda):
+        linhas = self._com_borda(borda)
+        if len(linhas) % 2:
+            linhas.append([False] * len(linhas[0]))
+        blocos = {(False, False): " ", (True, False): "▀", (False, True): "▄", (True, True): "█"}
+        return "\n".join(
+            "".join(blocos[(a, b)] for a, b in zip(cima, baixo))
+            for cima, baixo in zip(linhas[0::2], linhas[1::2])
+        )
+
+
+class QrCache:
+    """Bounded LRU of encoded QR payloads, addressable by payload or by id"""
+
+    def __init__(self, capacidade=64):
+        self.capacidade = capacidade
+        self._itens = collections.OrderedDict()  # id -> QrImagem
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.codificacoes = 0
+
+    def obter(self, payload):
+        """Encoded QR for the payload (encodes only on first use)"""
+        chave = hashlib.sha256(payload.encode()).hexdigest()[:16]
+        with self._lock:
+            imagem = self._itens.get(chave)
+            if imagem is not None:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return imagem
+
+        return self._guardar(QrImagem(payload, self._codificar(payload)))
+
+    def importar(self, payload, matriz_hex):
+        """Store a matrix already encoded by another process (see QrImagem.exportar)"""
+        largura = len(matriz_hex)
+        matriz = [[bit == "1" for bit in format(int(linha, 16), f"0{largura}b")] for linha in matriz_hex]
+        return self._guardar(QrImagem(payload, matriz))
+
+    def por_id(self, qr_id):
+        """Cached QR by id, or None if evicted"""
+        with self._lock:
+            imagem = self._itens.get(qr_id)
+            if imagem is not None:
+                self._itens.move_to_end(qr_id)
+            return imagem
+
+    def _guardar(self, imagem):
+        with self._lock:
+            self._itens[imagem.id] = imagem
+            self._itens.move_to_end(imagem.id)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+        return imagem
+
+    def _codificar(self, payload):
+        import qrcode  # Only needed to encode: kept off the backend's startup path
+
+        self.codificacoes += 1
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            border=0,  # Quiet zone is added per output
+        )
+        qr.add_data(payload)
+        qr.make(fit=True)
+        return [list(linha) for linha in qr.get_matrix()]
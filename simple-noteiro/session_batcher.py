@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Session Batching
+Accumulates the notes of one customer into a single withdraw, with a provisional quote kept up to date
+
+A session opens with the first note on an acceptor channel and closes when the
+customer confirms, when no note arrives for `ociosa` seconds, or `duracao_max`
+seconds after it opened. on_fechar is then called once with the whole session,
+so a five-note deposit costs one LNbits link and one QR instead of five.
+"""
+
+import threading
+import time
+import uuid
+
+from metrics import REGISTRO
+
+METRICA_FECHADAS = REGISTRO.contador("atm_sessoes_fechadas_total", "Sessões fechadas em um único saque",
+                                     ("motivo",))
+METRICA_NOTAS_SESSAO = REGISTRO.histograma("atm_sessao_notas", "Notas por sessão fechada",
+                                           buckets=(1, 2, 3, 4, 5, 8, 13, 20))
+
+
+class Sessao:
+    """Open session of one acceptor channel"""
+
+    def __init__(self, canal):
+        self.ident = uuid.uuid4().hex[:12]  # Also the id of the withdraw it becomes
+        self.canal = canal
+        self.notas = []  # (valor, pulsos, note id)
+        self.total = 0.0
+        self.sats = 0  # Provisional quote of the running total
+        self.aberta_em = time.monotonic()
+        self.ultima_nota = self.aberta_em
+
+    def prazo(self, ociosa, duracao_max):
+        """Monotonic time at which the session closes by itself"""
+        return min(self.ultima_nota + ociosa, self.aberta_em + duracao_max)
+
+    def resumo(self, ociosa, duracao_max):
+        return {
+            "id": self.ident,
+            "canal": self.canal,
+            "total": self.total,
+            "notas": len(self.notas),
+            "sats": self.sats,
+            # Wall clock deadline for the display countdown
+            "expira_em": time.time() + max(0.0, self.prazo(ociosa, duracao_max) - time.monotonic()),
+        }
+
+
+class SessionBatcher:
+    """Per-channel sessions closed by confirmation, idle window or maximum duration.
+
+    cotar(total_brl) returns the provisional quote in sats. on_nota(resumo) is
+    called with the lock held right after a note joins a session (for
+    journaling; it must not block), and on_fechar(resumo, motivo) once per
+    session from outside the lock. One thread waits for the earliest deadline.
+    """
+
+    def __init__(self, on_fechar, cotar, ociosa=30.0, duracao_max=300.0, on_nota=None):
+        self.on_fechar = on_fechar
+        self.cotar = cotar
+        self.ociosa = ociosa
+        self.duracao_max = duracao_max
+        self.on_nota = on_nota
+        self._sessoes = {}  # canal -> Sessao
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition(self._lock)
+        self._parar = False
+        self._thread = None
+
+    def adicionar(self, canal, valor, pulsos=None, ident=None):
+        """Add a note to the channel's session (opening one if needed); returns its summary"""
+        with self._mudou:
+            sessao = self._sessoes.get(canal)
+            if sessao is None:
+                sessao = self._sessoes[canal] = Sessao(canal)
+            sessao.notas.append((valor, pulsos, ident))
+            sessao.total += valor
+            sessao.sats = self.cotar(sessao.total)
+            sessao.ultima_nota = time.monotonic()
+            resumo = sessao.resumo(self.ociosa, self.duracao_max)
+            if self.on_nota:
+                self.on_nota(resumo)
+            self._mudou.notify()
+        return resumo
+
+    def confirmar(self, canal=None):
+        """Close the channel's session (or every session) now; returns how many were closed"""
+        return len(self._fechar(canal, "confirmada"))
+
+    def descartar(self, canal=None):
+        """Drop sessions without a withdraw (operator reset); returns their summaries"""
+        with self._mudou:
+            canais = [canal] if canal is not None else list(self._sessoes)
+            sessoes = [self._sessoes.pop(c) for c in canais if c in self._sessoes]
+            self._mudou.notify()
+        return [s.resumo(self.ociosa, self.duracao_max) for s in sessoes]
+
+    def recotar(self):
+        """Re-quote every open session (new price); returns the updated summaries"""
+        with self._lock:
+            for sessao in self._sessoes.values():
+                sessao.sats = self.cotar(sessao.total)
+            return [s.resumo(self.ociosa, self.duracao_max) for s in self._sessoes.values()]
+
+    def abertas(self):
+        with self._lock:
+            return [s.resumo(self.ociosa, self.duracao_max) for s in self._sessoes.values()]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="sessoes", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the deadline thread (open sessions stay in the journal and close on restart)"""
+        with self._mudou:
+            self._parar = True
+            self._mudou.notify()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _fechar(self, canal, motivo, ate=None):
+        # Pop under the lock, call back outside it: a note arriving meanwhile opens a new session
+        with self._mudou:
+            canais = [canal] if canal is not None else list(self._sessoes)
+            fechadas = []
+            for c in canais:
+                sessao = self._sessoes.get(c)
+                if sessao and (ate is None or sessao.prazo(self.ociosa, self.duracao_max) <= ate):
+                    fechadas.append((self._sessoes.pop(c), motivo))
+        for sessao, motivo in fechadas:
+            if motivo == "prazo":
+                ociosa = sessao.ultima_nota + self.ociosa <= sessao.aberta_em + self.duracao_max
+                motivo = "ociosa" if ociosa else "duracao"
+            METRICA_FECHADAS.inc(motivo=motivo)
+            METRICA_NOTAS_SESSAO.observe(len(sessao.notas))
+            try:
+                self.on_fechar(sessao.resumo(self.ociosa, self.duracao_max), motivo)
+            except Exception as e:
+                print(f"❌ Erro ao fechar sessão {sessao.ident}: {e}")
+        return fechadas
+
+    def _loop(self):
+        while True:
+            with self._mudou:
+                if self._parar:
+                    return
+                prazos = [s.prazo(self.ociosa, self.duracao_max) for s in self._sessoes.values()]
+                espera = min(prazos) - time.monotonic() if prazos else None
+                if espera is None or espera > 0:
+                    self._mudou.wait(espera)
+                    continue
+            self._fechar(None, "prazo", ate=time.monotonic())
@@ -3,4 +3,5 @@
 
 cd /home/dennytorresrbp/Desktop/atmDenny/simple-noteiro
 source venv/bin/activate
+python3 asset_bundle.py  # Bundle comprimido e com cache longo (dist/)
 python3 app.py
\ No newline at end of file
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Startup Phases
+Times the backend's staged startup and its background readiness milestones
+
+Phases run in order on the main thread (pulse capture first); slow,
+network-dependent ones run in the background with em_segundo_plano() and
+report when they finish. Every duration is measured from process start.
+"""
+
+import contextlib
+import threading
+import time
+
+from metrics import REGISTRO
+
+METRICA_FASE = REGISTRO.medidor("atm_inicio_fase_segundos", "Duração de cada fase da inicialização", ("fase",))
+METRICA_MARCO = REGISTRO.medidor("atm_inicio_marco_segundos",
+                                 "Segundos desde o início do processo até cada marco", ("marco",))
+
+
+class StartupPhases:
+    """Phase durations and one-shot milestones, relative to `inicio` (time.monotonic())"""
+
+    def __init__(self, inicio=None):
+        self.inicio = inicio if inicio is not None else time.monotonic()
+        self.fases = {}  # nome -> duration (s)
+        self.marcos = {}  # nome -> seconds since process start
+        self._lock = threading.Lock()
+
+    def decorrido(self):
+        return time.monotonic() - self.inicio
+
+    @contextlib.contextmanager
+    def fase(self, nome):
+        """Time a startup phase (errors still propagate)"""
+        comeco = time.monotonic()
+        try:
+            yield
+        finally:
+            duracao = time.monotonic() - comeco
+            with self._lock:
+                self.fases[nome] = duracao
+            METRICA_FASE.set(duracao, fase=nome)
+
+    def marco(self, nome):
+        """Record a milestone the first time it is reached; returns its time, or None if already reached"""
+        with self._lock:
+            if nome in self.marcos:
+                return None
+            self.marcos[nome] = self.decorrido()
+        METRICA_MARCO.set(self.marcos[nome], marco=nome)
+        print(f"⏱️  {nome}: {self.marcos[nome]:.3f}s desde o início")
+        return self.marcos[nome]
+
+    def em_segundo_plano(self, nome, funcao):
+        """Run a phase on its own thread; the milestone `nome` is set when it completes"""
+        def executar():
+            try:
+                with self.fase(nome):
+                    funcao()
+            except Exception as e:
+                print(f"⚠️  Fase '{nome}' falhou: {e}")
+                return
+            self.marco(nome)
+
+        thread = threading.Thread(target=executar, name=f"inicio-{nome}", daemon=True)
+        thread.start()
+        return thread
+
+    def relatorio(self):
+        """One line per phase and milestone, in the order they happened"""
+        with self._lock:
+            fases = list(self.fases.items())
+            marcos = sorted(self.marcos.items(), key=lambda item: item[1])
+        linhas = [f"   {nome:<16} {duracao * 1000:8.1f} ms" for nome, duracao in fases]
+        linhas += [f"   ✔ {nome:<14} {momento:8.3f} s" for nome, momento in marcos]
+        return "\n".join(linhas)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Display State Store
+Versioned, lock-protected display state shared by every server thread
+
+Every mutation is a transition: applied, versioned and published to the SSE
+subscribers under one lock, so version N always means the same state for
+/api/status, the event stream and the ETag. The JSON body of the current
+version is serialized once and reused by every poll.
+"""
+
+import copy
+import json
+import queue
+import secrets
+import threading
+
+
+class StateStore:
+    """Display state as a dict plus a version bumped on every transition.
+
+    ao_mudar(anterior, novo) is called with the lock held after each
+    transition (keep it short and never call back into the store); the
+    frontend uses it to follow the link on display.
+    """
+
+    def __init__(self, inicial, ao_mudar=None, fila_max=100):
+        self._estado = dict(inicial)
+        self._versao = 0
+        self._lock = threading.Lock()
+        self._assinantes = []  # One queue per connected display
+        self._corpo = None  # (versao, JSON bytes) of the last serialized state
+        self.ao_mudar = ao_mudar
+        self.fila_max = fila_max
+        self.ressincronizados = 0  # Subscribers whose full queue was replaced by a snapshot
+        # Versions restart at 0 with the process: the boot id keeps old ETags from matching
+        self._boot = secrets.token_hex(4)
+
+    @property
+    def versao(self):
+        return self._versao
+
+    def obter(self, campo=None):
+        """Copy of the current state (or one field of it)"""
+        with self._lock:
+            if campo is not None:
+                return copy.deepcopy(self._estado.get(campo))
+            return copy.deepcopy(self._estado)
+
+    def transicao(self, tipo, mudancas, se=None):
+        """Apply `mudancas` and publish them as event `tipo`; None if `se(estado)` says no, else the new version"""
+        with self._lock:
+            if se is not None and not se(self._estado):
+                return None
+            anterior = self._estado
+            self._estado = dict(anterior, **copy.deepcopy(mudancas))
+            return self._publicar(tipo, mudancas, anterior)
+
+    def substituir(self, tipo, novo, se=None):
+        """Replace the whole state (reset); published in full"""
+        with self._lock:
+            if se is not None and not se(self._estado):
+                return None
+            anterior = self._estado
+            self._estado = copy.deepcopy(novo)
+            return self._publicar(tipo, novo, anterior)
+
+    def etag(self, versao=None):
+        return f'W/"{self._boot}-{self._versao if versao is None else versao}"'
+
+    def corpo(self):
+        """(etag, JSON bytes) of the current state, serialized once per version"""
+        with self._lock:
+            if self._corpo is None or self._corpo[0] != self._versao:
+                self._corpo = (self._versao, json.dumps(self._estado).encode())
+            return self.etag(self._corpo[0]), self._corpo[1]
+
+    def assinar(self, limite=None):
+        """New subscriber queue plus (version, JSON) of the state it starts from; None at `limite` subscribers"""
+        fila = queue.Queue(maxsize=self.fila_max)
+        with self._lock:
+            if limite is not None and len(self._assinantes) >= limite:
+                return None
+            self._assinantes.append(fila)
+            return fila, self._versao, json.dumps(self._estado)
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.remove(fila)
+
+    def assinantes(self):
+        with self._lock:
+            return len(self._assinantes)
+
+    @staticmethod
+    def _descartar(fila):
+        while True:
+            try:
+                fila.get_nowait()
+            except queue.Empty:
+                return
+
+    def _publicar(self, tipo, dados, anterior):
+        # Called with the lock held
+        self._versao += 1
+        evento = (self._versao, tipo, json.dumps(dados))
+        completo = None
+        for fila in self._assinantes:
+            try:
+                fila.put_nowait(evento)
+            except queue.Full:
+                # Slow display: its backlog is replaced by the full state (an "estado"
+                # event resyncs it) and later deltas follow from there
+                if completo is None:
+                    completo = (self._versao, "estado", json.dumps(self._estado))
+                self._descartar(fila)
+                fila.put_nowait(completo)
+                self.ressincronizados += 1
+        if self.ao_mudar:
+            try:
+                self.ao_mudar(anterior, self._estado)
+            except Exception as e:
+                print(f"⚠️  Erro ao acompanhar mudança de estado: {e}")
+        return self._versao
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Withdraw Link Pool
+Pre-created single-use withdraw links per denomination, replenished in the background
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+
+class WithdrawPool:
+    """Warm pool of withdraw links keyed by BRL denomination.
+
+    `criar_links([(valor_brl, amount_sats), ...])` must return one withdraw
+    dict or None per pair (LightningProvider.criar_links), so a whole refill
+    goes out as one concurrent batch; `cotar(valor_brl)` returns the
+    current amount in sats, or None while no trustworthy quote exists (the
+    pool then neither serves nor creates links). Links whose amount drifts
+    more than `tolerancia` from the current quote are removed through
+    `apagar_link(withdraw_id)`.
+
+    Pooled links are live claims against the wallet, so the pool file must
+    be readable only by the ATM user.
+    """
+
+    def __init__(self, criar_links, cotar, apagar_link=None, denominacoes=(), tamanho=2,
+                 tolerancia=0.01, intervalo=30, arquivo=None):
+        self.criar_links = criar_links
+        self.cotar = cotar
+        self.apagar_link = apagar_link
+        self.denominacoes = sorted(set(denominacoes))
+        self.tamanho = tamanho
+        self.tolerancia = tolerancia
+        self.intervalo = intervalo
+        self.arquivo = arquivo
+        self._links = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._salvar_lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self.acertos = 0
+        self.faltas = 0
+        self.invalidados = 0
+        self._carregar()
+
+    def retirar(self, valor_brl):
+        """Pop a ready link for this denomination (None if the pool is empty)"""
+        cotacao_atual = self.cotar(valor_brl)
+        if not cotacao_atual:
+            return None
+        with self._lock:
+            fila = self._links.get(valor_brl)
+            while fila:
+                link = fila.popleft()
+                if self._dentro_tolerancia(link, cotacao_atual):
+                    self.acertos += 1
+                    break
+                self._descartar(link)
+            else:
+                link = None
+                self.faltas += 1
+
+        self._acordar.set()  # Replenish in the background
+        if link is not None:
+            self._salvar()
+        return link
+
+    def disponiveis(self):
+        """Ready links per denomination"""
+        with self._lock:
+            return {valor: len(self._links.get(valor, ())) for valor in self.denominacoes}
+
+    def start(self):
+        """Start the background replenisher"""
+        self._thread = threading.Thread(target=self._loop, name="pool-saques", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def repor(self):
+        """Drop links off the current quote and top every denomination up to `tamanho`"""
+        self._revalidar()
+
+        pedidos = []
+        for valor in self.denominacoes:
+            with self._lock:
+                faltam = self.tamanho - len(self._links[valor])
+            if faltam <= 0:
+                continue
+            amount_sats = self.cotar(valor)
+            if not amount_sats:
+                return False  # No trustworthy quote yet
+            pedidos.extend([(valor, amount_sats)] * faltam)
+        if not pedidos or self._parar.is_set():
+            return False
+
+        # Links that failed (LNbits unavailable) are simply asked for again next cycle
+        criados = [link for link in self.criar_links(pedidos) if link]
+        for link in criados:
+            link["criado_em"] = time.time()
+            with self._lock:
+                self._links[link["amount_brl"]].append(link)
+
+        if criados:
+            self._salvar()
+        return bool(criados)
+
+    def _revalidar(self):
+        removidos = 0
+        for valor in self.denominacoes:
+            cotacao_atual = self.cotar(valor)
+            if not cotacao_atual:
+                continue
+            with self._lock:
+                fila = self._links[valor]
+                validos = [link for link in fila if self._dentro_tolerancia(link, cotacao_atual)]
+                for link in fila:
+                    if link not in validos:
+                        self._descartar(link)
+                        removidos += 1
+                self._links[valor] = collections.deque(validos)
+        if removidos:
+            print(f"♻️  {removidos} links do pool re-precificados (cotação mudou)")
+            self._salvar()
+
+    def _dentro_tolerancia(self, link, cotacao_atual):
+        return abs(link["amount_sats"] - cotacao_atual) / cotacao_atual <= self.tolerancia
+
+    def _descartar(self, link):
+        self.invalidados += 1
+        if self.apagar_link:
+            # Deleting over the network must not hold the pool lock for long
+            threading.Thread(target=self.apagar_link, args=(link["withdraw_id"],), daemon=True).start()
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                self.repor()
+            except Exception as e:
+                print(f"⚠️  Erro ao repor pool de saques: {e}")
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+    def _carregar(self):
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return
+        try:
+            with open(self.arquivo) as f:
+                data = json.load(f)
+            for link in data.get("links", []):
+                if link["amount_brl"] in self.denominacoes:
+                    self._links[link["amount_brl"]].append(link)
+            print(f"💾 Pool de saques carregado: {sum(map(len, self._links.values()))} links")
+        except Exception as e:
+            print(f"⚠️  Erro ao carregar pool de saques: {e}")
+
+    def _salvar(self):
+        if not self.arquivo:
+            return
+        with self._lock:
+            links = [link for fila in self._links.values() for link in fila]
+        tmp = f"{self.arquivo}.tmp"
+        try:
+            with self._salvar_lock:
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"links": links}, f)
+                os.replace(tmp, self.arquivo)
+        except Exception as e:
+            print(f"⚠️  Erro ao salvar pool de saques: {e}")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+ATM Bitcoin Lightning - Offline Withdraw Queue
+Durable record of withdraws owed while LNbits is unreachable, replayed in batches once it answers
+
+The customer leaves with a claim token (and a QR of its claim URL) instead of
+a link; the real withdraw link is created later and delivered under that token.
+
+Spool file, one JSON record per line:
+  {"op": "novo", "token": ..., "valor_brl": ..., "amount_sats": ..., "criado_em": ...}
+  {"op": "link", "token": ..., "lnurl": ..., "withdraw_id": ...}
+  {"op": "entregue", "token": ...}
+  {"op": "recusado", "token": ..., "erro": ...}
+"""
+
+import collections
+import json
+import os
+import secrets
+import threading
+import time
+
+ALFABETO_TOKEN = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"  # No 0/O, 1/I/L: read aloud or typed by hand
+
+
+def gerar_token(tamanho=12, grupo=4):
+    """Random claim token in groups, e.g. 'K7QM-3XRA-PW9D' (~59 bits)"""
+    letras = "".join(secrets.choice(ALFABETO_TOKEN) for _ in range(tamanho))
+    return "-".join(letras[i:i + grupo] for i in range(0, tamanho, grupo))
+
+
+class WithdrawQueue:
+    """Owed withdraws kept in an fsynced spool until their link is created and delivered.
+
+    enfileirar() only appends to the spool, so accepting notes during an
+    outage runs at full acceptor speed. A replay thread hands up to `lote`
+    entries per round to `criar_links([(valor_brl, amount_sats), ...])` (one
+    withdraw dict or None per pair, see LightningProvider.criar_links),
+    backing off exponentially while every creation fails. A pair answered
+    with an exception instance was refused for good (e.g. LNbits 4xx): that
+    entry stops being replayed and is kept for the operator (recusadas()).
+    on_pronto(entrada) must return True once the link reached the claim
+    page; until then the entry is retried on every round.
+
+    Like the withdraw pool, the spool holds live claims: readable only by the
+    ATM user.
+    """
+
+    def __init__(self, criar_links, arquivo=None, on_pronto=None, lote=10, intervalo=5.0, espera_max=300.0):
+        self.criar_links = criar_links
+        self.arquivo = arquivo
+        self.on_pronto = on_pronto
+        self.lote = lote
+        self.intervalo = intervalo
+        self.espera_max = espera_max
+        self._entradas = collections.OrderedDict()  # token -> entry, in acceptance order
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self.offline = False  # Last attempt failed: new withdraws skip LNbits and queue directly
+        self.enfileirados = 0
+        self.criados = 0
+        self.falhas = 0
+        self.recusados = 0
+        self._carregar()
+
+    def enfileirar(self, valor_brl, amount_sats):
+        """Record an owed withdraw; returns its entry (with the claim token) immediately"""
+        entrada = {"token": gerar_token(), "valor_brl": valor_brl, "amount_sats": amount_sats,
+                   "criado_em": time.time()}
+        with self._lock:
+            while entrada["token"] in self._entradas:
+                entrada["token"] = gerar_token()
+            self._entradas[entrada["token"]] = entrada
+            self._anexar(dict(entrada, op="novo"))
+            self.enfileirados += 1
+            self.offline = True  # Until a replay round gets a link through
+        return dict(entrada)
+
+    def pendentes(self):
+        """Entries still waiting for their link"""
+        with self._lock:
+            return sum(1 for e in self._entradas.values() if "lnurl" not in e and "recusado" not in e)
+
+    def recusadas(self):
+        """Entries the provider refused for good: still owed, settled by the operator"""
+        with self._lock:
+            return [dict(e) for e in self._entradas.values() if "recusado" in e]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="fila-saques", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop replaying (everything still owed stays in the spool)"""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def repetir(self):
+        """One replay round: deliver ready links, then create the next batch; False if every request failed"""
+        with self._lock:
+            prontas = [dict(e) for e in self._entradas.values() if "lnurl" in e]
+            lote = [dict(e) for e in self._entradas.values()
+                    if "lnurl" not in e and "recusado" not in e][:self.lote]
+
+        for entrada in prontas:
+            self._entregar(entrada)
+        if not lote:
+            self.offline = False
+            return True
+
+        resultados = self.criar_links([(e["valor_brl"], e["amount_sats"]) for e in lote])
+        recusados = 0
+        for entrada, resultado in zip(lote, resultados):
+            if isinstance(resultado, Exception):
+                self._recusar(entrada, resultado)
+                recusados += 1
+            elif resultado:
+                entrada.update(lnurl=resultado["lnurl"], withdraw_id=resultado["withdraw_id"])
+                with self._lock:
+                    if entrada["token"] in self._entradas:
+                        self._entradas[entrada["token"]].update(lnurl=entrada["lnurl"],
+                                                                withdraw_id=entrada["withdraw_id"])
+                    self._anexar({"op": "link", "token": entrada["token"], "lnurl": entrada["lnurl"],
+                                  "withdraw_id": entrada["withdraw_id"]})
+                self._entregar(entrada)
+
+        criados = sum(1 for r in resultados if r and not isinstance(r, Exception))
+        falhas = len(resultados) - criados - recusados
+        self.criados += criados
+        self.falhas += falhas
+        # A refusal is still an answer: only unreachable (None) results keep the queue offline
+        self.offline = criados == 0 and falhas > 0
+        if criados:
+            print(f"📤 Fila de saques: {criados}/{len(lote)} links criados ({self.pendentes()} pendentes)")
+        return not self.offline
+
+    def _recusar(self, entrada, erro):
+        with self._lock:
+            if entrada["token"] not in self._entradas:
+                return
+            self._entradas[entrada["token"]]["recusado"] = str(erro)
+            self._anexar({"op": "recusado", "token": entrada["token"], "erro": str(erro)})
+            self.recusados += 1
+        print(f"❌ Resgate {entrada['token']} (R$ {entrada['valor_brl']:.2f}) recusado: {erro} "
+              f"- não será repetido, acertar manualmente")
+
+    def _entregar(self, entrada):
+        try:
+            entregue = self.on_pronto(entrada) if self.on_pronto else True
+        except Exception as e:
+            print(f"⚠️  Erro ao entregar resgate {entrada['token']}: {e}")
+            entregue = False
+        if entregue:
+            with self._lock:
+                self._entradas.pop(entrada["token"], None)
+                self._anexar({"op": "entregue", "token": entrada["token"]})
+                if all("recusado" in e for e in self._entradas.values()):
+                    self._reescrever()
+
+    def _loop(self):
+        espera = self.intervalo
+        while not self._parar.is_set():
+            self._acordar.wait(espera)
+            self._acordar.clear()
+            if self._parar.is_set():
+                break
+            try:
+                ok = self.repetir()
+            except Exception as e:
+                print(f"⚠️  Erro na fila de saques: {e}")
+                ok = False
+            if not ok:
+                espera = min(max(espera, self.intervalo) * 2, self.espera_max)  # Still offline: back off
+            elif self.pendentes():
+                espera = 0  # Back online: drain the backlog batch after batch
+            else:
+                espera = self.intervalo
+
+    def _anexar(self, registro):
+        # Called with the lock held
+        if not self.arquivo:
+            return
+        try:
+            fd = os.open(self.arquivo, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            with os.fdopen(fd, "a") as f:
+                f.write(json.dumps(registro) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"⚠️  Erro ao gravar fila de saques: {e}")
+
+    def _reescrever(self):
+        # Called with the lock held; only once nothing is left to replay (refused entries are
+        # rewritten with their reason), so a crash never loses an entry
+        if not self.arquivo:
+            return
+        try:
+            tmp = f"{self.arquivo}.tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                for entrada in self._entradas.values():
+                    f.write(json.dumps(dict(entrada, op="novo")) + "\n")
+            os.replace(tmp, self.arquivo)
+        except OSError as e:
+            print(f"⚠️  Erro ao compactar fila de saques: {e}")
+
+    def _carregar(self):
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return
+        try:
+            with open(self.arquivo) as f:
+                for linha in f:
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    op = registro.pop("op", None)
+                    token = registro.get("token")
+                    if op == "novo":
+                        self._entradas[token] = registro
+                    elif op == "link" and token in self._entradas:
+                        self._entradas[token].update(lnurl=registro["lnurl"], withdraw_id=registro["withdraw_id"])
+                    elif op == "recusado" and token in self._entradas:
+                        self._entradas[token]["recusado"] = registro.get("erro")
+                    elif op == "entregue":
+                        self._entradas.pop(token, None)
+            if self.pendentes():
+                self.offline = True  # Replay before trusting LNbits again
+                print(f"💾 Fila de saques: {len(self._entradas)} saques devidos recuperados")
+        except OSError as e:
+            print(f"⚠️  Erro ao ler fila de saques: {e}")